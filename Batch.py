@@ -0,0 +1,224 @@
+import os
+import io
+import glob
+import time
+import traceback
+import json
+from contextlib import redirect_stdout, contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import CsbFile
+import CtbFile
+from CsbExporter import Export
+from GlbExporter import ExportGlb
+from PlyExporter import ExportPly
+from CsbImporter import ImportScene, GenerateCsbBytes
+from OutputCache import OutputCache
+from GeometryCleanup import WeldVertices, CullTriangles
+from OctreeTuning import TuneParameters
+
+Extensions = ('.csb', '.dae', '.glb')
+
+#-format choices for exported .csb files
+Exporters = {'dae': Export, 'glb': ExportGlb, 'ply': ExportPly}
+
+def IsPattern(pattern: str) -> bool:
+    return any(c in pattern for c in '*?[')
+
+def CollectFiles(patterns: list[str]) -> list[(str, str)]:
+    #Expands files, directories (searched recursively) and glob patterns into (path, relative path) pairs,
+    #the relative path keeps the folder layout below a directory argument for the output directory
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, names in os.walk(pattern):
+                for name in sorted(names):
+                    if name.lower().endswith(Extensions):
+                        path = os.path.join(root, name)
+                        files.append((path, os.path.relpath(path, pattern)))
+        elif IsPattern(pattern):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path) and path.lower().endswith(Extensions):
+                    files.append((path, os.path.basename(path)))
+        else:
+            files.append((pattern, os.path.basename(pattern)))
+
+    #the same file named twice only gets processed once
+    seen = set()
+    unique = []
+    for path, relative in files:
+        key = os.path.realpath(path)
+        if not key in seen:
+            seen.add(key)
+            unique.append((path, relative))
+    return unique
+
+@contextmanager
+def Stage(stages: dict, name: str):
+    #Adds the time spent in the block to the named stage
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+def OutputBase(path: str, relative: str, outputDir: str) -> str:
+    #Output path without extension, next to the input unless an output directory is given
+    if outputDir is None:
+        return path[:-4]
+    base = os.path.join(outputDir, relative[:-4])
+    os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+    return base
+
+def Tune(csb: CsbFile.CsbFile, options: dict, stages: dict, result: dict) -> (int, int):
+    #Octree settings for the file's .ctb, the given ones or the auto-tuned ones
+    if not options['auto_tune']:
+        return options['max_triangles'], options['max_depth']
+    with Stage(stages, 'tune'):
+        maxTriangles, maxDepth = TuneParameters(csb, options['ctb_budget'])
+    result['Octree'] = {'max_triangles': maxTriangles, 'max_depth': maxDepth}
+    return maxTriangles, maxDepth
+
+def ProcessFile(path: str, relative: str, outputDir: str, options: dict) -> dict:
+    #Runs what main.py does for one file, never raises so one bad file can't stop the batch
+    result = {'File': path, 'Size': 0, 'Outputs': {}, 'Stages': {}, 'Error': None}
+    stages = {}
+    try:
+        result['Size'] = os.path.getsize(path)
+        base = OutputBase(path, relative, outputDir)
+        outputs = []
+
+        #the library reports progress with print, keep the batch output to one line per file
+        with redirect_stdout(io.StringIO()):
+            cache = OutputCache(options['cache'], options['cache_size'] * 1024 * 1024) if options['cache'] else None
+            
+            if path.lower().endswith('.csb') and options['ctb']:
+                with Stage(stages, 'read'):
+                    csb = CsbFile.Open(path, options['big_endian'])
+                with csb:
+                    with Stage(stages, 'read'):
+                        csb.Models[0].Geometry
+                    maxTriangles, maxDepth = Tune(csb, options, stages, result)
+                    with Stage(stages, 'ctb'):
+                        data = CtbFile.GenerateBytes(csb, options['big_endian'], options['exact'], 1, options['grid'], maxTriangles, maxDepth, cache)
+                if data:
+                    with Stage(stages, 'write'):
+                        with open(f'{base}_output.ctb', 'wb') as file:
+                            file.write(data)
+                    outputs.append(f'{base}_output.ctb')
+            elif path.lower().endswith('.csb'):
+                with Stage(stages, 'read'):
+                    csb = CsbFile.Open(path, False)
+                with csb:
+                    with Stage(stages, 'read'):
+                        for model in csb.Models:
+                            model.Geometry
+                    with Stage(stages, 'export'):
+                        Exporters[options['format']](csb, f"{base}.{options['format']}")
+                outputs.append(f"{base}.{options['format']}")
+            elif path.lower().endswith(('.dae', '.glb')):
+                with Stage(stages, 'import'):
+                    csb = ImportScene(path, options['map_object'])
+                if options['weld'] is not None:
+                    with Stage(stages, 'weld'):
+                        WeldVertices(csb, options['weld'], options['weld_combined'])
+                if options['cull']:
+                    with Stage(stages, 'cull'):
+                        result['Culled'] = CullTriangles(csb, checkNormals=options['cull_normals'])
+                maxTriangles, maxDepth = Tune(csb, options, stages, result)
+                key = None
+                with Stage(stages, 'write'):
+                    if cache is None:
+                        with open(f'{base}_output.csb', 'wb') as file:
+                            csb.WriteTo(file, False)
+                    else:
+                        key = cache.Key(csb, CtbFile.CacheParameters(options['exact'], maxTriangles, maxDepth), False)
+                        with open(f'{base}_output.csb', 'wb') as file:
+                            file.write(GenerateCsbBytes(csb, cache, key))
+                outputs.append(f'{base}_output.csb')
+                with Stage(stages, 'ctb'):
+                    data = CtbFile.GenerateBytes(csb, False, options['exact'], 1, options['grid'], maxTriangles, maxDepth, cache, key)
+                if data:
+                    with Stage(stages, 'write'):
+                        with open(f'{base}_output.ctb', 'wb') as file:
+                            file.write(data)
+                    outputs.append(f'{base}_output.ctb')
+            else:
+                raise ValueError('not a .csb, .dae or .glb file')
+
+        result['Outputs'] = {output: os.path.getsize(output) for output in outputs}
+    except Exception as e:
+        result['Error'] = f'{type(e).__name__}: {e}'
+        result['Traceback'] = traceback.format_exc()
+    result['Stages'] = stages
+    return result
+
+def FormatSize(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}GB'
+
+def PrintResult(result: dict):
+    stages = ' '.join(f'{name} {seconds:.2f}s' for name, seconds in result['Stages'].items())
+    if result['Error'] is None:
+        outputs = ', '.join(f'{os.path.basename(output)} {FormatSize(size)}' for output, size in result['Outputs'].items())
+        print(f"ok     {result['File']} ({FormatSize(result['Size'])}) {stages} -> {outputs}")
+    else:
+        print(f"FAILED {result['File']} ({FormatSize(result['Size'])}) {stages} {result['Error']}")
+
+def RunBatch(files: list[(str, str)], options: dict, jobs: int = 1, outputDir: str = None, summaryPath: str = None) -> list[dict]:
+    #Largest files first so a big file started last doesn't keep the pool waiting on its own
+    files = sorted(files, key=lambda file: os.path.getsize(file[0]) if os.path.isfile(file[0]) else 0, reverse=True)
+
+    start = time.perf_counter()
+    results = []
+    if jobs <= 1:
+        for path, relative in files:
+            results.append(ProcessFile(path, relative, outputDir, options))
+            PrintResult(results[-1])
+    else:
+        #A worker dying outright (out of memory, ...) breaks the whole pool and fails every file still in it.
+        #The file that killed it can't be told apart from the ones queued with it, so each of them
+        #gets one more try alone in a fresh single worker pool and only the culprit ends up failed.
+        broken = []
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(ProcessFile, path, relative, outputDir, options): (path, relative) for path, relative in files}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                    PrintResult(results[-1])
+                except BrokenProcessPool:
+                    broken.append(futures[future])
+        for path, relative in broken:
+            try:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    results.append(pool.submit(ProcessFile, path, relative, outputDir, options).result())
+            except BrokenProcessPool:
+                size = os.path.getsize(path) if os.path.isfile(path) else 0
+                results.append({'File': path, 'Size': size, 'Outputs': {}, 'Stages': {}, 'Error': 'worker process died'})
+            PrintResult(results[-1])
+
+    elapsed = time.perf_counter() - start
+    PrintSummary(results, elapsed)
+    if summaryPath is not None:
+        with open(summaryPath, 'w') as file:
+            json.dump({'Elapsed': elapsed, 'Jobs': jobs, 'Files': results}, file, indent=4)
+    return results
+
+def PrintSummary(results: list[dict], elapsed: float):
+    failed = [result for result in results if result['Error'] is not None]
+    stages = {}
+    for result in results:
+        for name, seconds in result['Stages'].items():
+            stages[name] = stages.get(name, 0.0) + seconds
+
+    print()
+    print(f'{len(results) - len(failed)} of {len(results)} files done in {elapsed:.2f}s')
+    print(f"    read {FormatSize(sum(result['Size'] for result in results))}, wrote {FormatSize(sum(sum(result['Outputs'].values()) for result in results))}")
+    if stages:
+        print('    ' + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in stages.items()))
+    for result in failed:
+        print(f"    failed: {result['File']} – {result['Error']}")
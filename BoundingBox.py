@@ -1,28 +1,53 @@
 from struct import unpack_from
+import numpy as np
 
 class BoundingBox:
+    #Min and Max are (x, y, z) tuples, both None while the box is empty
     Min = None
     Max = None
-    
+
+    def __init__(self, min: tuple = None, max: tuple = None):
+        self.Min = None if min is None else tuple(min)
+        self.Max = None if max is None else tuple(max)
+
     def Read(self, reader: bytearray, readOffset: int, byteOrder: str):
         self.Min = unpack_from(f'{byteOrder}3f', reader, offset=readOffset)
         readOffset += 12
         self.Max = unpack_from(f'{byteOrder}3f', reader, offset=readOffset)
-    
+
     # def Write(self):
-    
+
+    @staticmethod
+    def FromArray(positions: np.ndarray) -> 'BoundingBox':
+        box = BoundingBox()
+        box.Compute(positions)
+        return box
+
+    def IsEmpty(self) -> bool:
+        return self.Min is None
+
     def Compute(self, positions: list):
-        minX = maxX = positions[0][0]
-        minY = maxY = positions[0][1]
-        minZ = maxZ = positions[0][2]
-        
-        for i in range(1,len(positions)):
-            minX = min(minX, positions[i][0])
-            minY = min(minY, positions[i][1])
-            minZ = min(minZ, positions[i][2])
-            maxX = max(maxX, positions[i][0])
-            maxY = max(maxY, positions[i][1])
-            maxZ = max(maxZ, positions[i][2])
-        
-        self.Min = (minX, minY, minZ)
-        self.Max = (maxX, maxY, maxZ)
\ No newline at end of file
+        positions = np.asarray(positions).reshape(-1, 3)
+        if len(positions) == 0:
+            self.Min = self.Max = None
+            return
+
+        self.Min = tuple(positions.min(axis=0).tolist())
+        self.Max = tuple(positions.max(axis=0).tolist())
+
+    def Expand(self, other: 'BoundingBox') -> 'BoundingBox':
+        #Grows this box to also hold other, a running accumulator starts as an empty BoundingBox()
+        if other.IsEmpty():
+            return self
+        if self.IsEmpty():
+            self.Min, self.Max = other.Min, other.Max
+        else:
+            self.Min = tuple(map(min, self.Min, other.Min))
+            self.Max = tuple(map(max, self.Max, other.Max))
+        return self
+
+    def ExpandPositions(self, positions: np.ndarray) -> 'BoundingBox':
+        return self.Expand(BoundingBox.FromArray(positions))
+
+    def Union(self, other: 'BoundingBox') -> 'BoundingBox':
+        return BoundingBox(self.Min, self.Max).Expand(other)
@@ -0,0 +1,292 @@
+from CsbFile import CsbFile
+import TriangleHelper
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+def ModelMatrix(model: CsbFile.Model) -> (np.ndarray, np.ndarray):
+    #Rotation matrix and translation of a split model, same order as the exporter (translate, rotate z, y, x)
+    rotation = Rotation.from_euler('xyz', model.Rotation if model.Rotation is not None else (0, 0, 0)).as_matrix()
+    translation = np.asarray(model.Translate if model.Translate is not None else (0, 0, 0), dtype=np.float64)
+    return rotation, translation
+
+def MortonCodes(points: np.ndarray, low: np.ndarray, extent: np.ndarray, bits: int = 10) -> np.ndarray:
+    #Interleaved bits of the points quantized into the box at low, points outside are clamped to it
+    cells = np.clip((points - low) / extent * ((1 << bits) - 1), 0, (1 << bits) - 1).astype(np.int64)
+    code = np.zeros(len(points), dtype=np.int64)
+    for bit in range(bits):
+        for axis in range(3):
+            code |= ((cells[:, axis] >> bit) & 1) << (3 * bit + axis)
+    return code
+
+def BoxDistance(points: np.ndarray, boxMin: np.ndarray, boxMax: np.ndarray) -> np.ndarray:
+    #Distance from every point to its box, 0 inside
+    return np.linalg.norm(np.maximum(np.maximum(boxMin - points, points - boxMax), 0), axis=1)
+
+def BoxFarthest(points: np.ndarray, boxMin: np.ndarray, boxMax: np.ndarray) -> np.ndarray:
+    #Distance from every point to the farthest corner of its box, nothing inside the box is farther
+    return np.linalg.norm(np.maximum(np.abs(points - boxMin), np.abs(points - boxMax)), axis=1)
+
+class Hits:
+    #Results of a batched query, one entry per ray/point. Misses have Triangle -1, Distance inf,
+    #nan Position and Normal, an empty MeshName and -1 ColFlag and MaterialAttribute.
+    def __init__(self, count: int):
+        self.Triangle = np.full(count, -1, dtype=np.int64) #index into CollisionBvh.Vertices
+        self.Distance = np.full(count, np.inf)
+        self.Position = np.full((count, 3), np.nan)
+        self.Normal = np.full((count, 3), np.nan)
+        self.MeshName = np.full(count, '', dtype=object)
+        self.ColFlag = np.full(count, -1, dtype=np.int64)
+        self.MaterialAttribute = np.full(count, -1, dtype=np.int64)
+
+    @property
+    def Hit(self) -> np.ndarray:
+        return self.Triangle >= 0
+
+class CollisionBvh:
+    #Bounding volume hierarchy over every triangle of a CsbFile: the DEADBEEF model as stored and the
+    #split models moved by their Translate/Rotation. Triangles are ordered along a Morton curve and
+    #grouped LeafSize at a time, every level above pairs up neighbouring nodes of the level below.
+
+    LeafSize = 4
+    #Queries handled per batch, bounds the memory of the query/node pairs
+    ChunkSize = 16384
+    #Query/triangle pairs tested at once
+    PairBlockSize = 1 << 18
+    #Triangles around a point along the curve that give the first closest point bound
+    NeighbourCount = 16
+
+    def __init__(self, csb: CsbFile):
+        vertices = []
+        normals = []
+        meshes = []
+        self.MeshNames = []
+        self.MeshColFlags = []
+        self.MeshMaterials = []
+        self.Models = [] #model index of every triangle
+        self.ModelTriangles = [] #triangle index inside its model
+
+        for modelIndex, model in enumerate(csb.Models):
+            geometry = model.Geometry
+            if geometry.NumTriangles == 0:
+                continue
+
+            modelVertices = geometry.TriangleVertices().astype(np.float64)
+            modelNormals = geometry.Normals.astype(np.float64)
+            meshIndex = np.zeros(geometry.NumTriangles, dtype=np.int64)
+            if len(model.Meshes) > 0:
+                for mesh in model.Meshes:
+                    meshIndex[mesh.TriangleOffset : mesh.TriangleOffset + mesh.NumTriangles] = len(self.MeshNames)
+                    self.AddMesh(mesh.Name, mesh.ColFlag, mesh.MaterialAttribute)
+            else:
+                rotation, translation = ModelMatrix(model)
+                modelVertices = modelVertices @ rotation.T + translation
+                modelNormals = modelNormals @ rotation.T
+                meshIndex[:] = len(self.MeshNames)
+                self.AddMesh(model.Name, model.ColFlag, model.MaterialAttribute)
+
+            vertices.append(modelVertices)
+            normals.append(modelNormals)
+            meshes.append(meshIndex)
+            self.Models.append(np.full(geometry.NumTriangles, modelIndex, dtype=np.int64))
+            self.ModelTriangles.append(np.arange(geometry.NumTriangles, dtype=np.int64))
+
+        self.Vertices = np.concatenate(vertices) if vertices else np.zeros((0, 3, 3))
+        self.Normals = np.concatenate(normals) if normals else np.zeros((0, 3))
+        self.Meshes = np.concatenate(meshes) if meshes else np.zeros(0, dtype=np.int64)
+        self.Models = np.concatenate(self.Models) if vertices else np.zeros(0, dtype=np.int64)
+        self.ModelTriangles = np.concatenate(self.ModelTriangles) if vertices else np.zeros(0, dtype=np.int64)
+        self.MeshNames = np.array(self.MeshNames, dtype=object)
+        self.MeshColFlags = np.array(self.MeshColFlags, dtype=np.int64)
+        self.MeshMaterials = np.array(self.MeshMaterials, dtype=np.int64)
+
+        self.Build()
+
+    def AddMesh(self, name: str, colFlag: int, materialAttribute: int):
+        self.MeshNames.append(name)
+        self.MeshColFlags.append(colFlag or 0)
+        self.MeshMaterials.append(materialAttribute or 0)
+
+    def Build(self):
+        triangleMin, triangleMax = TriangleHelper.TriangleBounds(self.Vertices)
+
+        #Leaves hold LeafSize neighbouring triangles along the curve
+        centers = (triangleMin + triangleMax) / 2
+        self.CodeLow = centers.min(axis=0) if len(centers) else np.zeros(3)
+        self.CodeExtent = np.maximum(centers.max(axis=0) - self.CodeLow, 1e-12) if len(centers) else np.ones(3)
+        codes = MortonCodes(centers, self.CodeLow, self.CodeExtent)
+        self.Order = np.argsort(codes, kind='stable')
+        self.SortedCodes = codes[self.Order]
+        self.SortedVertices = self.Vertices[self.Order]
+        starts = np.arange(0, len(self.Order), self.LeafSize)
+
+        #Levels from the leaves up to the single root, node i has children 2i and 2i + 1 on the level below
+        self.LevelMin = [np.minimum.reduceat(triangleMin[self.Order], starts)] if len(starts) else []
+        self.LevelMax = [np.maximum.reduceat(triangleMax[self.Order], starts)] if len(starts) else []
+        while self.LevelMin and len(self.LevelMin[-1]) > 1:
+            pairs = np.arange(0, len(self.LevelMin[-1]), 2)
+            self.LevelMin.append(np.minimum.reduceat(self.LevelMin[-1], pairs))
+            self.LevelMax.append(np.maximum.reduceat(self.LevelMax[-1], pairs))
+
+    def Descend(self, queries: np.ndarray, overlaps) -> (np.ndarray, np.ndarray):
+        #Walks all queries down the tree one level per step, keeping the (query, node) pairs
+        #overlaps(queries, level, nodes) accepts. Returns the accepted (query, leaf) pairs.
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        for level in reversed(range(len(self.LevelMin))):
+            keep = overlaps(queries, level, nodes)
+            queries = queries[keep]
+            nodes = nodes[keep]
+
+            if level > 0:
+                queries = np.repeat(queries, 2)
+                nodes = (nodes[:, None] * 2 + np.array([0, 1])).ravel()
+                exists = nodes < len(self.LevelMin[level - 1])
+                queries = queries[exists]
+                nodes = nodes[exists]
+        return queries, nodes
+
+    def LeafTriangles(self, queries: np.ndarray, leaves: np.ndarray):
+        #(query, sorted triangle) pairs of the given leaves, in blocks of about PairBlockSize pairs
+        counts = np.minimum(self.LeafSize, len(self.Order) - leaves * self.LeafSize)
+        cumulative = np.cumsum(counts)
+        total = int(cumulative[-1]) if len(cumulative) else 0
+        bounds = np.searchsorted(cumulative, np.arange(self.PairBlockSize, total, self.PairBlockSize), side='right')
+        bounds = np.unique(np.concatenate([[0], bounds, [len(counts)]])).tolist()
+        for blockStart, blockEnd in zip(bounds[:-1], bounds[1:]):
+            blockCounts = counts[blockStart:blockEnd]
+            local = np.arange(blockCounts.sum()) - np.repeat(np.cumsum(blockCounts) - blockCounts, blockCounts)
+            yield np.repeat(queries[blockStart:blockEnd], blockCounts), np.repeat(leaves[blockStart:blockEnd] * self.LeafSize, blockCounts) + local
+
+    def KeepClosest(self, queries: np.ndarray, triangles: np.ndarray, distances: np.ndarray, bestTriangles: np.ndarray, bestDistances: np.ndarray):
+        #Closest triangle per query (the lower index on ties), merged into the best ones so far
+        order = np.lexsort((triangles, distances, queries))
+        queries, triangles, distances = queries[order], triangles[order], distances[order]
+        closest = np.ones(len(queries), dtype=bool)
+        closest[1:] = queries[1:] != queries[:-1]
+        queries, triangles, distances = queries[closest], triangles[closest], distances[closest]
+
+        better = (distances < bestDistances[queries]) | ((distances == bestDistances[queries]) & (triangles < bestTriangles[queries]))
+        bestTriangles[queries[better]] = triangles[better]
+        bestDistances[queries[better]] = distances[better]
+
+    def FillHits(self, hits: Hits, start: int, triangles: np.ndarray, distances: np.ndarray):
+        #Copies a chunk's closest triangles (-1 for none) into hits, starting at start
+        found = np.flatnonzero(triangles >= 0)
+        triangle = triangles[found]
+        mesh = self.Meshes[triangle]
+        hits.Triangle[start + found] = triangle
+        hits.Distance[start + found] = distances[found]
+        hits.Normal[start + found] = self.Normals[triangle]
+        hits.MeshName[start + found] = self.MeshNames[mesh]
+        hits.ColFlag[start + found] = self.MeshColFlags[mesh]
+        hits.MaterialAttribute[start + found] = self.MeshMaterials[mesh]
+
+    def Raycast(self, origins: np.ndarray, directions: np.ndarray, maxDistance: float = np.inf) -> Hits:
+        #Closest hit of every ray, Distance is in multiples of the direction
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        return self.Sweep(origins, directions, np.zeros(len(origins)), maxDistance)
+
+    def SphereSweep(self, origins: np.ndarray, directions: np.ndarray, radius, maxDistance: float = np.inf) -> Hits:
+        #First contact of spheres moved along the directions, Position is the sphere center at contact
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        return self.Sweep(origins, directions, np.broadcast_to(np.asarray(radius, dtype=np.float64), len(origins)), maxDistance)
+
+    def Sweep(self, origins: np.ndarray, directions: np.ndarray, radii: np.ndarray, maxDistance) -> Hits:
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        maxDistance = np.broadcast_to(np.asarray(maxDistance, dtype=np.float64), len(origins))
+
+        hits = Hits(len(origins))
+        for start in range(0, len(origins), self.ChunkSize):
+            chunk = slice(start, start + self.ChunkSize)
+            triangles, distances = self.SweepChunk(origins[chunk], directions[chunk], radii[chunk], maxDistance[chunk])
+            self.FillHits(hits, start, triangles, distances)
+
+        hit = hits.Hit
+        hits.Position[hit] = origins[hit] + directions[hit] * hits.Distance[hit][:, None]
+        return hits
+
+    def SweepChunk(self, origins: np.ndarray, directions: np.ndarray, radii: np.ndarray, maxDistance: np.ndarray) -> (np.ndarray, np.ndarray):
+        with np.errstate(divide='ignore'):
+            inverse = 1.0 / directions
+
+        def overlaps(queries: np.ndarray, level: int, nodes: np.ndarray) -> np.ndarray:
+            low = self.LevelMin[level][nodes]
+            high = self.LevelMax[level][nodes]
+            if radii.any():
+                #Boxes grown by the sphere radius
+                grow = radii[queries][:, None]
+                low = low - grow
+                high = high + grow
+            return TriangleHelper.RaysBoxesIntersect(origins[queries], inverse[queries], low, high, maxDistance[queries])
+
+        triangles = np.full(len(origins), -1, dtype=np.int64)
+        distances = np.full(len(origins), np.inf)
+        for queries, sortedTriangles in self.LeafTriangles(*self.Descend(np.arange(len(origins)), overlaps)):
+            if radii.any():
+                t = TriangleHelper.SpheresTrianglesSweep(origins[queries], directions[queries], radii[queries], self.SortedVertices[sortedTriangles])
+            else:
+                t = TriangleHelper.RaysTrianglesIntersect(origins[queries], directions[queries], self.SortedVertices[sortedTriangles])
+            hit = t <= maxDistance[queries]
+            self.KeepClosest(queries[hit], self.Order[sortedTriangles[hit]], t[hit], triangles, distances)
+        return triangles, distances
+
+    def ClosestPoint(self, points: np.ndarray, maxDistance: float = np.inf) -> Hits:
+        #Closest point on the geometry to every point, Distance is the euclidean distance
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+        hits = Hits(len(points))
+        if len(self.Order) == 0:
+            return hits
+        for start in range(0, len(points), self.ChunkSize):
+            triangles, distances = self.ClosestPointChunk(points[start : start + self.ChunkSize], maxDistance)
+            self.FillHits(hits, start, triangles, distances)
+
+        hit = hits.Hit
+        hits.Position[hit] = TriangleHelper.ClosestPointsOnTriangles(points[hit], self.Vertices[hits.Triangle[hit]])
+        return hits
+
+    def ClosestPointChunk(self, points: np.ndarray, maxDistance: float) -> (np.ndarray, np.ndarray):
+        #The triangles next to the point along the curve give a distance to start from and every box
+        #on the way down tightens it, boxes whose nearest point is farther are skipped
+        bound = np.minimum(self.NeighbourDistance(points), maxDistance)
+
+        def overlaps(queries: np.ndarray, level: int, nodes: np.ndarray) -> np.ndarray:
+            p = points[queries]
+            low = self.LevelMin[level][nodes]
+            high = self.LevelMax[level][nodes]
+            np.minimum.at(bound, queries, BoxFarthest(p, low, high))
+            return BoxDistance(p, low, high) <= bound[queries]
+
+        queries, leaves = self.Descend(np.arange(len(points)), overlaps)
+        
+        #Test every point's leaves nearest first in rounds of doubling size, each round tightens
+        #the bound that drops the leaves of the next rounds
+        nearest = BoxDistance(points[queries], self.LevelMin[0][leaves], self.LevelMax[0][leaves])
+        order = np.lexsort((nearest, queries))
+        queries, leaves, nearest = queries[order], leaves[order], nearest[order]
+        groupStart = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]])
+        rank = np.arange(len(queries)) - np.repeat(groupStart, np.diff(np.r_[groupStart, len(queries)]))
+        
+        triangles = np.full(len(points), -1, dtype=np.int64)
+        distances = np.full(len(points), np.inf)
+        low = 0
+        high = 1
+        while low < len(queries) and (rank >= low).any():
+            selected = (rank >= low) & (rank < high) & (nearest <= bound[queries])
+            for roundQueries, sortedTriangles in self.LeafTriangles(queries[selected], leaves[selected]):
+                closest = TriangleHelper.ClosestPointsOnTriangles(points[roundQueries], self.SortedVertices[sortedTriangles])
+                distance = np.linalg.norm(closest - points[roundQueries], axis=1)
+                hit = distance <= maxDistance
+                self.KeepClosest(roundQueries[hit], self.Order[sortedTriangles[hit]], distance[hit], triangles, distances)
+            np.minimum(bound, distances, out=bound)
+            low = high
+            high *= 2
+        return triangles, distances
+
+    def NeighbourDistance(self, points: np.ndarray) -> np.ndarray:
+        #Distance to the triangles next to each point along the Morton curve, a cheap upper bound
+        around = np.searchsorted(self.SortedCodes, MortonCodes(points, self.CodeLow, self.CodeExtent))
+        first = np.clip(around - self.NeighbourCount // 2, 0, max(len(self.Order) - self.NeighbourCount, 0))
+        queries = np.repeat(np.arange(len(points)), self.NeighbourCount)
+        sortedTriangles = np.minimum((first[:, None] + np.arange(self.NeighbourCount)).ravel(), len(self.Order) - 1)
+        closest = TriangleHelper.ClosestPointsOnTriangles(points[queries], self.SortedVertices[sortedTriangles])
+        return np.linalg.norm(closest - points[queries], axis=1).reshape(-1, self.NeighbourCount).min(axis=1)
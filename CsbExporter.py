@@ -1,197 +1,268 @@
-from collada import *
+from CsbFile import CsbFile
+from Geometry import Geometry
+from SceneBuilder import MaterialName
+from GeometryCleanup import UniqueRows
 import numpy as np
 from math import degrees
+from datetime import datetime
+from xml.sax.saxutils import quoteattr
 
-eff = material.Effect("effect0", [], "phong", diffuse=(1.0, 1.0, 1.0, 1.0), double_sided=False)
-
-def SetupMaterial(attribute: int, flag: int, identifiers: list[int] = None):
-    global iomodel, ioscene, eff
-    if identifiers is None:
-        name = f"MAT{attribute}_FLAG{flag}"
-    else:
-        #print(identifiers)
-        name = f"MAT{attribute}_FLAG{flag}_ID-A{identifiers[0]}_ID-B{identifiers[1]}"
-    
-    mat = material.Material(name, name, eff)
-    matnode = scene.MaterialNode(symbol=name, target=mat, inputs=())
-    if not [None for x in ioscene.nodes if type(x) is scene.MaterialNode and x.symbol == matnode.symbol]: # if matnode isn't in nodelist:
-        ioscene.nodes.append(matnode)
-        iomodel.materials.append(mat)
-    return matnode
-
-def SetupMesh(mesh_idx: int, name: str, mat: str, triangles: list, positions: list):
-    global iomodel
-
-    vertsrc = positions
-    normsrc = []
-    idxsrc = []
-    
-    normidx = 0
-    
-    for tri in triangles:
-        #vertsrc.append(tri.Vertices)
-        #print(tri.Vertices)
-
-        idxsrc.append(tri.A)
-        idxsrc.append(normidx)
-        normidx += 1
-        idxsrc.append(tri.B)
-        idxsrc.append(normidx)
-        normidx += 1
-        idxsrc.append(tri.C)
-        idxsrc.append(normidx)
-        normidx += 1
-        normsrc.append(tri.Normal)
-        normsrc.append(tri.Normal)
-        normsrc.append(tri.Normal)
-    vertsrc = source.FloatSource(f"verts-array-{mesh_idx}", np.array(vertsrc).ravel(), ('X', 'Y', 'Z'))
-    normsrc = source.FloatSource(f"normals-array-{mesh_idx}", np.array(normsrc).ravel(), ('X', 'Y', 'Z'))
-    geom = geometry.Geometry(iomodel, f"{name}_geometry", name, [vertsrc, normsrc])
-    
-    #print(len(np.array(idxsrc).ravel()))
-    idxsrc = np.array(idxsrc)
-    input_list = source.InputList()
-    input_list.addInput(0, "VERTEX", f"#verts-array-{mesh_idx}")
-    input_list.addInput(1, "NORMAL", f"#normals-array-{mesh_idx}")
-    
-    #print(input_list.getList())
-    triset = geom.createTriangleSet(idxsrc, input_list, mat.symbol)
-    geom.primitives.append(triset)
-    
-    geomnode = scene.GeometryNode(geom, [mat])
-    
-    return geom, geomnode
-
-def LoadNode(node, parent, repeat):
-    global currentIdx, node_list, ioscene
-    index = node.ID
-    #print(currentIdx)
-    if not repeat:
-        currentIdx += 1
-    
-    #print(index)
-    
-    #find the model, mesh or mobj that links to this to label it
-    name = f"Node{currentIdx}"
-    
-    model = next((x for x in csb.Models if x.NodeIndex == index), None)
-    
-    if not model is None:
-        model.AbsoluteIndex = currentIdx - 1
-    
-    else:
-        obj = next((x for x in csb.Objects if x.NodeIndex == index), None)
-        
-        if not obj is None:
-            obj.AbsoluteIndex = currentIdx - 1
-        
-        elif len(csb.Models[0].Meshes) > 0 :
-            mesh = next((x for x in csb.Models[0].Meshes if x.NodeIndex == index), None)
-            if not mesh is None:
-                mesh.AbsoluteIndex = currentIdx - 1
-                name = f"{mesh.Name}"
-    
-    bone = scene.Node(id=name, children=[])
-    
-    #if node.NumChildren == -1:
-    #    if not repeat:
-    #        LoadNode(csb.Nodes[currentIdx-1], bone, True)
-    #        LoadNode(csb.Nodes[currentIdx-1], bone, True)
-    #        LoadNode(csb.Nodes[currentIdx-1], bone, True)
-            
-    
-    node_list.append(bone)
-    
-    #print(node.NumChildren)
-    if csb.OldParenting:
-        startIdx = currentIdx
-        while currentIdx < (startIdx + node.NumChildren):
-            LoadNode(csb.Nodes[currentIdx], bone, False)
-    else:
-        for i in range(node.NumChildren):
-            LoadNode(csb.Nodes[currentIdx], bone, False)
-    
-    if parent == None:
-        ioscene.nodes.append(bone)
-    else:
-        parent.children.append(bone)
-    
-def Export(csb_in, filePath):
-    mesh_idx = 0
-    
-    global csb, node_list, iomodel, ioscene
-    csb = csb_in
-    ioscene = scene.Scene("scene", [])
-    
-    iomodel = Collada(validate_output=True)
-    
-    iomodel.effects.append(eff)
-    
-    
-    #node tree
-    
-    global currentIdx
-    currentIdx = 0
-    
-    node_list = []
-    
-    #print([x.Name for x in csb.Nodes])
-    #print()
-    while len(node_list) < len(csb.Nodes):
-        LoadNode(csb.Nodes[currentIdx], None, False)
-    
-    for obj in csb.Objects:
-        type = "MAPOBJ_SPHERE" if obj.IsSphere else "MAPOBJ_BOX"
-        
-        mat = SetupMaterial(0, obj.ColFlag, [obj.Identifier1, obj.Identifier2])
-        
-        #Add meshes as map objects
-        iomesh, iomeshnode = SetupMesh(mesh_idx, f"{type}_{obj.Name}", mat, [], [])
-        mesh_idx += 1
-
-        iomodel.geometries.append(iomesh)
-        node_list[obj.AbsoluteIndex].id = obj.Name
-        node_list[obj.AbsoluteIndex].name = f'{type}_{obj.Name}'
-        node_list[obj.AbsoluteIndex].children.append(iomeshnode)
-        node_list[obj.AbsoluteIndex].children.append(scene.TranslateTransform(*obj.Point1))
-        node_list[obj.AbsoluteIndex].children.append(scene.RotateTransform(0, 0, 1, degrees(obj.Rotation[2])))
-        node_list[obj.AbsoluteIndex].children.append(scene.RotateTransform(0, 1, 0, degrees(obj.Rotation[1])))
-        node_list[obj.AbsoluteIndex].children.append(scene.RotateTransform(1, 0, 0, degrees(obj.Rotation[0])))
-        node_list[obj.AbsoluteIndex].children.append(scene.ScaleTransform(*obj.Size))
-        
-        if obj.IsSphere:
-            node_list[obj.AbsoluteIndex].children[-1] = scene.ScaleTransform(obj.Radius, obj.Radius, obj.Radius)
-    
-    for idx, model in enumerate(csb.Models):
-        if len(model.Meshes) > 0:
+#Values formatted per write, keeps the text of a huge mesh from ever being in memory at once
+ChunkSize = 1 << 16
+
+#Deepest node level that still gets indented
+MaxIndent = 64
+
+Header = '''<?xml version="1.0" encoding="utf-8"?>
+<COLLADA xmlns="http://www.collada.org/2005/11/COLLADASchema" version="1.4.1">
+  <asset>
+    <created>{now}</created>
+    <modified>{now}</modified>
+    <up_axis>Y_UP</up_axis>
+  </asset>
+  <library_effects>
+    <effect id="effect0" name="effect0">
+      <profile_COMMON>
+        <technique sid="common">
+          <phong>
+            <emission>
+              <color>0.0 0.0 0.0 1.0</color>
+            </emission>
+            <ambient>
+              <color>0.0 0.0 0.0 1.0</color>
+            </ambient>
+            <diffuse>
+              <color>1.0 1.0 1.0 1.0</color>
+            </diffuse>
+            <specular>
+              <color>0.0 0.0 0.0 1.0</color>
+            </specular>
+            <shininess>
+              <float>0.0</float>
+            </shininess>
+            <reflective>
+              <color>0.0 0.0 0.0 1.0</color>
+            </reflective>
+            <reflectivity>
+              <float>0.0</float>
+            </reflectivity>
+            <transparent>
+              <color>0.0 0.0 0.0 1.0</color>
+            </transparent>
+            <transparency>
+              <float>1.0</float>
+            </transparency>
+          </phong>
+        </technique>
+        <extra>
+          <technique profile="GOOGLEEARTH">
+            <double_sided>0</double_sided>
+          </technique>
+        </extra>
+      </profile_COMMON>
+    </effect>
+  </library_effects>
+'''
+
+def WriteValues(file, values: np.ndarray, format: str):
+    #Space separated values, one % formatting call per chunk instead of one per value
+    values = values.ravel()
+    for start in range(0, len(values), ChunkSize):
+        chunk = values[start : start + ChunkSize].tolist()
+        if start:
+            file.write(' ')
+        file.write((f'{format} ' * len(chunk) % tuple(chunk))[:-1])
+
+def WriteSource(file, id: str, values: np.ndarray):
+    file.write(f'        <source id="{id}">\n')
+    file.write(f'          <float_array count="{values.size}" id="{id}-array">')
+    WriteValues(file, values, '%.7g')
+    file.write('</float_array>\n')
+    file.write('          <technique_common>\n')
+    file.write(f'            <accessor count="{len(values)}" source="#{id}-array" stride="3">\n')
+    file.write('              <param type="float" name="X" />\n')
+    file.write('              <param type="float" name="Y" />\n')
+    file.write('              <param type="float" name="Z" />\n')
+    file.write('            </accessor>\n')
+    file.write('          </technique_common>\n')
+    file.write('        </source>\n')
+
+def WriteMesh(file, mesh_idx: int, name: str, mat: str, meshGeometry: Geometry) -> str:
+    #Writes one <geometry> and returns its id
+    id = f"{name}_geometry"
+    corners = meshGeometry.LocalIndices()
+
+    #one entry per distinct face normal (exact float bits, so -0.0 stays -0.0), all three corners
+    #of a triangle index it, flat regions end up sharing a handful of normals
+    normals = np.ascontiguousarray(meshGeometry.Normals, dtype=np.float32)
+    first, normalIndices = UniqueRows(normals.view(np.int32))
+    idxsrc = np.empty((len(corners), 3, 2), dtype=np.int64)
+    idxsrc[:, :, 0] = corners
+    idxsrc[:, :, 1] = normalIndices[:, None]
+    normsrc = normals[first]
+
+    file.write(f'    <geometry id={quoteattr(id)} name={quoteattr(name)}>\n')
+    file.write('      <mesh>\n')
+    WriteSource(file, f"verts-array-{mesh_idx}", meshGeometry.Positions)
+    WriteSource(file, f"normals-array-{mesh_idx}", normsrc)
+    file.write(f'        <vertices id="verts-array-{mesh_idx}-vertices">\n')
+    file.write(f'          <input semantic="POSITION" source="#verts-array-{mesh_idx}" />\n')
+    file.write('        </vertices>\n')
+    file.write(f'        <triangles count="{len(corners)}" material={quoteattr(mat)}>\n')
+    file.write(f'          <input offset="0" semantic="VERTEX" source="#verts-array-{mesh_idx}-vertices" />\n')
+    file.write(f'          <input offset="1" semantic="NORMAL" source="#normals-array-{mesh_idx}" />\n')
+    file.write('          <p>')
+    WriteValues(file, idxsrc, '%d')
+    file.write('</p>\n')
+    file.write('        </triangles>\n')
+    file.write('      </mesh>\n')
+    file.write('    </geometry>\n')
+    return id
+
+def Transforms(translate, rotation, scale = None) -> list[str]:
+    #translate, rotate z, y, x, then scale, as <translate>/<rotate>/<scale> elements
+    transforms = [
+        f"<translate>{' '.join(str(x) for x in translate)}</translate>",
+        f"<rotate>0 0 1 {degrees(rotation[2])}</rotate>",
+        f"<rotate>0 1 0 {degrees(rotation[1])}</rotate>",
+        f"<rotate>1 0 0 {degrees(rotation[0])}</rotate>",
+    ]
+    if not scale is None:
+        transforms.append(f"<scale>{' '.join(str(x) for x in scale)}</scale>")
+    return transforms
+
+class CsbExporter:
+    #One .dae export of a CsbFile. All state lives on the instance and the CsbFile is only read,
+    #so separate exports can run on a thread pool at the same time, also of the same CsbFile.
+
+    def __init__(self, csb: CsbFile):
+        self.Csb = csb
+
+        #decode lazily opened geometry up front (LoadGeometry is locked, so this is safe
+        #while other exports of the same file do the same), writing then only reads
+        for model in csb.Models:
+            model.LoadGeometry()
             for mesh in model.Meshes:
-                mat = SetupMaterial(mesh.MaterialAttribute, mesh.ColFlag)
-                
-                iomesh, iomeshnode = SetupMesh(mesh_idx, mesh.Name, mat, mesh.Triangles, mesh.Positions)
-                mesh_idx += 1
-
-                iomodel.geometries.append(iomesh)
-                node_list[mesh.AbsoluteIndex].children.append(iomeshnode)
-        elif len(model.Triangles) > 0:
-            mat = SetupMaterial(model.MaterialAttribute, model.ColFlag)
-            
-            iomesh, iomeshnode = SetupMesh(mesh_idx, model.Name, mat, model.Triangles, model.Positions)
-            mesh_idx += 1
-
-            iomodel.geometries.append(iomesh)
-            node_list[model.AbsoluteIndex].id = model.Name
-            node_list[model.AbsoluteIndex].name = f'MODELSPLIT_{model.Name}'
-            node_list[model.AbsoluteIndex].children.append(iomeshnode)
-            node_list[model.AbsoluteIndex].children.append(scene.TranslateTransform(*model.Translate))
-            node_list[model.AbsoluteIndex].children.append(scene.RotateTransform(0, 0, 1, degrees(model.Rotation[2])))
-            node_list[model.AbsoluteIndex].children.append(scene.RotateTransform(0, 1, 0, degrees(model.Rotation[1])))
-            node_list[model.AbsoluteIndex].children.append(scene.RotateTransform(1, 0, 0, degrees(model.Rotation[0])))
-    iomodel.scenes.append(ioscene)
-    iomodel.scene = ioscene
-    iomodel.write(filePath)
-    # prepend standard dae formatting line
-    with open(filePath, 'r+') as f:
-        content = f.read()
-        f.seek(0, 0)
-        f.write('<?xml version="1.0" encoding="utf-8"?>'.rstrip('\r\n') + '\n' + content)
-    
\ No newline at end of file
+                mesh.LoadGeometry()
+
+        #node tree as child lists, from the depth first order of csb.Nodes
+        self.Parents = csb.GetNodeParents()
+        self.Children = [[] for _ in csb.Nodes]
+        for index, parent in enumerate(self.Parents):
+            if parent != -1:
+                self.Children[parent].append(index)
+
+        #label every node after the model, mesh or mobj linking to it
+        self.Labels = []
+        self.OwnerNodes = {} #id() of a model, object or mesh -> index of its node
+        for index, owner in enumerate(csb.GetNodeOwners()):
+            self.Labels.append({'id': f"Node{index + 1}", 'name': f"Node{index + 1}"})
+            if not owner is None:
+                self.OwnerNodes[id(owner)] = index
+                if isinstance(owner, CsbFile.Mesh):
+                    self.Labels[index]['id'] = self.Labels[index]['name'] = f"{owner.Name}"
+
+        self.Materials = {} #names in order of first use
+        self.MeshIndex = 0
+
+    def SetupMaterial(self, attribute: int, flag: int, identifiers: list[int] = None) -> str:
+        name = MaterialName(attribute, flag, identifiers)
+        self.Materials.setdefault(name)
+        return name
+
+    def SetupMesh(self, file, owner, name: str, mat: str, meshGeometry: Geometry) -> dict:
+        #Writes the geometry and returns the label of the owner's node (a throwaway one if it has no node)
+        geometry = WriteMesh(file, self.MeshIndex, name, mat, meshGeometry)
+        self.MeshIndex += 1
+
+        label = self.Labels[self.OwnerNodes[id(owner)]] if id(owner) in self.OwnerNodes else {}
+        label['geometry'] = geometry
+        label['material'] = mat
+        return label
+
+    def WriteGeometries(self, file):
+        file.write('  <library_geometries>\n')
+        for obj in self.Csb.Objects:
+            type = "MAPOBJ_SPHERE" if obj.IsSphere else "MAPOBJ_BOX"
+
+            #Add meshes as map objects
+            mat = self.SetupMaterial(0, obj.ColFlag, [obj.Identifier1, obj.Identifier2])
+            label = self.SetupMesh(file, obj, f"{type}_{obj.Name}", mat, Geometry())
+            label['id'] = obj.Name
+            label['name'] = f'{type}_{obj.Name}'
+            label['transforms'] = Transforms(obj.Point1, obj.Rotation, (obj.Radius,) * 3 if obj.IsSphere else obj.Size)
+
+        for model in self.Csb.Models:
+            if len(model.Meshes) > 0:
+                for mesh in model.Meshes:
+                    mat = self.SetupMaterial(mesh.MaterialAttribute, mesh.ColFlag)
+                    self.SetupMesh(file, mesh, mesh.Name, mat, mesh.Geometry)
+            elif model.Geometry.NumTriangles > 0:
+                mat = self.SetupMaterial(model.MaterialAttribute, model.ColFlag)
+                label = self.SetupMesh(file, model, model.Name, mat, model.Geometry)
+                label['id'] = model.Name
+                label['name'] = f'MODELSPLIT_{model.Name}'
+                label['transforms'] = Transforms(model.Translate, model.Rotation)
+        file.write('  </library_geometries>\n')
+
+    def WriteMaterials(self, file):
+        file.write('  <library_materials>\n')
+        for mat in self.Materials:
+            file.write(f'    <material id={quoteattr(mat)} name={quoteattr(mat)}>\n')
+            file.write('      <instance_effect url="#effect0" />\n')
+            file.write('    </material>\n')
+        file.write('  </library_materials>\n')
+
+    def WriteNodeStart(self, file, index: int, indent: str):
+        label = self.Labels[index]
+        file.write(f"{indent}<node id={quoteattr(label['id'])} name={quoteattr(label['name'])}>\n")
+
+        #the schema wants transforms first, then the geometry and then the child nodes
+        for transform in label.get('transforms', []):
+            file.write(f"{indent}  {transform}\n")
+
+        if 'geometry' in label:
+            mat = quoteattr(label['material'])
+            file.write(f"{indent}  <instance_geometry url={quoteattr('#' + label['geometry'])}>\n")
+            file.write(f"{indent}    <bind_material>\n")
+            file.write(f"{indent}      <technique_common>\n")
+            file.write(f"{indent}        <instance_material symbol={mat} target={quoteattr('#' + label['material'])} />\n")
+            file.write(f"{indent}      </technique_common>\n")
+            file.write(f"{indent}    </bind_material>\n")
+            file.write(f"{indent}  </instance_geometry>\n")
+
+    def WriteVisualScene(self, file):
+        file.write('  <library_visual_scenes>\n')
+        file.write('    <visual_scene id="scene">\n')
+
+        #walked with a stack, deep node chains can't hit the recursion limit
+        #and the indentation stops growing past MaxIndent levels so long chains don't write gigabytes of spaces
+        stack = [(index, 3, False) for index in reversed(range(len(self.Parents))) if self.Parents[index] == -1]
+        while stack:
+            index, depth, close = stack.pop()
+            indent = '  ' * min(depth, MaxIndent)
+            if close:
+                file.write(f"{indent}</node>\n")
+                continue
+            self.WriteNodeStart(file, index, indent)
+            stack.append((index, depth, True))
+            stack.extend((child, depth + 1, False) for child in reversed(self.Children[index]))
+
+        file.write('    </visual_scene>\n')
+        file.write('  </library_visual_scenes>\n')
+
+    def Write(self, filePath: str):
+        #Streams the .dae straight to the file: geometries are formatted and written one at a time,
+        #only the names and transforms of the node tree are kept until the visual scene is written
+        with open(filePath, 'w', encoding='utf-8', newline='\n') as file:
+            file.write(Header.format(now=datetime.now().isoformat()))
+            self.WriteGeometries(file)
+            self.WriteMaterials(file)
+            self.WriteVisualScene(file)
+            file.write('  <scene>\n')
+            file.write('    <instance_visual_scene url="#scene" />\n')
+            file.write('  </scene>\n')
+            file.write('</COLLADA>\n')
+
+def Export(csb: CsbFile, filePath: str):
+    CsbExporter(csb).Write(filePath)
@@ -1,11 +1,84 @@
-from struct import unpack_from, pack
+from struct import unpack_from, Struct
+from functools import lru_cache
 from numpy import array, array_equal
+import numpy as np
+import mmap
+import threading
 from BoundingBox import BoundingBox
+from Geometry import Geometry, AsArray
 from Triangle import *
 
+def TriangleDtype(byteOrder: str) -> np.dtype:
+    #A/B/C vertex indices followed by the face normal, 24 bytes per triangle
+    return np.dtype([
+        ('A', f'{byteOrder}u4'),
+        ('B', f'{byteOrder}u4'),
+        ('C', f'{byteOrder}u4'),
+        ('Normal', f'{byteOrder}f4', (3,)),
+    ])
+
+@lru_cache(maxsize=None)
+def Packer(byteOrder: str, format: str) -> Struct:
+    #Compiled once per byte order and format instead of on every pack() call
+    return Struct(f'{byteOrder}{format}')
+
+class BufferWriter:
+    #Minimal write() target over a preallocated buffer
+    def __init__(self, buffer: bytearray, offset: int = 0):
+        self.Buffer = memoryview(buffer).cast('B')
+        self.Position = offset
+    
+    def write(self, data: bytes) -> int:
+        end = self.Position + len(data)
+        self.Buffer[self.Position : end] = data
+        self.Position = end
+        return len(data)
+
+def ReadGeometry(reader: bytearray, readOffset: int, numVertices: int, numTriangles: int, byteOrder: str) -> Geometry:
+    positions = np.frombuffer(reader, dtype=f'{byteOrder}f4', count=numVertices * 3, offset=readOffset).reshape(-1, 3)
+    readOffset += positions.nbytes
+    
+    #indices and normals are strided views into the same 24 byte triangle records
+    tris = np.frombuffer(reader, dtype=f'{byteOrder}u4', count=numTriangles * 6, offset=readOffset).reshape(-1, 6)
+    return Geometry(positions, tris[:, 0:3], tris.view(f'{byteOrder}f4')[:, 3:6])
+
 def ReadZeroTerminatedString(reader: bytearray, address: int) -> str:
-    end = reader[address:].index(b"\x00") + address
-    return reader[address:end].decode('utf-8')
+    #find() works on bytes, bytearray and mmap without copying the rest of the file
+    end = reader.find(b"\x00", address)
+    return bytes(reader[address:end]).decode('utf-8')
+
+class GeometryOwner:
+    #Models and meshes keep their faces in a Geometry
+    #Positions and Triangles are kept as views of it for older code
+    
+    def LoadGeometry(self):
+        pass
+    
+    @property
+    def Geometry(self) -> Geometry:
+        self.LoadGeometry()
+        return self._geometry
+    
+    @Geometry.setter
+    def Geometry(self, value: Geometry):
+        self.LoadGeometry()
+        self._geometry = value
+    
+    @property
+    def Positions(self) -> np.ndarray:
+        return self.Geometry.Positions
+    
+    @Positions.setter
+    def Positions(self, value: list):
+        self.Geometry.Positions = AsArray(value, 'f4', 3)
+    
+    @property
+    def Triangles(self):
+        return self.Geometry.Triangles
+    
+    @Triangles.setter
+    def Triangles(self, value: list[Triangle]):
+        self.Geometry.SetTriangles(value)
 
 class CsbFile:
     Models = []
@@ -47,7 +120,7 @@ class CsbFile:
         Flags = None
         NumChildren = None
 
-    class Mesh:
+    class Mesh(GeometryOwner):
         Name = None
         MaterialAttribute = None
         ColFlag = None
@@ -57,11 +130,28 @@ class CsbFile:
         NumVertices = None
         NumTriangles = None
         
+        #Index of the mesh's first vertex/triangle in the combined model buffer
+        #Triangle indices are relative to the combined buffer, not the mesh
+        VertexOffset = 0
+        TriangleOffset = 0
+        
         def __init__(self):
-            self.Positions = list()
-            self.Triangles = list()
+            self._model = None #combined model to slice geometry from on first access
+            self._geometry = Geometry()
+            self._lock = threading.Lock()
+        
+        def LoadGeometry(self):
+            if self._model is None:
+                return
+            #threads reading Geometry at once wait for the one slicing it, _model is only
+            #cleared once the slice is in place so nobody sees the empty placeholder
+            with self._lock:
+                if self._model is None:
+                    return
+                self._geometry = self._model.Geometry.Slice(self.TriangleOffset, self.NumTriangles, self.VertexOffset, self.NumVertices)
+                self._model = None
 
-    class Model:
+    class Model(GeometryOwner):
         NumTriangles = 0
         NumVertices = 0
         
@@ -87,10 +177,53 @@ class CsbFile:
             
             self.Meshes = list()
             
-            self.Triangles = list()
-            self.Positions = list()
+            self._source = None #(reader, offset, byteOrder) of geometry not decoded yet
+            self._geometry = Geometry()
+            self._lock = threading.Lock()
+        
+        def IsLoaded(self) -> bool:
+            return self._source is None
+        
+        def LoadGeometry(self):
+            if self._source is None:
+                return
+            #decoded once even when several threads ask at the same time, _source is only
+            #cleared once the finished geometry is in place
+            with self._lock:
+                if self._source is None:
+                    return
+                reader, readOffset, byteOrder = self._source
+                geometry = ReadGeometry(reader, readOffset, self.NumVertices, self.NumTriangles, byteOrder)
+                
+                #the file has no triangle ids, the CTB refers to triangles by their face order
+                geometry.IDs = np.arange(self.NumTriangles, dtype=np.int32)
+                
+                #per face material attributes come from the model itself or the mesh owning the range
+                if self.MaterialAttribute is not None:
+                    geometry.Materials[:] = self.MaterialAttribute
+                for mesh in self.Meshes:
+                    if mesh.NumTriangles:
+                        geometry.Materials[mesh.TriangleOffset : mesh.TriangleOffset + mesh.NumTriangles] = mesh.MaterialAttribute
+                
+                self._geometry = geometry
+                self._source = None
+        
+        def Detach(self):
+            #Copies everything still pointing into the file mapping, so the mapping can be closed
+            with self._lock:
+                if self._source is not None:
+                    reader, readOffset, byteOrder = self._source
+                    size = self.NumVertices * 12 + self.NumTriangles * TriangleDtype(byteOrder).itemsize
+                    self._source = (bytes(reader[readOffset : readOffset + size]), 0, byteOrder)
+                    return
+                geometry = self._geometry
+                self._geometry = Geometry(geometry.Positions.copy(), geometry.Indices.copy(), geometry.Normals.copy(), geometry.IDs, geometry.Materials, geometry.VertexOffset)
+            for mesh in self.Meshes:
+                with mesh._lock:
+                    if mesh._model is None:
+                        mesh._geometry = self._geometry.Slice(mesh.TriangleOffset, mesh.NumTriangles, mesh.VertexOffset, mesh.NumVertices)
 
-    def Read(self, reader: bytearray, bigEndian: bool):
+    def Read(self, reader: bytearray, bigEndian: bool, lazy: bool = False):
         
         byteOrder = '>' if bigEndian else '<'
         
@@ -104,6 +237,9 @@ class CsbFile:
         #these are generally used to trigger things
         num_sphere_objects = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
         readOffset += 4
+        #a count larger than the file is not a csb (or the wrong byte order), fail before allocating it
+        if num_sphere_objects * 32 > len(reader) - readOffset:
+            raise ValueError(f'Invalid sphere object count {num_sphere_objects}')
         
         sphere_objects = [self.CollisionObject() for _ in range(num_sphere_objects)]
         for i in range(num_sphere_objects):
@@ -124,6 +260,8 @@ class CsbFile:
         
         num_box_objects = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
         readOffset += 4
+        if num_box_objects * 32 > len(reader) - readOffset:
+            raise ValueError(f'Invalid box object count {num_box_objects}')
         
         box_objects = [self.CollisionObject() for _ in range(num_box_objects)]
         for i in range(num_box_objects):
@@ -318,28 +456,10 @@ class CsbFile:
             models[i].Bounding.Read(reader, readOffset, byteOrder)
             readOffset += 24
             
-            positions = [None for _ in range(models[i].NumVertices)]
-            
-            for v in range(models[i].NumVertices):
-                positions[v] = unpack_from(f'{byteOrder}3f', reader, offset=readOffset)
-                readOffset += 12
-            
-            tris = [Triangle() for _ in range(models[i].NumTriangles)]
-            for v in range(models[i].NumTriangles):
-                tris[v].A = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
-                readOffset += 4
-                tris[v].B = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
-                readOffset += 4
-                tris[v].C = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
-                readOffset += 4
-                tris[v].Normal = unpack_from(f'{byteOrder}3f', reader, offset=readOffset)
-                readOffset += 12
-                tris[v].Vertices = [None, None, None]
-                tris[v].Vertices[0] = positions[tris[v].A]
-                tris[v].Vertices[1] = positions[tris[v].B]
-                tris[v].Vertices[2] = positions[tris[v].C]
-            models[i].Positions = positions.copy()
-            models[i].Triangles = tris.copy()
+            #only index the geometry here, it gets decoded on first access
+            models[i]._source = (reader, readOffset, byteOrder)
+            readOffset += models[i].NumVertices * 12
+            readOffset += models[i].NumTriangles * TriangleDtype(byteOrder).itemsize
             
             #DEADBEEF model has combined meshes
             #Typically paired with a .ctb file for searching collision with octrees
@@ -368,12 +488,10 @@ class CsbFile:
                 meshes[m].NumVertices = num_verts
                 meshes[m].NumTriangles = num_tris
                 
-                meshes[m].Positions = positions[vtx_idx : num_verts + vtx_idx].copy()
-                meshes[m].Triangles = tris[tri_idx : num_tris + tri_idx].copy()
-                for v in range(len(meshes[m].Triangles)):
-                    meshes[m].Triangles[v].A -= vtx_idx
-                    meshes[m].Triangles[v].B -= vtx_idx
-                    meshes[m].Triangles[v].C -= vtx_idx
+                #views into the combined buffers, indices stay relative to the model
+                meshes[m].VertexOffset = vtx_idx
+                meshes[m].TriangleOffset = tri_idx
+                meshes[m]._model = models[i]
             models[i].Meshes.extend(meshes)
             
             readOffset += 4 # 0
@@ -447,175 +565,262 @@ class CsbFile:
                 readOffset += 24
                 
                 
-                positions = [None for _ in range(models_split[i].NumVertices)]
-                
-                for v in range(models_split[i].NumVertices):
-                    positions[v] = unpack_from(f'{byteOrder}3f', reader, offset=readOffset)
-                    readOffset += 12
-                
-                tris = [Triangle() for _ in range(models_split[i].NumTriangles)]
-                for v in range(models_split[i].NumTriangles):
-                    tris[v].A = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
-                    readOffset += 4
-                    tris[v].B = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
-                    readOffset += 4
-                    tris[v].C = unpack_from(f'{byteOrder}I', reader, offset=readOffset)[0]
-                    readOffset += 4
-                    tris[v].Normal = unpack_from(f'{byteOrder}3f', reader, offset=readOffset)
-                    readOffset += 12
-                    
-                    tris[v].Vertices = [None, None, None]
-                    tris[v].Vertices[0] = positions[tris[v].A]
-                    tris[v].Vertices[1] = positions[tris[v].B]
-                    tris[v].Vertices[2] = positions[tris[v].C] 
-                
-                models_split[i].Positions = positions.copy()
-                models_split[i].Triangles = tris.copy()
+                models_split[i]._source = (reader, readOffset, byteOrder)
+                readOffset += models_split[i].NumVertices * 12
+                readOffset += models_split[i].NumTriangles * TriangleDtype(byteOrder).itemsize
             self.Models.extend(models_split)
+        
+        if not lazy:
+            for model in self.Models:
+                model.LoadGeometry()
     
-    def Write(self, bigEndian: bool) -> bytearray:
+    def GetNodeParents(self) -> list[int]:
+        #Position of every node's parent in Nodes (-1 for roots). Nodes are stored depth first, each followed
+        #by its NumChildren children, or with old parenting by the NumChildren nodes of its whole subtree
+        parents = [-1] * len(self.Nodes)
+
+        #open nodes as [position, children left] or with old parenting [position, end of subtree]
+        stack = []
+        for position, node in enumerate(self.Nodes):
+            while stack and (position >= stack[-1][1] if self.OldParenting else stack[-1][1] <= 0):
+                stack.pop()
+
+            if stack:
+                parents[position] = stack[-1][0]
+                if not self.OldParenting:
+                    stack[-1][1] -= 1
+            stack.append([position, position + 1 + node.NumChildren if self.OldParenting else node.NumChildren])
+        return parents
+
+    def GetNodeOwners(self) -> list:
+        #The model, object or mesh linked to each node (checked in that order, the first one of a kind wins) or None
+        owners = {}
+        for owner in reversed(self.Models[0].Meshes if self.Models else []):
+            owners[owner.NodeIndex] = owner
+        for owner in reversed(self.Objects):
+            owners[owner.NodeIndex] = owner
+        for owner in reversed(self.Models):
+            owners[owner.NodeIndex] = owner
+        return [owners.get(node.ID) for node in self.Nodes]
+
+    @staticmethod
+    def BuildStringTable(List: list[str]) -> bytearray:
+        writer = bytearray()
+        for Str in List:
+            writer.extend(Str.encode('utf-8'))
+            writer.extend(b'\x00') #zero terminate
+        writer.extend(b'\x00' * ((4 - (len(writer) % 4)) % 4))
+        return writer
+    
+    def GetLayout(self) -> dict:
+        #Byte offset of every section, computed from the counts alone so the output can be
+        #preallocated or streamed without building it in memory first
+        sphere_objects = [obj for obj in self.Objects if obj.IsSphere]
+        box_objects = [obj for obj in self.Objects if not obj.IsSphere]
+        meshes = self.Models[0].Meshes
         
-        def BuildStringTable(List: list[str]) -> bytearray:
-            writer = bytearray()
-            for Str in List:
-                writer.extend(Str.encode('utf-8'))
-                writer.extend(b'\x00') #zero terminate
-            writer.extend(b'\x00' * ((4 - (len(writer) % 4)) % 4))
-            return writer
-                
+        layout = {}
+        size = 0
         
-        writer = bytearray()
+        layout['Objects'] = size
+        size += 4 + 32 * len(sphere_objects)
+        size += 4 + 88 * len(box_objects)
+        size += 24
+        size += 10 * len(self.Objects)
+        size += 4 + len(CsbFile.BuildStringTable([obj.Name for obj in self.Objects]))
+        
+        layout['Meshes'] = size
+        size += 4 + 22 * len(meshes)
+        size += 4 + len(CsbFile.BuildStringTable([mesh.Name for mesh in meshes]))
+        
+        layout['Nodes'] = size
+        size += 2 + 4 * len(self.Nodes)
+        size += 12
         
+        layout['Models'] = []
+        for model in self.Models:
+            layout['Models'].append(size)
+            if model.Name != 'DEADBEEF':
+                size += 12
+            size += 136
+            size += model.Geometry.NumVertices * 12
+            size += model.Geometry.NumTriangles * TriangleDtype('<').itemsize
+            if model.Name == 'DEADBEEF':
+                size += 36
+        
+        layout['Size'] = size
+        return layout
+    
+    def Write(self, bigEndian: bool) -> bytearray:
+        buffer = bytearray(self.GetLayout()['Size'])
+        self.WriteInto(buffer, bigEndian)
+        return buffer
+    
+    def WriteInto(self, buffer: bytearray, bigEndian: bool, offset: int = 0) -> int:
+        #Fill a preallocated buffer (bytearray, mmap, ...), returns the end offset
+        writer = BufferWriter(buffer, offset)
+        self.WriteTo(writer, bigEndian)
+        return writer.Position
+    
+    def WriteTo(self, stream, bigEndian: bool):
+        #Stream the file section by section to anything with a write() method
         byteOrder = '>' if bigEndian else '<'
         
+        u16 = Packer(byteOrder, 'H')
+        u32 = Packer(byteOrder, 'I')
+        
         isVersion1 = True
         
         sphere_objects = [obj for obj in self.Objects if obj.IsSphere]
         box_objects = [obj for obj in self.Objects if not obj.IsSphere]
         
-        writer.extend(pack(f'{byteOrder}I', len(sphere_objects)))
+        sphere_object = Packer(byteOrder, 'HH3f3ff')
+        stream.write(u32.pack(len(sphere_objects)))
         for group in sphere_objects:
-            writer.extend(pack(f'{byteOrder}H', group.Identifier1))
-            writer.extend(pack(f'{byteOrder}H', group.Identifier2))
-            writer.extend(pack(f'{byteOrder}3f', *group.Point1))
-            writer.extend(pack(f'{byteOrder}3f', *group.Point2))
-            writer.extend(pack(f'{byteOrder}f', group.Radius))
+            stream.write(sphere_object.pack(group.Identifier1, group.Identifier2, *group.Point1, *group.Point2, group.Radius))
         
-        writer.extend(pack(f'{byteOrder}I', len(box_objects)))
+        box_object = Packer(byteOrder, 'HH3f3f3f3f9f')
+        stream.write(u32.pack(len(box_objects)))
         for group in box_objects:
-            writer.extend(pack(f'{byteOrder}H', group.Identifier1))
-            writer.extend(pack(f'{byteOrder}H', group.Identifier2))
-            writer.extend(pack(f'{byteOrder}3f', *group.Point1))
-            writer.extend(pack(f'{byteOrder}3f', *group.Point2))
-            writer.extend(pack(f'{byteOrder}3f', *group.Size))
-            writer.extend(pack(f'{byteOrder}3f', *group.Rotation))
-            writer.extend(pack(f'{byteOrder}9f', *group.BoxExtra))
-        
-        writer.extend(pack(f'{byteOrder}I', 0)) #0 (maybe another object type)
-        writer.extend(pack(f'{byteOrder}I', 0)) #0
-        writer.extend(pack(f'{byteOrder}I', 0)) #0
-        writer.extend(pack(f'{byteOrder}I', 0)) #0
-        writer.extend(pack(f'{byteOrder}I', 0)) #0
-        writer.extend(pack(f'{byteOrder}I', 0)) #0
+            stream.write(box_object.pack(group.Identifier1, group.Identifier2, *group.Point1, *group.Point2, *group.Size, *group.Rotation, *group.BoxExtra))
+        
+        stream.write(Packer(byteOrder, '6I').pack(0, 0, 0, 0, 0, 0)) #0 (maybe another object type), then zeros
         
         # reorder objects by type
         self.Objects = sphere_objects + box_objects
         
         #object name offsets
+        object_name_offsets = []
         object_name_offset = 0
         for group in self.Objects:
-            writer.extend(pack(f'{byteOrder}I', object_name_offset))
+            object_name_offsets.append(object_name_offset)
             object_name_offset += len(group.Name) + 1
         
-        for group in self.Objects:
-            writer.extend(pack(f'{byteOrder}I', group.ColFlag))
+        stream.write(Packer(byteOrder, f'{len(self.Objects)}I').pack(*object_name_offsets))
+        stream.write(Packer(byteOrder, f'{len(self.Objects)}I').pack(*[group.ColFlag for group in self.Objects]))
+        stream.write(Packer(byteOrder, f'{len(self.Objects)}H').pack(*[group.NodeIndex for group in self.Objects]))
         
-        for group in self.Objects:
-            writer.extend(pack(f'{byteOrder}H', group.NodeIndex))
-        
-        string_table = BuildStringTable([group.Name for group in self.Objects])
-        writer.extend(pack(f'{byteOrder}I', len(string_table)))
-        writer.extend(string_table)
+        string_table = CsbFile.BuildStringTable([group.Name for group in self.Objects])
+        stream.write(u32.pack(len(string_table)))
+        stream.write(string_table)
         
         #Only select the first model 
         #Additional models don't use a combined buffer
         meshes = self.Models[0].Meshes
         
-        writer.extend(pack(f'{byteOrder}I', len(meshes))) #mesh count
+        mesh_array = Packer(byteOrder, f'{len(meshes)}I')
+        
+        stream.write(u32.pack(len(meshes))) #mesh count
         
         #name offsets
+        name_offsets = []
         name_offset = 0
         for mesh in meshes:
-            writer.extend(pack(f'{byteOrder}I', name_offset))
+            name_offsets.append(name_offset)
             name_offset += len(mesh.Name) + 1
+        stream.write(mesh_array.pack(*name_offsets))
         #triangle start indices
-        tri_index = 0
         tri_start_indexes = []
+        tri_index = 0
         for mesh in meshes:
-            writer.extend(pack(f'{byteOrder}I', tri_index))
             tri_start_indexes.append(tri_index)
             tri_index += mesh.NumTriangles
+        stream.write(mesh_array.pack(*tri_start_indexes))
         #vertex start indices
-        vtx_index = 0
         vtx_start_indexes = []
+        vtx_index = 0
         for mesh in meshes:
-            writer.extend(pack(f'{byteOrder}I', vtx_index))
             vtx_start_indexes.append(vtx_index)
             vtx_index += mesh.NumVertices
+        stream.write(mesh_array.pack(*vtx_start_indexes))
         #uint32 flags
-        for mesh in meshes:
-            writer.extend(pack(f'{byteOrder}I', mesh.ColFlag))
+        stream.write(mesh_array.pack(*[mesh.ColFlag for mesh in meshes]))
         #uint32 material attributes
-        for mesh in meshes:
-            writer.extend(pack(f'{byteOrder}I', mesh.MaterialAttribute))
+        stream.write(mesh_array.pack(*[mesh.MaterialAttribute for mesh in meshes]))
         #node indices
-        for mesh in meshes:
-            writer.extend(pack(f'{byteOrder}H', mesh.NodeIndex))
+        stream.write(Packer(byteOrder, f'{len(meshes)}H').pack(*[mesh.NodeIndex for mesh in meshes]))
         #build string table
-        node_string_table = BuildStringTable([mesh.Name for mesh in meshes])
-        writer.extend(pack(f'{byteOrder}I', len(node_string_table)))
-        writer.extend(node_string_table)
+        node_string_table = CsbFile.BuildStringTable([mesh.Name for mesh in meshes])
+        stream.write(u32.pack(len(node_string_table)))
+        stream.write(node_string_table)
         
         #nodes
-        writer.extend(pack(f'{byteOrder}H', len(self.Nodes)))
-        for node in self.Nodes:
-            writer.extend(pack(f'{byteOrder}H', node.ID))
-            writer.extend(pack(f'{byteOrder}B', node.Flags))
-            writer.extend(pack(f'{byteOrder}b', node.NumChildren))
-        
-        writer.extend(pack(f'{byteOrder}I', 1))
-        writer.extend(b'\x00\x00\x00\x00\x00\x00\x00\x00')
+        node = Packer(byteOrder, 'HBb')
+        stream.write(u16.pack(len(self.Nodes)))
+        for n in self.Nodes:
+            stream.write(node.pack(n.ID, n.Flags, n.NumChildren))
+        
+        stream.write(u32.pack(1))
+        stream.write(b'\x00\x00\x00\x00\x00\x00\x00\x00')
+        
+        split_header = Packer(byteOrder, 'IHHHH')
+        model_header = Packer(byteOrder, 'III3f3f3f6f')
         for model in self.Models:
             if model.Name != 'DEADBEEF':
-                writer.extend(pack(f'{byteOrder}I', model.Unknown0))
-                writer.extend(pack(f'{byteOrder}I', model.NodeIndex))
-                writer.extend(pack(f'{byteOrder}H', model.ColFlag))
-                writer.extend(pack(f'{byteOrder}H', model.MaterialAttribute))
+                #node index is a u16 followed by padding, as Read expects
+                stream.write(split_header.pack(model.Unknown0, model.NodeIndex, 0, model.ColFlag, model.MaterialAttribute))
+            
+            name = model.Name.encode('utf-8')
+            stream.write(name + b'\x00' * (64 - len(name)))
+            stream.write(model_header.pack(model.Unknown5, model.NumVertices, model.NumTriangles,
+                *model.Zero, *model.Translate, *model.Rotation, *model.Bounding.Min, *model.Bounding.Max))
             
-            writer.extend(model.Name.encode('utf-8'))
-            writer.extend(b'\x00' * (64 - len(model.Name.encode('utf-8'))))
-            writer.extend(pack(f'{byteOrder}I', model.Unknown5))
-            writer.extend(pack(f'{byteOrder}I', model.NumVertices))
-            writer.extend(pack(f'{byteOrder}I', model.NumTriangles))
-            writer.extend(pack(f'{byteOrder}3f', *model.Zero))
-            writer.extend(pack(f'{byteOrder}3f', *model.Translate))
-            writer.extend(pack(f'{byteOrder}3f', *model.Rotation))
-            writer.extend(pack(f'{byteOrder}6f', *model.Bounding.Min, *model.Bounding.Max))
+            #geometry goes out as one block each
+            geometry = model.Geometry
+            stream.write(geometry.Positions.astype(f'{byteOrder}f4', copy=False).tobytes())
+            
+            tris = np.empty(geometry.NumTriangles, dtype=TriangleDtype(byteOrder))
+            tris['A'] = geometry.Indices[:, 0]
+            tris['B'] = geometry.Indices[:, 1]
+            tris['C'] = geometry.Indices[:, 2]
+            tris['Normal'] = geometry.Normals
+            stream.write(tris.tobytes())
+            del tris
             
-            for pos in model.Positions:
-                writer.extend(pack(f'{byteOrder}3f', *pos))
-            for tri in model.Triangles:
-                writer.extend(pack(f'{byteOrder}I', tri.A))
-                writer.extend(pack(f'{byteOrder}I', tri.B))
-                writer.extend(pack(f'{byteOrder}I', tri.C))
-                writer.extend(pack(f'{byteOrder}3f', *tri.Normal))
             if model.Name == 'DEADBEEF': #DEADBEEF model where it has model list and total bounding of sub models
-                writer.extend(pack(f'{byteOrder}I', 0))
-                writer.extend(b'\x00\x00\x00\x00')
-                writer.extend(pack(f'{byteOrder}I', len(self.Models) - 1))
-                writer.extend(pack(f'{byteOrder}6f', *self.SubModelBounding.Min, *self.SubModelBounding.Max))
-        return writer
+                stream.write(u32.pack(0))
+                stream.write(b'\x00\x00\x00\x00')
+                stream.write(u32.pack(len(self.Models) - 1))
+                stream.write(Packer(byteOrder, '6f').pack(*self.SubModelBounding.Min, *self.SubModelBounding.Max))
     
-    def __init__(self, stream: bytearray = None, bigEndian: bool = False):
+    def __init__(self, stream: bytearray = None, bigEndian: bool = False, lazy: bool = False):
+        self.Models = []
+        self.Nodes = []
+        self.Objects = []
+        self.SubModelBounding = BoundingBox()
+        self._mapping = None #file mapping of Open, closed by Close
+        
         if not stream is None:
-            self.Read(stream, bigEndian)
+            self.Read(stream, bigEndian, lazy)
+    
+    def Close(self):
+        #Releases the file mapping of Open (on Windows it keeps the file from being overwritten).
+        #Everything read stays usable: decoded geometry and the bytes of geometry not decoded yet
+        #are copied out of the mapping first. Geometry arrays taken before Close point into the mapping,
+        #while any of them are still alive the mapping is left to the garbage collector instead.
+        if self._mapping is None:
+            return
+        mapping = self._mapping
+        self._mapping = None
+        for model in self.Models:
+            model.Detach()
+        try:
+            mapping.close()
+        except BufferError:
+            pass
+    
+    def __enter__(self) -> 'CsbFile':
+        return self
+    
+    def __exit__(self, *exception):
+        self.Close()
+
+def Open(filePath: str, bigEndian: bool = False, lazy: bool = True) -> CsbFile:
+    #Map the file instead of reading it, only the headers and name tables are parsed up front
+    #and each model's geometry is decoded from the mapping when it is first accessed.
+    #The caller closes the mapping with Close() or by using the CsbFile in a with block.
+    with open(filePath, 'rb') as file:
+        reader = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    csb = CsbFile(reader, bigEndian, lazy)
+    csb._mapping = reader
+    return csb
@@ -1,267 +1,217 @@
-from collada import *
 from CsbFile import CsbFile
-from CtbFile import CtbFile
+from CtbFile import CacheParameters, GenerateBytes
+from OutputCache import OutputCache
 from CsbExporter import Export
-from Triangle import *
+from Geometry import Geometry
+from SceneBuilder import SceneNode, BuildCsb
+from GlbImporter import ImportFromGlb
+from GeometryCleanup import WeldVertices, CullTriangles, CullReport
+from OctreeTuning import TuneParameters
 
 import numpy as np
-from math import radians
-from scipy.spatial.transform import Rotation
+from xml.etree import ElementTree
 
-epsilon = 1e-9
+def LocalName(tag: str) -> str:
+    #tag without its {namespace}
+    return tag.rsplit('}', 1)[-1]
 
-def DecomposeMatrix(matrix: np.ndarray) -> (list, list, list):
-    # Extract translation
-    translation = matrix[:3, 3]
+def ParseArray(text: str, dtype) -> np.ndarray:
+    #whole float_array/<p> blocks in one call
+    return np.fromstring(text or '', dtype=dtype, sep=' ')
 
-    # Extract scale (length of each axis vector)
-    scale = np.linalg.norm(matrix[:3, :3], axis=0)
+def RotationMatrix(x, y, z, angle) -> np.ndarray:
+    #float32 math like earlier (pycollada based) imports used, so re-imported transforms come out the same
+    c = np.cos(angle)
+    s = np.sin(angle)
+    t = (1 - c)
+    return np.array([[t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0],
+                     [t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0],
+                     [t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0],
+                     [0, 0, 0, 1]], dtype=np.float32)
 
-    # Remove scale from the rotation matrix
-    rotation_matrix = matrix[:3, :3] / scale
+def ReadTransform(element) -> np.ndarray:
+    #4x4 float32 matrix of a <translate>, <rotate>, <scale> or <matrix>, None for anything else
+    tag = LocalName(element.tag)
+    floats = ParseArray(element.text, np.float32)
+    matrix = np.identity(4, dtype=np.float32)
+    if tag == 'translate':
+        matrix[:3, 3] = floats[:3]
+    elif tag == 'rotate':
+        matrix = RotationMatrix(floats[0], floats[1], floats[2], floats[3] * np.pi / 180.0)
+    elif tag == 'scale':
+        matrix[0, 0], matrix[1, 1], matrix[2, 2] = floats[:3]
+    elif tag == 'matrix':
+        matrix = floats.reshape(4, 4)
+    else:
+        return None
+    return matrix
 
-    # Convert rotation matrix to Euler angles
-    # Assumes XYZ rotation order (can be adjusted as needed)
-    rotation = Rotation.from_matrix(rotation_matrix)
-    eulerAngles = rotation.as_euler('xyz', degrees=True)
-    eulerAngles = [radians(a) for a in eulerAngles]
-
-    return translation, eulerAngles, scale
-
-def ImportFromDae(filePath: str, is_map_object: bool = False):
-    triID = 0
+def ReadGeometry(element) -> Geometry:
+    #First <triangles>/<polylist> of a <geometry>, triangles use the face normal of their first corner
+    mesh = next((x for x in element if LocalName(x.tag) == 'mesh'), None)
+    if mesh is None:
+        return Geometry()
     
-    def getValues(materials: list):
-        #try to detect the material and flags via material name
-        identifiers = [None, None]
-        MaterialAttribute = 0
-        ColFlag = 0
-        
-        if materials:
-            mat = materials[0].target.name
-            values = mat.split('_')
-            for v in values:
-                if v.startswith('MAT'):
-                    MaterialAttribute = int(v.replace('MAT', ''))
-                elif v.startswith('FLAG'):
-                    ColFlag = int(v.replace('FLAG', ''))
-                elif v.startswith('ID-A'):
-                    identifiers[0] = int(v.replace('ID-A', ''))           
-                elif v.startswith('ID-B'):
-                    identifiers[1] = int(v.replace('ID-B', ''))
-            return MaterialAttribute, ColFlag, identifiers
-        else:
-            return 0, 0
+    sources = {}
+    vertices = {}
+    primitive = None
+    for child in mesh:
+        tag = LocalName(child.tag)
+        if tag == 'source':
+            floats = next((x for x in child if LocalName(x.tag) == 'float_array'), None)
+            accessor = child.find('.//{*}accessor')
+            stride = int(accessor.get('stride', 1)) if accessor is not None else 3
+            data = ParseArray(floats.text if floats is not None else '', np.float32)
+            sources[child.get('id')] = data[:len(data) - len(data) % stride].reshape(-1, stride)
+        elif tag == 'vertices':
+            vertices[child.get('id')] = {x.get('semantic'): x.get('source', '')[1:] for x in child if LocalName(x.tag) == 'input'}
+        elif tag in ('triangles', 'polylist') and primitive is None:
+            primitive = child
+    
+    if primitive is None:
+        return Geometry()
+    
+    inputs = {x.get('semantic'): (int(x.get('offset', 0)), x.get('source', '')[1:]) for x in primitive if LocalName(x.tag) == 'input'}
+    stride = max(offset for offset, _ in inputs.values()) + 1 if inputs else 1
+    vertexOffset, vertexSource = inputs.get('VERTEX', (0, ''))
+    vertexInputs = vertices.get(vertexSource, {})
+    positions = sources.get(vertexInputs.get('POSITION'), np.zeros((0, 3), dtype=np.float32))[:, :3]
     
-    def ImportMapObject(node: CsbFile.Node, mats: list, isSphere: bool = False):
-        nonlocal csb, ID
-        newColObject = csb.CollisionObject()
-        
-        newColObject.IsSphere = isSphere
-        
-        t, r, s = DecomposeMatrix(node.matrix)
-        newColObject.Point1 = newColObject.Point2 = t
-        
-        if isSphere:
-            newColObject.Radius = s[0] if s[0] > epsilon else epsilon
+    p = primitive.find('{*}p')
+    corners = ParseArray(p.text if p is not None else '', np.int32)
+    corners = corners[:len(corners) - len(corners) % stride].reshape(-1, stride)
+    
+    if LocalName(primitive.tag) == 'polylist':
+        #fan triangulate the polygons
+        vcount = primitive.find('{*}vcount')
+        counts = ParseArray(vcount.text if vcount is not None else '', np.int64)
+        starts = np.cumsum(counts) - counts
+        fans = np.maximum(counts - 2, 0)
+        first = np.repeat(starts, fans)
+        step = np.arange(fans.sum()) - np.repeat(np.cumsum(fans) - fans, fans)
+        corners = corners[np.stack([first, first + step + 1, first + step + 2], axis=1)]
+    else:
+        corners = corners[:len(corners) - len(corners) % 3].reshape(-1, 3, stride)
+    
+    indices = corners[:, :, vertexOffset].astype(np.int64)
+    normals = None
+    if 'NORMAL' in inputs and inputs['NORMAL'][1] in sources:
+        normalOffset, normalSource = inputs['NORMAL']
+        normals = sources[normalSource][corners[:, 0, normalOffset]]
+    elif vertexInputs.get('NORMAL') in sources:
+        normals = sources[vertexInputs['NORMAL']][indices[:, 0]]
+    
+    return Geometry(positions, indices, normals)
+
+def ReadDaeNode(element, pending: list) -> SceneNode:
+    #Instanced geometries get resolved once the whole file is read, their library may come after the scene
+    transforms = []
+    children = []
+    instance = None
+    for child in element:
+        tag = LocalName(child.tag)
+        if tag == 'node':
+            children.append(ReadDaeNode(child, pending))
+        elif tag == 'instance_geometry':
+            if instance is None:
+                instance = child
         else:
-            newColObject.Rotation = r 
-            newColObject.Size = [x if x > epsilon else epsilon for x in s]
-        
-        newColObject.Name = node.name.split('_')
-        newColObject.Name = newColObject.Name[2:]
-        newColObject.Name = '_'.join(newColObject.Name)
-        
-        newColObject.NodeIndex = ID - 1
-        
-        newColObject.Unknown = 0
-        
-        #print(newColObject.Name)
-        #print(newColObject.Point1)
-        #print()
-        
-        newColObject.MaterialAttribute, newColObject.ColFlag, identifiers = getValues(mats)
-        newColObject.Identifier1 = identifiers[0]
-        newColObject.Identifier2 = identifiers[1]
-        
-        csb.Objects.append(newColObject)
+            matrix = ReadTransform(child)
+            if not matrix is None:
+                transforms.append(matrix)
     
-    def ImportModelSplit(node: CsbFile.Node, geometryChild: scene.GeometryNode):
-        nonlocal csb, ID
-        newModelSplit = csb.Model()
-        
-        newModelSplit.Meshes = []
-        newModelSplit.Triangles = []
-        newModelSplit.Positions = []
-        
-        t, r, s = DecomposeMatrix(node.matrix)
-        newModelSplit.Translate = t
-        newModelSplit.Rotation = r
-        
-        newModelSplit.MaterialAttribute, newModelSplit.ColFlag, _ = getValues(geometryChild.materials)
-        
-        newModelSplit.Name = node.name.split('_')
-        newModelSplit.Name = newModelSplit.Name[1:]
-        newModelSplit.Name = '_'.join(newModelSplit.Name)
-        
-        newModelSplit.NodeIndex = ID - 1
-        
-        newModelSplit.Unknown0 = 1
-        newModelSplit.Unknown4 = 4
-        
-        newModelSplit.Positions = list(list(geometryChild.geometry.sourceById.values())[0])
-        newModelSplit.Positions = [x.tolist() for x in newModelSplit.Positions]
-        newModelSplit.NumVertices = len(newModelSplit.Positions)
-        
-        newModelSplit.Triangles = []
-        
-        if geometryChild.geometry.primitives and not geometryChild.geometry.primitives[0].vertex_index is None:
-            normalSource = geometryChild.geometry.primitives[0].normal
-            vertexSource = geometryChild.geometry.primitives[0].vertex
-            for vtxIdxData, normalIdxData in zip(geometryChild.geometry.primitives[0].vertex_index, geometryChild.geometry.primitives[0].normal_index):
-                vtxIdxData = vtxIdxData.tolist()
-                newTri = Triangle()
-                newTri.A = vtxIdxData[0]
-                newTri.B = vtxIdxData[1]
-                newTri.C = vtxIdxData[2]
-                newTri.Vertices = [vertexSource[vtxIdxData[0]], vertexSource[vtxIdxData[1]], vertexSource[vtxIdxData[2]]]
-                #print('Tri:')
-                #print(newTri.Vertices)
-                newTri.Normal = normalSource[normalIdxData[0]]
-                newModelSplit.Triangles.append(newTri)
-        
-        newModelSplit.NumTriangles = len(newModelSplit.Triangles)
-        
-        newModelSplit.Bounding.Compute(newModelSplit.Positions)
-        
-        csb.Models.append(newModelSplit)
-        
-        
+    #combined in document order, a single transform is used as it is
+    if len(transforms) == 0:
+        matrix = np.identity(4, dtype=np.float32)
+    elif len(transforms) == 1:
+        matrix = transforms[0]
+    else:
+        matrix = np.identity(4, dtype=np.float32)
+        for transform in transforms:
+            matrix = np.dot(matrix, transform)
     
-    def ImportNode(node: CsbFile.Node, root: bool = False):
-        nonlocal csb, ID, newModel, triID
-        
-        if root:
-            t, r, s = DecomposeMatrix(node.matrix)
-            newModel.Translate = t
-            newModel.Rotation = r
-        
-        newNode = csb.Node()
-        
-        newNode.ID = ID
-        ID += 1
-        
-        newNode.Flags = 0
-        
-        geometryChildren = [i for i, x in enumerate(node.children) if type(x) is scene.GeometryNode]
-        
-        newNode.NumChildren = len(node.children) - (1 if geometryChildren else 0)
-        
-        csb.Nodes.append(newNode)
-        
-        if geometryChildren:
-            geometryChild = node.children[geometryChildren[0]]
-            node.children.pop(geometryChildren[0])
-            
-            if node.name.startswith('MAPOBJ_SPHERE'):
-                ImportMapObject(node, geometryChild.materials, True)
-                newNode.Flags = 2
-            elif node.name.startswith('MAPOBJ_BOX'):
-                ImportMapObject(node, geometryChild.materials, False)
-                newNode.Flags = 3
-            elif node.name.startswith('MODELSPLIT'):
-                ImportModelSplit(node, geometryChild)
-                newNode.Flags = 1
-            else:
-                newMesh = csb.Mesh()
-                
-                newMesh.Name = node.name
-                newMesh.NodeIndex = newNode.ID
-                newNode.Flags = 0
-                
-                newMesh.MaterialAttribute, newMesh.ColFlag, _ = getValues(geometryChild.materials)
-                
-                #if len(geometryChild.geometry.primitives[0]) > 0:
-                    #print(list(list(geometryChild.geometry.sourceById.values())[0])[0])
-                    #print(list(geometryChild.geometry.primitives[0].vertex_index))
-                    #print(list(geometryChild.geometry.primitives[0].normal)[0])
-                
-                newMesh.Positions = list(list(geometryChild.geometry.sourceById.values())[0])
-                newMesh.Positions = [x.tolist() for x in newMesh.Positions]
-                newMesh.NumVertices = len(newMesh.Positions)
-                
-                newMesh.Triangles = []
-                
-                #print()
-                #print(newMesh.Name)
-                
-                if geometryChild.geometry.primitives and not geometryChild.geometry.primitives[0].vertex_index is None:
-                    normalSource = geometryChild.geometry.primitives[0].normal
-                    vertexSource = geometryChild.geometry.primitives[0].vertex
-                    for vtxIdxData, normalIdxData in zip(geometryChild.geometry.primitives[0].vertex_index, geometryChild.geometry.primitives[0].normal_index):
-                        vtxIdxData = vtxIdxData.tolist()    
-                        #print((vtxIdxData, normalIdxData))
-                        newTri = Triangle()
-                        newTri.A = vtxIdxData[0] + len(newModel.Positions)
-                        newTri.B = vtxIdxData[1] + len(newModel.Positions)
-                        newTri.C = vtxIdxData[2] + len(newModel.Positions)
-                        newTri.Vertices = [vertexSource[vtxIdxData[0]], vertexSource[vtxIdxData[1]], vertexSource[vtxIdxData[2]]]
-                        #print('Tri:')
-                        #print(newTri.Vertices)
-                        newTri.Normal = normalSource[normalIdxData[0]]
-                        newTri.ID = triID
-                        triID += 1
-                        newMesh.Triangles.append(newTri)
-                
-                newMesh.NumTriangles = len(newMesh.Triangles)
-            
-                newModel.Meshes.append(newMesh)
-                newModel.Positions.extend(newMesh.Positions)
-                newModel.Triangles.extend(newMesh.Triangles)
-                newModel.NumVertices += newMesh.NumVertices
-                newModel.NumTriangles += newMesh.NumTriangles
-                
-                if len(csb.Models) == 0:
-                    #No sub models so use defaults
-                    csb.SubModelBounding.Min = (99999.0, 99999.0, 99999.0)
-                    csb.SubModelBounding.Max = (-99999.0, -99999.0, -99999.0)
-                else:
-                    csb.SubModelBounding.Compute(sum([model.Positions for model in csb.Models], []))
-        
-        for subnode in node.children:
-            ImportNode(subnode)
+    name = element.get('name', element.get('id'))
+    if instance is None:
+        return SceneNode(name, matrix, children)
     
-    csb = CsbFile()
-    collada = Collada(filePath)
-    myscene = collada.scene
-    #settings = ImportSettings().IsMapObject = is_map_object
+    node = SceneNode(name, matrix, children, hasGeometry=True)
+    material = instance.find('.//{*}instance_material')
+    pending.append((node, instance.get('url', '')[1:], material.get('target', '')[1:] if material is not None else None))
+    return node
+
+def ImportFromDae(filePath: str, is_map_object: bool = False) -> CsbFile:
+    #Reads the file element by element, each geometry is decoded into arrays as soon as it ends
+    #and its XML freed, so the document is never in memory as a whole
+    geometries = {}
+    materials = {}
+    visualScenes = {}
+    sceneUrl = None
+    pending = []
+    
+    for _, element in ElementTree.iterparse(filePath, events=('end',)):
+        tag = LocalName(element.tag)
+        if tag == 'geometry':
+            geometries[element.get('id')] = ReadGeometry(element)
+            element.clear()
+        elif tag == 'material':
+            materials[element.get('id')] = element.get('name')
+            element.clear()
+        elif tag == 'visual_scene':
+            visualScenes[element.get('id')] = [ReadDaeNode(x, pending) for x in element if LocalName(x.tag) == 'node']
+            element.clear()
+        elif tag == 'instance_visual_scene':
+            sceneUrl = element.get('url', '')[1:]
+    
+    for node, url, target in pending:
+        node.Geometry = geometries.get(url)
+        node.Material = materials.get(target)
     
-    # DEADBEEF model
-    ID = 0
-    newModel = csb.Model()
-    for node in myscene.nodes:
-        ImportNode(node, True)
-    newModel.Bounding.Compute(newModel.Positions)
-    csb.Models.insert(0, newModel)
-    #Export(csb, f'{filePath}.re.dae')
-    #for obj in csb.Objects:
-    #    print(obj.Name)
-    #    print(obj.Point1)
-    #    print()
-    return csb
-            
+    #settings = ImportSettings().IsMapObject = is_map_object
+    nodes = visualScenes.get(sceneUrl, next(iter(visualScenes.values()), []))
+    return BuildCsb(nodes)
+
+def ImportScene(filePath: str, is_map_object: bool = False) -> CsbFile:
+    #.glb files go through the binary reader, everything else is read as Collada
+    if filePath.lower().endswith('.glb'):
+        return ImportFromGlb(filePath, is_map_object)
+    return ImportFromDae(filePath, is_map_object)
 
-def Import(filePath: str, name: str, is_big_endian: bool, is_map_object: bool):
+def GenerateCsbBytes(results: CsbFile, cache: OutputCache, key: str) -> bytes:
+    #Written csb of an imported scene, taken from the cache when the same scene was written before
+    data = cache.Load(key, 'csb')
+    if data is None:
+        data = bytes(results.Write(False))
+        cache.Save(key, 'csb', data)
+    else:
+        print("Scene unchanged, using the cached csb")
+    return data
+
+def Import(filePath: str, name: str, is_big_endian: bool, is_map_object: bool, exact_overlap: bool = False, jobs: int = 1, bottom_up: bool = False, max_triangles: int = 10, max_depth: int = 5, cache: OutputCache = None, weld: float = None, weld_combined: bool = False, cull: bool = False, cull_normals: bool = False, auto_tune: bool = False, ctb_budget: int = None):
     print("Loading file data")
     
-    results = ImportFromDae(filePath, is_map_object)
+    results = ImportScene(filePath, is_map_object)
     
-    open(f'{name}_output.csb', 'wb').write(results.Write(False))
+    if weld is not None:
+        before, after = WeldVertices(results, weld, weld_combined)
+        print(f"Welded {before} vertices into {after}")
     
-    #Generate a collision table
-    ctbfile = CtbFile()
-    ctbfile.Generate(results)
+    if cull:
+        print(CullReport(CullTriangles(results, checkNormals=cull_normals)))
+    
+    if auto_tune:
+        max_triangles, max_depth = TuneParameters(results, ctb_budget)
     
-    open(f'{name}_output.ctb', 'wb').write(ctbfile.Write(False))
+    key = None
+    if cache is None:
+        with open(f'{name}_output.csb', 'wb') as file:
+            results.WriteTo(file, False)
+    else:
+        key = cache.Key(results, CacheParameters(exact_overlap, max_triangles, max_depth), False)
+        open(f'{name}_output.csb', 'wb').write(GenerateCsbBytes(results, cache, key))
+    
+    #Generate a collision table
+    data = GenerateBytes(results, False, exact_overlap, jobs, bottom_up, max_triangles, max_depth, cache, key)
+    if data:
+        open(f'{name}_output.ctb', 'wb').write(data)
     
     
\ No newline at end of file
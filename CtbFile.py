@@ -1,7 +1,33 @@
 from CsbFile import CsbFile
 import OctreeGenerator
 
-from struct import pack
+from struct import pack, unpack_from
+import numpy as np
+
+def NodeDtype(byteOrder: str) -> np.dtype:
+    #28 bytes per node
+    return np.dtype([
+        ('position', f'{byteOrder}f4', (3,)),
+        ('size', f'{byteOrder}f4'),
+        ('node_id', f'{byteOrder}u4'),
+        ('child_bits', 'u1'),
+        ('root_flag', 'u1'),
+        ('padding', f'{byteOrder}u2'),
+        ('num_triangles', f'{byteOrder}u4'),
+    ])
+
+def OctreeRoot(model: CsbFile.Model) -> (tuple, float):
+    #Center and half size of the root node, a square around the model's XZ bounds
+    Min = model.Bounding.Min
+    Max = model.Bounding.Max
+    center = [(a + b) / 2 for a, b in zip(Min, Max)]
+    
+    scale = max(Max[0] - Min[0], Max[2] - Min[2])
+    #largest scale halved, but slightly scaled up
+    #Unsure how this is really handled. 
+    root_scale = scale / 2
+    root_position = (center[0], 0, center[2])
+    return root_position, root_scale
 
 class CtbFile:
     num_model_groups = 1
@@ -18,29 +44,88 @@ class CtbFile:
         padding = 0xCCCC #int
         num_triangles = None #int
         
-        TriangleIndices = None #list[int]
+        TriangleIndices = None #np.ndarray[uint32], sorted
         def __init__(self):
             self.Children = list() #list[Node]
     
     Nodes = list() #list[Node]
     
-    def GetTriangles(self, node: OctreeGenerator.OctreeNode):
-        if node is None: return list()
+    #Flat arrays filled by Read
+    NodeTable = None #np.ndarray[NodeDtype], nodes in file (pre-order) order
+    IndexPool = None #np.ndarray[uint32], every node's triangle indices back to back
+    IndexOffsets = None #np.ndarray[int64], start of each node's indices in IndexPool, plus the end
+    ChildNodes = None #np.ndarray[int32] nodes x 8, table index of the child in each slot or -1
+    
+    def __init__(self, stream: bytearray = None, bigEndian: bool = False):
+        self.Nodes = list()
         
-        indices = []
-        indices.extend([x.ID for x in node.Triangles])
+        if not stream is None:
+            self.Read(stream, bigEndian)
+    
+    def Read(self, reader: bytearray, bigEndian: bool = False):
+        byteOrder = '>' if bigEndian else '<'
         
-        for i in range(len(node.Children)):
-            indices.extend(self.GetTriangles(node.Children[i]))
+        readOffset = 12
+        self.num_model_groups, = unpack_from(f'{byteOrder}I', reader, readOffset)
+        readOffset += 4
+        self.root_size, self.unk, *self.root_position = unpack_from(f'{byteOrder}5f', reader, readOffset)
+        readOffset += 20
+        numNodes, _ = unpack_from(f'{byteOrder}2I', reader, readOffset)
+        readOffset += 8
+        
+        dtype = NodeDtype(byteOrder)
+        self.NodeTable = np.frombuffer(reader, dtype=dtype, count=numNodes, offset=readOffset)
+        readOffset += numNodes * dtype.itemsize
         
-        return sorted(list(dict.fromkeys(indices)))
+        counts = self.NodeTable['num_triangles'].astype(np.int64)
+        self.IndexOffsets = np.zeros(numNodes + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.IndexOffsets[1:])
+        self.IndexPool = np.frombuffer(reader, dtype=f'{byteOrder}u4', count=int(self.IndexOffsets[-1]), offset=readOffset)
+        
+        #Nodes are stored depth first, each followed by its children in slot order,
+        #one child for every bit set in child_bits
+        self.ChildNodes = np.full((numNodes, 8), -1, dtype=np.int32)
+        childBits = self.NodeTable['child_bits'].tolist()
+        stack = [(0, bit) for bit in reversed(range(8)) if numNodes and childBits[0] & (1 << bit)]
+        index = 1
+        while stack:
+            parent, slot = stack.pop()
+            self.ChildNodes[parent, slot] = index
+            stack.extend((index, bit) for bit in reversed(range(8)) if childBits[index] & (1 << bit))
+            index += 1
+    
+    def GetNodeTriangles(self, index: int) -> np.ndarray:
+        #Triangle indices stored for a node of the read table
+        return self.IndexPool[self.IndexOffsets[index] : self.IndexOffsets[index + 1]]
     
-    def SetupOctree(self, node: OctreeGenerator.OctreeNode, cTreeNode: Node):
+    def GetTriangleSets(self, octree: OctreeGenerator.OctreeNode) -> dict:
+        #Sorted unique triangle ids of every subtree, built in one post-order pass where
+        #each node only merges its own triangles with its children's finished sets
+        sets = {}
+        stack = [(octree, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.Children if child is not None)
+                continue
+            
+            parts = [np.asarray(node.Triangles, dtype=np.uint32)]
+            parts.extend(sets[child] for child in node.Children if child is not None)
+            sets[node] = np.unique(np.concatenate(parts))
+        return sets
+    
+    def GetTriangles(self, node: OctreeGenerator.OctreeNode):
+        if node is None: return list()
+        
+        return self.GetTriangleSets(node)[node].tolist()
+    
+    def SetupOctree(self, node: OctreeGenerator.OctreeNode, cTreeNode: Node, sets: dict):
         for i in range(len(node.Children)):
             if node.Children[i] is None:
                 continue
             
-            triangles = self.GetTriangles(node.Children[i])
+            triangles = sets[node.Children[i]]
             if len(triangles) == 0:
                 continue
             
@@ -57,7 +142,7 @@ class CtbFile:
             
             c.TriangleIndices = triangles
             
-            c = self.SetupOctree(node.Children[i], c)
+            c = self.SetupOctree(node.Children[i], c, sets)
             
             cTreeNode.Children.append(c)
         self.id += 8
@@ -70,69 +155,94 @@ class CtbFile:
             nodes.extend(self.GetNodesRecursive(child))
         return nodes
     
-    def Generate(self, csbFile: CsbFile):
-        print('Generating collision table binary')
-        
-        #CTB only gets used for singular csb model files
-        model = csbFile.Models[0]
-        # No triangles to search for, skip
-        if len(model.Triangles) == 0:
-            return
-        
-        Min = model.Bounding.Min
-        Max = model.Bounding.Max
-        size = [b - a for a, b in zip(Min, Max)]
-        center = [(a + b) / 2 for a, b in zip(Min, Max)]
-        
-        scale = max(Max[0] - Min[0], Max[2] - Min[2])
-        #largest scale halved, but slightly scaled up
-        #Unsure how this is really handled. 
-        root_scale = scale / 2
-        root_position = (center[0], 0, center[2])
-        
-        octree = OctreeGenerator.Generate(root_position, root_scale, model.Triangles)
+    def BuildNodes(self, octree: OctreeGenerator.OctreeNode, root_position: list[float], root_scale: float):
+        sets = self.GetTriangleSets(octree)
         
         root = self.Node()
         root.root_flag = 0xCC
         
-        root.TriangleIndices = self.GetTriangles(octree)
+        root.TriangleIndices = sets[octree]
         root.position = root_position
         root.size = root_scale
         root.node_id = 1
         
         self.id = 2
-        root = self.SetupOctree(octree, root)
+        root = self.SetupOctree(octree, root, sets)
         self.Nodes = self.GetNodesRecursive(root)
     
+    def Generate(self, csbFile: CsbFile, exactOverlap: bool = False, jobs: int = 1, bottomUp: bool = False, maxTrianglesPerNode: int = 10, maxDepth: int = 5):
+        print('Generating collision table binary')
+        
+        #CTB only gets used for singular csb model files
+        model = csbFile.Models[0]
+        # No triangles to search for, skip
+        if model.Geometry.NumTriangles == 0:
+            return
+        
+        root_position, root_scale = OctreeRoot(model)
+        
+        if bottomUp and not exactOverlap:
+            #the grid builder only knows the conservative overlap test
+            octree = OctreeGenerator.GenerateBottomUp(root_position, root_scale, model.Geometry, maxTrianglesPerNode, maxDepth)
+            self.BuildNodes(octree, root_position, root_scale)
+            return
+        
+        octree = OctreeGenerator.Octree(root_position, root_scale, maxTrianglesPerNode, maxDepth, exactOverlap)
+        octree.Build(model.Geometry, jobs)
+        self.BuildNodes(octree.root, root_position, root_scale)
+        
+        if exactOverlap and octree.LeafAabbTriangles:
+            #the AABB test ran on the same cells first, so its counts show what the exact test saved without a second build
+            reduction = 100 * (octree.LeafAabbTriangles - octree.LeafTriangles) / octree.LeafAabbTriangles
+            print(f'Exact overlap test: {octree.LeafTriangles} leaf triangles instead of {octree.LeafAabbTriangles} ({reduction:.1f}% fewer)')
+    
     def Write(self, big_endian: bool = False):
         byteOrder = '>' if big_endian else '<'
         
+        if self.Nodes:
+            nodes = np.zeros(len(self.Nodes), dtype=NodeDtype(byteOrder))
+            nodes['position'] = [node.position for node in self.Nodes]
+            nodes['size'] = [node.size for node in self.Nodes]
+            nodes['node_id'] = [node.node_id for node in self.Nodes]
+            nodes['child_bits'] = [node.child_bits for node in self.Nodes]
+            nodes['root_flag'] = [node.root_flag for node in self.Nodes]
+            nodes['padding'] = [node.padding for node in self.Nodes]
+            nodes['num_triangles'] = [len(node.TriangleIndices) for node in self.Nodes]
+            
+            indices = np.concatenate([np.asarray(node.TriangleIndices, dtype=np.uint32) for node in self.Nodes])
+        else:
+            #Read file, write its tables back as they are
+            nodes = self.NodeTable.astype(NodeDtype(byteOrder))
+            indices = self.IndexPool
+        
         writer = bytearray()
-        writer.extend(pack(f'{byteOrder}I', 0))
-        writer.extend(pack(f'{byteOrder}I', 0))
-        writer.extend(pack(f'{byteOrder}I', 0))
-        writer.extend(pack(f'{byteOrder}I', self.num_model_groups))
-        writer.extend(pack(f'{byteOrder}f', self.Nodes[0].size))
-        writer.extend(pack(f'{byteOrder}f', self.unk))
-        writer.extend(pack(f'{byteOrder}f', self.Nodes[0].position[0]))
-        writer.extend(pack(f'{byteOrder}f', self.Nodes[0].position[1]))
-        writer.extend(pack(f'{byteOrder}f', self.Nodes[0].position[2]))
-        writer.extend(pack(f'{byteOrder}I', len(self.Nodes)))
-        writer.extend(pack(f'{byteOrder}I', len(self.Nodes[0].TriangleIndices)))
-        for node in self.Nodes:
-            writer.extend(pack(f'{byteOrder}f', node.position[0]))
-            writer.extend(pack(f'{byteOrder}f', node.position[1]))
-            writer.extend(pack(f'{byteOrder}f', node.position[2]))
-            writer.extend(pack(f'{byteOrder}f', node.size))
-            writer.extend(pack(f'{byteOrder}I', node.node_id))
-            writer.extend(pack(f'{byteOrder}B', node.child_bits))
-            writer.extend(pack(f'{byteOrder}B', node.root_flag))
-            writer.extend(pack(f'{byteOrder}H', node.padding))
-            writer.extend(pack(f'{byteOrder}I', len(node.TriangleIndices)))
-        
-        for node in self.Nodes:
-            for index in node.TriangleIndices:
-                writer.extend(pack(f'{byteOrder}I', index))
+        writer.extend(pack(f'{byteOrder}4I', 0, 0, 0, self.num_model_groups))
+        writer.extend(pack(f'{byteOrder}5f', nodes[0]['size'], self.unk, *nodes[0]['position'].tolist()))
+        writer.extend(pack(f'{byteOrder}2I', len(nodes), nodes[0]['num_triangles']))
+        writer.extend(nodes.tobytes())
+        writer.extend(indices.astype(f'{byteOrder}u4', copy=False).tobytes())
         
         return writer
-    
\ No newline at end of file
+
+def CacheParameters(exactOverlap: bool, maxTrianglesPerNode: int, maxDepth: int) -> dict:
+    #Settings that change the generated table, the builder and the job count don't
+    return {'exact': bool(exactOverlap), 'max_triangles': maxTrianglesPerNode, 'max_depth': maxDepth}
+
+def GenerateBytes(csbFile: CsbFile, bigEndian: bool = False, exactOverlap: bool = False, jobs: int = 1, bottomUp: bool = False, maxTrianglesPerNode: int = 10, maxDepth: int = 5, cache = None, key: str = None) -> bytes:
+    #Written table of a csb, empty when it has no triangles.
+    #With an OutputCache the table is only generated when no entry for the same input exists.
+    if cache is not None:
+        if key is None:
+            key = cache.Key(csbFile, CacheParameters(exactOverlap, maxTrianglesPerNode, maxDepth), bigEndian)
+        data = cache.Load(key, 'ctb')
+        if data is not None:
+            print('Collision table unchanged, using the cached one')
+            return data
+    
+    ctbfile = CtbFile()
+    ctbfile.Generate(csbFile, exactOverlap, jobs, bottomUp, maxTrianglesPerNode, maxDepth)
+    data = bytes(ctbfile.Write(bigEndian)) if ctbfile.Nodes else b''
+    
+    if cache is not None:
+        cache.Save(key, 'ctb', data)
+    return data
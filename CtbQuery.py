@@ -0,0 +1,163 @@
+from CsbFile import CsbFile
+from CtbFile import CtbFile
+import TriangleHelper
+import numpy as np
+
+#Nodes only divide width and depth, every node spans the same height band (see TriangleHelper)
+box_height = 10000.0
+
+class CtbQuery:
+    #Spatial queries against a read CtbFile and the CsbFile it was generated for.
+    #The CTB stores triangle indices into the DEADBEEF model (Models[0]).
+    
+    #Rays handled per batch, bounds the memory of the ray/node and ray/triangle pairs
+    ChunkSize = 16384
+    #Ray/triangle pairs tested at once
+    PairBlockSize = 1 << 18
+    
+    def __init__(self, ctb: CtbFile, csb: CsbFile):
+        self.Ctb = ctb
+        self.Csb = csb
+        self.Vertices = csb.Models[0].Geometry.TriangleVertices().astype(np.float64)
+        
+        table = ctb.NodeTable
+        halfSize = table['size'].astype(np.float64)[:, None] * np.array([1.0, 0.0, 1.0]) + np.array([0.0, box_height, 0.0])
+        self.NodePositions = table['position'].astype(np.float64)
+        self.NodeMin = self.NodePositions - halfSize
+        self.NodeMax = self.NodePositions + halfSize
+        self.IsLeaf = table['child_bits'] == 0
+    
+    def FindLeaves(self, points: np.ndarray) -> np.ndarray:
+        #Descends like the runtime, picking the child slot from the side of the node center
+        #the point is on (bit 0 +x, bit 1 +z). Returns the leaf's table index or -1 when the
+        #point is outside the root or ends up in an empty child.
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        nodes = np.where(np.all((points >= self.NodeMin[0]) & (points <= self.NodeMax[0]), axis=1), 0, -1)
+        
+        active = np.flatnonzero(nodes >= 0)
+        while len(active):
+            current = nodes[active]
+            inner = ~self.IsLeaf[current]
+            active = active[inner]
+            current = current[inner]
+            
+            center = self.NodePositions[current]
+            slot = (points[active, 0] >= center[:, 0]).astype(np.int64) | ((points[active, 2] >= center[:, 2]).astype(np.int64) << 1)
+            nodes[active] = self.Ctb.ChildNodes[current, slot]
+            active = active[nodes[active] >= 0]
+        return nodes
+    
+    def FindLeaf(self, point: list[float]) -> int:
+        return int(self.FindLeaves(point)[0])
+    
+    def GetCandidates(self, point: list[float]) -> np.ndarray:
+        #Triangles the game would test for a point, empty outside the tree
+        leaf = self.FindLeaf(point)
+        if leaf < 0:
+            return np.zeros(0, dtype=np.uint32)
+        return self.Ctb.GetNodeTriangles(leaf)
+    
+    def QueryAabb(self, boxMin: list[float], boxMax: list[float]) -> np.ndarray:
+        #Sorted triangle indices whose bounds overlap the box, gathered from the leaves it touches
+        boxMin = np.asarray(boxMin, dtype=np.float64)
+        boxMax = np.asarray(boxMax, dtype=np.float64)
+        
+        leaves = []
+        stack = [0] if len(self.IsLeaf) else []
+        while stack:
+            node = stack.pop()
+            if not np.all((self.NodeMin[node] <= boxMax) & (self.NodeMax[node] >= boxMin)):
+                continue
+            if self.IsLeaf[node]:
+                leaves.append(self.Ctb.GetNodeTriangles(node))
+            else:
+                stack.extend(int(child) for child in self.Ctb.ChildNodes[node] if child >= 0)
+        
+        if not leaves:
+            return np.zeros(0, dtype=np.uint32)
+        candidates = np.unique(np.concatenate(leaves))
+        
+        triangleMin, triangleMax = TriangleHelper.TriangleBounds(self.Vertices[candidates])
+        return candidates[np.all((triangleMin <= boxMax) & (triangleMax >= boxMin), axis=1)]
+    
+    def Raycast(self, origins: np.ndarray, directions: np.ndarray, maxDistance: float = np.inf) -> (np.ndarray, np.ndarray):
+        #Closest hit of every ray, distances are in multiples of the direction.
+        #Returns the triangle index (-1 for a miss) and the distance (inf for a miss).
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        maxDistance = np.broadcast_to(np.asarray(maxDistance, dtype=np.float64), len(origins))
+        
+        triangles = np.full(len(origins), -1, dtype=np.int64)
+        distances = np.full(len(origins), np.inf)
+        for start in range(0, len(origins), self.ChunkSize):
+            end = min(start + self.ChunkSize, len(origins))
+            triangles[start:end], distances[start:end] = self.RaycastChunk(origins[start:end], directions[start:end], maxDistance[start:end])
+        return triangles, distances
+    
+    def SegmentCast(self, starts: np.ndarray, ends: np.ndarray) -> (np.ndarray, np.ndarray):
+        #First hit along every segment, the distance is the fraction of the segment (0 to 1)
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 3)
+        return self.Raycast(starts, ends - starts, 1.0)
+    
+    def RaycastChunk(self, origins: np.ndarray, directions: np.ndarray, maxDistance: np.ndarray) -> (np.ndarray, np.ndarray):
+        with np.errstate(divide='ignore'):
+            inverse = 1.0 / directions
+        
+        #Walk the tree for all rays at once, one level per step, keeping (ray, node) pairs whose boxes are hit
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+        leafRays = []
+        leafNodes = []
+        while len(rays):
+            hit = TriangleHelper.RaysBoxesIntersect(origins[rays], inverse[rays], self.NodeMin[nodes], self.NodeMax[nodes], maxDistance[rays])
+            rays = rays[hit]
+            nodes = nodes[hit]
+            
+            leaf = self.IsLeaf[nodes]
+            leafRays.append(rays[leaf])
+            leafNodes.append(nodes[leaf])
+            
+            children = self.Ctb.ChildNodes[nodes[~leaf]]
+            present = children >= 0
+            rays = np.repeat(rays[~leaf], present.sum(axis=1))
+            nodes = children[present].astype(np.int64)
+        
+        rays = np.concatenate(leafRays)
+        nodes = np.concatenate(leafNodes)
+        
+        triangles = np.full(len(origins), -1, dtype=np.int64)
+        distances = np.full(len(origins), np.inf)
+        
+        #Test the candidates of the crossed leaves in blocks of about PairBlockSize ray/triangle pairs
+        first = self.Ctb.IndexOffsets[nodes]
+        counts = self.Ctb.IndexOffsets[nodes + 1] - first
+        cumulative = np.cumsum(counts)
+        total = int(cumulative[-1]) if len(cumulative) else 0
+        bounds = np.searchsorted(cumulative, np.arange(self.PairBlockSize, total, self.PairBlockSize), side='right')
+        bounds = np.unique(np.concatenate([[0], bounds, [len(counts)]])).tolist()
+        for blockStart, blockEnd in zip(bounds[:-1], bounds[1:]):
+            block = slice(blockStart, blockEnd)
+            self.TestCandidates(origins, directions, maxDistance, rays[block], first[block], counts[block], triangles, distances)
+        return triangles, distances
+    
+    def TestCandidates(self, origins: np.ndarray, directions: np.ndarray, maxDistance: np.ndarray, rays: np.ndarray, first: np.ndarray, counts: np.ndarray, triangles: np.ndarray, distances: np.ndarray):
+        #Every candidate triangle of the given ray/leaf pairs, keeps the closest hit per ray
+        #(the lower triangle index on ties) in triangles and distances
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rays = np.repeat(rays, counts)
+        candidates = self.Ctb.IndexPool[np.repeat(first, counts) + local].astype(np.int64)
+        
+        t = TriangleHelper.RaysTrianglesIntersect(origins[rays], directions[rays], self.Vertices[candidates])
+        hit = t <= maxDistance[rays]
+        rays, candidates, t = rays[hit], candidates[hit], t[hit]
+        
+        order = np.lexsort((candidates, t, rays))
+        rays, candidates, t = rays[order], candidates[order], t[order]
+        closest = np.ones(len(rays), dtype=bool)
+        closest[1:] = rays[1:] != rays[:-1]
+        rays, candidates, t = rays[closest], candidates[closest], t[closest]
+        
+        better = (t < distances[rays]) | ((t == distances[rays]) & (candidates < triangles[rays]))
+        triangles[rays[better]] = candidates[better]
+        distances[rays[better]] = t[better]
@@ -0,0 +1,130 @@
+from collections.abc import Sequence
+from Triangle import *
+import numpy as np
+
+def AsArray(data, dtype: str, columns: int = None) -> np.ndarray:
+    #Keeps views (including byte swapped ones straight from a file) instead of copying them
+    dtype = np.dtype(dtype)
+    if data is None:
+        data = np.zeros((0, columns) if columns else 0, dtype=dtype)
+    array = np.asarray(data)
+    if array.dtype.newbyteorder('=') != dtype:
+        array = array.astype(dtype)
+    if columns:
+        array = array.reshape(-1, columns)
+    return array
+
+class Geometry:
+    #Positions are float32 Nx3, Indices uint32 Mx3, Normals float32 Mx3,
+    #IDs int32 M (-1 when the triangle has no id) and Materials uint32 M (material attribute per face)
+
+    #Index of Positions[0] in the combined buffer the indices refer to
+    #0 for models, the mesh's first vertex for meshes sliced out of the DEADBEEF model
+    VertexOffset = 0
+
+    def __init__(self, positions = None, indices = None, normals = None, ids = None, materials = None, vertexOffset: int = 0):
+        self.Positions = AsArray(positions, 'f4', 3)
+        self.Indices = AsArray(indices, 'u4', 3)
+
+        if normals is None:
+            normals = np.tile(np.array((0, 1, 0), dtype=np.float32), (len(self.Indices), 1))
+        self.Normals = AsArray(normals, 'f4', 3)
+
+        if ids is None:
+            ids = np.full(len(self.Indices), -1, dtype=np.int32)
+        self.IDs = AsArray(ids, 'i4')
+
+        if materials is None:
+            materials = np.zeros(len(self.Indices), dtype=np.uint32)
+        self.Materials = AsArray(materials, 'u4')
+
+        self.VertexOffset = vertexOffset
+
+    @property
+    def NumVertices(self) -> int:
+        return len(self.Positions)
+
+    @property
+    def NumTriangles(self) -> int:
+        return len(self.Indices)
+
+    @property
+    def Triangles(self) -> 'TriangleView':
+        return TriangleView(self)
+
+    def LocalIndices(self) -> np.ndarray:
+        #Indices into this geometry's own Positions
+        return self.Indices.astype(np.int64) - self.VertexOffset
+
+    def TriangleVertices(self) -> np.ndarray:
+        #Mx3x3 corner positions of every triangle
+        return self.Positions[self.LocalIndices()]
+
+    def Slice(self, triStart: int, triCount: int, vtxStart: int, vtxCount: int) -> 'Geometry':
+        #Views into this geometry, the indices keep referring to the combined buffer
+        triEnd = triStart + triCount
+        vtxEnd = vtxStart + vtxCount
+        return Geometry(
+            self.Positions[vtxStart : vtxEnd],
+            self.Indices[triStart : triEnd],
+            self.Normals[triStart : triEnd],
+            self.IDs[triStart : triEnd],
+            self.Materials[triStart : triEnd],
+            self.VertexOffset + vtxStart)
+
+    def SetTriangles(self, triangles: list[Triangle]):
+        #Replace the faces with a list of Triangle objects, A/B/C must refer to the current Positions
+        self.Indices = AsArray([(tri.A, tri.B, tri.C) for tri in triangles], 'u4', 3)
+        self.Normals = AsArray([tri.Normal for tri in triangles], 'f4', 3)
+        self.IDs = AsArray([-1 if tri.ID is None else tri.ID for tri in triangles], 'i4')
+        self.Materials = np.zeros(len(triangles), dtype=np.uint32)
+
+    @staticmethod
+    def FromTriangles(triangles: list[Triangle], positions: list = None) -> 'Geometry':
+        #Without positions, every triangle gets its own three vertices from Triangle.Vertices
+        if positions is None:
+            geometry = Geometry(np.array([tri.Vertices for tri in triangles], dtype=np.float32))
+            geometry.SetTriangles(triangles)
+            geometry.Indices = np.arange(len(triangles) * 3, dtype=np.uint32).reshape(-1, 3)
+        else:
+            geometry = Geometry(positions)
+            geometry.SetTriangles(triangles)
+        return geometry
+
+    @staticmethod
+    def Concatenate(geometries: list['Geometry']) -> 'Geometry':
+        #Indices are expected to already refer to the combined buffer (see VertexOffset)
+        if not geometries:
+            return Geometry()
+        return Geometry(
+            np.concatenate([g.Positions for g in geometries]),
+            np.concatenate([g.Indices for g in geometries]),
+            np.concatenate([g.Normals for g in geometries]),
+            np.concatenate([g.IDs for g in geometries]),
+            np.concatenate([g.Materials for g in geometries]),
+            geometries[0].VertexOffset)
+
+class TriangleView(Sequence):
+    #Compatibility view that builds Triangle objects on demand for code that still expects them
+
+    def __init__(self, geometry: Geometry):
+        self.Geometry = geometry
+
+    def __len__(self) -> int:
+        return self.Geometry.NumTriangles
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        geometry = self.Geometry
+        tri = Triangle()
+        tri.A, tri.B, tri.C = geometry.Indices[index].tolist()
+        tri.Vertices = [tuple(geometry.Positions[i - geometry.VertexOffset].tolist()) for i in (tri.A, tri.B, tri.C)]
+        tri.Normal = tuple(geometry.Normals[index].tolist())
+        tri.ID = None if geometry.IDs[index] < 0 else int(geometry.IDs[index])
+        return tri
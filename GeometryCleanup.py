@@ -0,0 +1,152 @@
+from CsbFile import CsbFile
+from Geometry import Geometry
+
+import numpy as np
+
+def PositionKeys(positions: np.ndarray, tolerance: float) -> np.ndarray:
+    #Nx3 integer keys, equal for positions that weld together. With no tolerance the float bits
+    #themselves (-0.0 counts as 0.0), otherwise the positions snapped to a grid of tolerance sized cells
+    if tolerance <= 0:
+        return (np.ascontiguousarray(positions, dtype=np.float32) + np.float32(0.0)).view(np.int32)
+    return np.floor(positions.astype(np.float64) / tolerance + 0.5).astype(np.int64)
+
+def UniqueRows(keys: np.ndarray) -> (np.ndarray, np.ndarray):
+    #First row of every distinct key and the index of each row's key in that list,
+    #numbered by first occurrence so welded buffers keep the original vertex order
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = np.ascontiguousarray(keys)
+    rows = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse.ravel()]
+
+def WeldGeometry(geometry: Geometry, tolerance: float, vertexOffset: int, positions: np.ndarray = None) -> Geometry:
+    #Geometry with the welded vertices at vertexOffset in the combined buffer, every welded vertex
+    #takes the position of the first one in its cell. positions replaces geometry.Positions when given.
+    if positions is None:
+        positions = geometry.Positions
+    first, remap = UniqueRows(PositionKeys(positions, tolerance))
+    indices = remap[geometry.LocalIndices()] + vertexOffset if len(remap) else geometry.Indices
+    return Geometry(positions[first], indices, geometry.Normals, geometry.IDs, geometry.Materials, vertexOffset)
+
+def WeldVertices(csb: CsbFile, tolerance: float = 0.0, combined: bool = False) -> (int, int):
+    #Merges vertices closer than tolerance (0 for exact duplicates only) and returns the vertex count
+    #before and after. Meshes keep their own vertex ranges in the DEADBEEF buffer; with combined the
+    #model is snapped as a whole first, so vertices on the seams between meshes land on the same position.
+    #Bounds are left as they are, welding only ever moves a vertex onto another one within tolerance.
+    before = sum(model.NumVertices for model in csb.Models)
+
+    for model in csb.Models:
+        if not model.Meshes:
+            model.Geometry = WeldGeometry(model.Geometry, tolerance, 0)
+            model.NumVertices = model.Geometry.NumVertices
+            continue
+
+        positions = model.Positions
+        if combined:
+            first, remap = UniqueRows(PositionKeys(positions, tolerance))
+            positions = positions[first][remap]
+
+        geometries = []
+        vertexOffset = 0
+        for mesh in model.Meshes:
+            meshPositions = positions[mesh.VertexOffset : mesh.VertexOffset + mesh.NumVertices]
+            geometry = WeldGeometry(mesh.Geometry, 0.0 if combined else tolerance, vertexOffset, meshPositions)
+            geometries.append(geometry)
+
+            mesh.VertexOffset = vertexOffset
+            mesh.NumVertices = geometry.NumVertices
+            vertexOffset += geometry.NumVertices
+
+        #recombine the mesh buffers and keep the meshes as views into it
+        model.Geometry = Geometry.Concatenate(geometries)
+        model.NumVertices = vertexOffset
+        for mesh in model.Meshes:
+            mesh.Geometry = model.Geometry.Slice(mesh.TriangleOffset, mesh.NumTriangles, mesh.VertexOffset, mesh.NumVertices)
+
+    return before, sum(model.NumVertices for model in csb.Models)
+
+#Why CullTriangles removed a triangle, the first reason that applies is the one counted
+Kept, Collapsed, ZeroArea, Duplicate, DuplicatePositions, BadNormal = range(6)
+CullReasons = {Collapsed: 'collapsed', ZeroArea: 'zero area', Duplicate: 'duplicate', DuplicatePositions: 'duplicate positions', BadNormal: 'bad normal'}
+
+def CanonicalTriangles(corners: np.ndarray) -> np.ndarray:
+    #Rotates every triangle to start at its smallest corner, the same face with the same winding
+    #always comes out the same while flipped (back facing) copies stay different
+    start = np.argmin(corners, axis=1)
+    return np.take_along_axis(corners, (start[:, None] + np.arange(3)) % 3, axis=1)
+
+def MarkDuplicates(reasons: np.ndarray, corners: np.ndarray, reason: int):
+    #Marks every triangle still kept whose corners repeat an earlier kept triangle
+    kept = np.flatnonzero(reasons == Kept)
+    first, _ = UniqueRows(CanonicalTriangles(corners[kept]))
+    duplicate = np.ones(len(kept), dtype=bool)
+    duplicate[first] = False
+    reasons[kept[duplicate]] = reason
+
+def TriangleCullReasons(geometry: Geometry, minArea: float = 1e-10, checkNormals: bool = False) -> np.ndarray:
+    #Cull reason of every triangle of a model, Kept (0) for the ones to keep
+    reasons = np.zeros(geometry.NumTriangles, dtype=np.int8)
+    if geometry.NumTriangles == 0:
+        return reasons
+    indices = geometry.LocalIndices()
+
+    #corners sharing a vertex, or sharing a position once exact duplicate positions are merged
+    _, vertexIds = UniqueRows(PositionKeys(geometry.Positions, 0.0))
+    corners = vertexIds[indices]
+    reasons[(corners[:, 0] == corners[:, 1]) | (corners[:, 1] == corners[:, 2]) | (corners[:, 2] == corners[:, 0])] = Collapsed
+
+    vertices = geometry.Positions[indices].astype(np.float64)
+    cross = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+    area = 0.5 * np.linalg.norm(cross, axis=1)
+    reasons[(reasons == Kept) & ~(area > minArea)] = ZeroArea
+
+    MarkDuplicates(reasons, indices, Duplicate)
+    MarkDuplicates(reasons, corners, DuplicatePositions)
+
+    if checkNormals:
+        #normals that aren't unit length or face away from the winding
+        normals = geometry.Normals.astype(np.float64)
+        length = np.linalg.norm(normals, axis=1)
+        bad = ~(np.abs(length - 1.0) < 1e-3) | ~(np.einsum('ij,ij->i', normals, cross) > 0)
+        reasons[(reasons == Kept) & bad] = BadNormal
+    return reasons
+
+def CullTriangles(csb: CsbFile, minArea: float = 1e-10, checkNormals: bool = False) -> dict:
+    #Removes triangles that can never be collided with: collapsed and zero area faces and repeats of
+    #another face of the same model (same vertices or same positions, with the same winding).
+    #Meshes keep their order and get their triangle ranges shrunk, DEADBEEF triangle ids stay the face order
+    #the .ctb refers to. Vertices are kept. Returns the number removed per reason.
+    removed = {name: 0 for name in CullReasons.values()}
+
+    for model in csb.Models:
+        reasons = TriangleCullReasons(model.Geometry, minArea, checkNormals)
+        for reason, name in CullReasons.items():
+            removed[name] += int(np.count_nonzero(reasons == reason))
+        keep = reasons == Kept
+        if keep.all():
+            continue
+
+        geometry = model.Geometry
+        ids = np.arange(np.count_nonzero(keep), dtype=np.int32) if model.Meshes else geometry.IDs[keep]
+        model.Geometry = Geometry(geometry.Positions, geometry.Indices[keep], geometry.Normals[keep], ids, geometry.Materials[keep], geometry.VertexOffset)
+        model.NumTriangles = model.Geometry.NumTriangles
+
+        triangleOffset = 0
+        for mesh in model.Meshes:
+            mesh.NumTriangles = int(np.count_nonzero(keep[mesh.TriangleOffset : mesh.TriangleOffset + mesh.NumTriangles]))
+            mesh.TriangleOffset = triangleOffset
+            triangleOffset += mesh.NumTriangles
+        for mesh in model.Meshes:
+            mesh.Geometry = model.Geometry.Slice(mesh.TriangleOffset, mesh.NumTriangles, mesh.VertexOffset, mesh.NumVertices)
+
+    return removed
+
+def CullReport(removed: dict) -> str:
+    total = sum(removed.values())
+    details = ', '.join(f"{count} {name}" for name, count in removed.items() if count)
+    return f"Removed {total} triangles ({details})" if total else "Removed 0 triangles"
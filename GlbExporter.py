@@ -0,0 +1,144 @@
+from CsbFile import CsbFile
+from SceneBuilder import MaterialName
+from Geometry import Geometry
+
+import json
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+#glTF component types and buffer view targets
+FLOAT = 5126
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+def Quaternion(rotation) -> list[float]:
+    #x, y, z, w of euler angles applied in the exporter's order (x, then y, then z)
+    return [float(x) for x in Rotation.from_euler('xyz', rotation if rotation is not None else (0, 0, 0)).as_quat()]
+
+class GlbBuilder:
+    #JSON document and binary chunk of a .glb file. Arrays are kept as they are and only
+    #copied once, when the file gets written.
+
+    def __init__(self):
+        self.Document = {
+            'asset': {'version': '2.0', 'generator': 'CollisionSceneBinaryPy'},
+            'scene': 0,
+            'scenes': [{'nodes': []}],
+            'nodes': [],
+            'meshes': [],
+            'materials': [],
+            'accessors': [],
+            'bufferViews': [],
+            'buffers': [],
+        }
+        self.Arrays = []
+        self.Length = 0
+        self.MaterialIndex = {}
+
+    def AddAccessor(self, array: np.ndarray, componentType: int, type: str, target: int = None, bounds: bool = False) -> int:
+        dtype = '<f4' if componentType == FLOAT else '<u4'
+        array = np.ascontiguousarray(array, dtype=dtype)
+
+        #every view starts 4 byte aligned
+        padding = -self.Length % 4
+        if padding:
+            self.Arrays.append(np.zeros(padding, dtype=np.uint8))
+            self.Length += padding
+
+        view = {'buffer': 0, 'byteOffset': self.Length, 'byteLength': array.nbytes}
+        if target is not None:
+            view['target'] = target
+        self.Document['bufferViews'].append(view)
+        self.Arrays.append(array)
+        self.Length += array.nbytes
+
+        accessor = {'bufferView': len(self.Document['bufferViews']) - 1, 'componentType': componentType, 'count': len(array), 'type': type}
+        if bounds:
+            accessor['min'] = [float(x) for x in array.min(axis=0)]
+            accessor['max'] = [float(x) for x in array.max(axis=0)]
+        self.Document['accessors'].append(accessor)
+        return len(self.Document['accessors']) - 1
+
+    def AddMaterial(self, name: str) -> int:
+        if not name in self.MaterialIndex:
+            self.MaterialIndex[name] = len(self.Document['materials'])
+            self.Document['materials'].append({'name': name, 'pbrMetallicRoughness': {'baseColorFactor': [1.0, 1.0, 1.0, 1.0]}})
+        return self.MaterialIndex[name]
+
+    def AddMesh(self, name: str, material: str, geometry: Geometry) -> int:
+        #Shared vertices and indices as they are in the csb. glTF only has per vertex normals,
+        #viewers fall back to flat shading without them and the face normals go in the extras
+        positions = self.AddAccessor(geometry.Positions, FLOAT, 'VEC3', ARRAY_BUFFER, True)
+        indices = self.AddAccessor(geometry.LocalIndices().ravel(), UNSIGNED_INT, 'SCALAR', ELEMENT_ARRAY_BUFFER)
+        normals = self.AddAccessor(geometry.Normals, FLOAT, 'VEC3')
+
+        self.Document['meshes'].append({
+            'name': name,
+            'primitives': [{'attributes': {'POSITION': positions}, 'indices': indices, 'material': self.AddMaterial(material), 'mode': 4}],
+            'extras': {'faceNormals': normals},
+        })
+        return len(self.Document['meshes']) - 1
+
+    def Write(self, filePath: str):
+        if self.Length:
+            self.Document['buffers'].append({'byteLength': self.Length})
+        else:
+            del self.Document['buffers'], self.Document['bufferViews'], self.Document['accessors']
+        for key in ('meshes', 'materials'):
+            if not self.Document[key]:
+                del self.Document[key]
+
+        content = json.dumps(self.Document, separators=(',', ':')).encode('utf-8')
+        content += b' ' * (-len(content) % 4)
+        binaryLength = self.Length + (-self.Length % 4)
+
+        total = 12 + 8 + len(content) + (8 + binaryLength if self.Length else 0)
+        with open(filePath, 'wb') as file:
+            file.write(np.array([0x46546C67, 2, total], dtype='<u4').tobytes()) #glTF
+            file.write(np.array([len(content), 0x4E4F534A], dtype='<u4').tobytes()) #JSON
+            file.write(content)
+            if self.Length:
+                file.write(np.array([binaryLength, 0x004E4942], dtype='<u4').tobytes()) #BIN
+                for array in self.Arrays:
+                    file.write(memoryview(array).cast('B'))
+                file.write(b'\x00' * (binaryLength - self.Length))
+
+def ExportGlb(csb: CsbFile, filePath: str):
+    #Same scene as the .dae export: one node per csb node named like the .dae ones, meshes on their nodes,
+    #MODELSPLIT_ models with their transform and MAPOBJ_ objects as empties whose material is in the extras
+    builder = GlbBuilder()
+    parents = csb.GetNodeParents()
+    nodes = builder.Document['nodes']
+
+    for index, (owner, parent) in enumerate(zip(csb.GetNodeOwners(), parents)):
+        gltfNode = {'name': f'Node{index + 1}'}
+
+        if isinstance(owner, CsbFile.CollisionObject):
+            type = 'MAPOBJ_SPHERE' if owner.IsSphere else 'MAPOBJ_BOX'
+            gltfNode['name'] = f'{type}_{owner.Name}'
+            gltfNode['translation'] = [float(x) for x in owner.Point1]
+            gltfNode['rotation'] = Quaternion(owner.Rotation)
+            gltfNode['scale'] = [float(owner.Radius)] * 3 if owner.IsSphere else [float(x) for x in owner.Size]
+            gltfNode['extras'] = {'material': MaterialName(0, owner.ColFlag, [owner.Identifier1, owner.Identifier2])}
+        elif isinstance(owner, CsbFile.Model) and not owner.Meshes and owner.NumTriangles > 0:
+            gltfNode['name'] = f'MODELSPLIT_{owner.Name}'
+            gltfNode['translation'] = [float(x) for x in owner.Translate]
+            gltfNode['rotation'] = Quaternion(owner.Rotation)
+            gltfNode['mesh'] = builder.AddMesh(owner.Name, MaterialName(owner.MaterialAttribute, owner.ColFlag), owner.Geometry)
+        elif isinstance(owner, CsbFile.Mesh):
+            gltfNode['name'] = owner.Name
+            material = MaterialName(owner.MaterialAttribute, owner.ColFlag)
+            if owner.NumTriangles > 0:
+                gltfNode['mesh'] = builder.AddMesh(owner.Name, material, owner.Geometry)
+            else:
+                #glTF meshes can't be empty, the material still marks the node as a mesh
+                gltfNode['extras'] = {'material': material}
+
+        nodes.append(gltfNode)
+        if parent == -1:
+            builder.Document['scenes'][0]['nodes'].append(index)
+        else:
+            nodes[parent].setdefault('children', []).append(index)
+
+    builder.Write(filePath)
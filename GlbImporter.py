@@ -0,0 +1,124 @@
+from CsbFile import CsbFile
+from SceneBuilder import SceneNode, BuildCsb
+from Geometry import Geometry
+
+import json
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+ComponentDtypes = {5120: 'i1', 5121: 'u1', 5122: '<i2', 5123: '<u2', 5125: '<u4', 5126: '<f4'}
+ComponentCounts = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+
+class GlbFile:
+    #JSON document and binary chunk of a .glb file, accessors are decoded as views into the chunk
+
+    def __init__(self, filePath: str):
+        with open(filePath, 'rb') as file:
+            data = file.read()
+
+        magic, version, length = np.frombuffer(data, dtype='<u4', count=3)
+        if magic != 0x46546C67 or version != 2:
+            raise ValueError(f'{filePath} is not a binary glTF 2.0 file')
+
+        self.Document = None
+        self.Binary = memoryview(b'')
+        offset = 12
+        while offset + 8 <= min(length, len(data)):
+            chunkLength, chunkType = np.frombuffer(data, dtype='<u4', count=2, offset=offset)
+            chunk = memoryview(data)[offset + 8 : offset + 8 + chunkLength]
+            if chunkType == 0x4E4F534A: #JSON
+                self.Document = json.loads(bytes(chunk))
+            elif chunkType == 0x004E4942 and not self.Binary: #BIN
+                self.Binary = chunk
+            offset += 8 + chunkLength
+
+        if self.Document is None:
+            raise ValueError(f'{filePath} has no JSON chunk')
+
+    def Accessor(self, index: int) -> np.ndarray:
+        #count x components array, zeros for accessors without a buffer view
+        accessor = self.Document['accessors'][index]
+        dtype = np.dtype(ComponentDtypes[accessor['componentType']])
+        components = ComponentCounts[accessor['type']]
+        count = accessor['count']
+
+        if not 'bufferView' in accessor:
+            return np.zeros((count, components), dtype=dtype)
+
+        view = self.Document['bufferViews'][accessor['bufferView']]
+        if view.get('buffer', 0) != 0:
+            raise ValueError('external glTF buffers are not supported')
+        offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+        stride = view.get('byteStride', dtype.itemsize * components)
+
+        #a view into the chunk, interleaved views just have a larger stride
+        if count == 0:
+            return np.zeros((0, components), dtype=dtype)
+        return np.ndarray((count, components), dtype=dtype, buffer=self.Binary, offset=offset, strides=(stride, dtype.itemsize))
+
+    def MeshGeometry(self, index: int) -> (Geometry, int):
+        #All triangle primitives of a mesh as one geometry and the material of the first one
+        mesh = self.Document['meshes'][index]
+        positions = []
+        indices = []
+        material = None
+        vertexCount = 0
+
+        for primitive in mesh['primitives']:
+            if primitive.get('mode', 4) != 4:
+                continue #points and lines have no collision
+            if material is None:
+                material = primitive.get('material')
+            primitivePositions = self.Accessor(primitive['attributes']['POSITION'])
+            if 'indices' in primitive:
+                primitiveIndices = self.Accessor(primitive['indices']).reshape(-1, 3).astype(np.int64)
+            else:
+                primitiveIndices = np.arange(len(primitivePositions), dtype=np.int64).reshape(-1, 3)
+            positions.append(primitivePositions)
+            indices.append(primitiveIndices + vertexCount)
+            vertexCount += len(primitivePositions)
+
+        if not positions:
+            return Geometry(), material
+        positions = np.concatenate(positions)
+        indices = np.concatenate(indices)
+
+        #face normals written by ExportGlb, otherwise those of the triangle planes
+        if 'faceNormals' in mesh.get('extras', {}) and len(mesh['primitives']) == 1:
+            normals = self.Accessor(mesh['extras']['faceNormals'])
+        else:
+            corners = positions[indices].astype(np.float64)
+            normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+        return Geometry(positions, indices, normals), material
+
+def NodeMatrix(node: dict) -> np.ndarray:
+    if 'matrix' in node:
+        return np.array(node['matrix'], dtype=np.float64).reshape(4, 4).T #column major
+
+    matrix = np.identity(4)
+    matrix[:3, :3] = Rotation.from_quat(node.get('rotation', (0, 0, 0, 1))).as_matrix() * np.array(node.get('scale', (1, 1, 1)))
+    matrix[:3, 3] = node.get('translation', (0, 0, 0))
+    return matrix
+
+def ImportFromGlb(filePath: str, is_map_object: bool = False) -> CsbFile:
+    #Builds the same scene nodes as a .dae import, so .glb files from ExportGlb import like their .dae
+    glb = GlbFile(filePath)
+    document = glb.Document
+    materials = document.get('materials', [])
+
+    def ReadNode(index: int) -> SceneNode:
+        node = document['nodes'][index]
+        children = [ReadNode(child) for child in node.get('children', [])]
+        extras = node.get('extras', {})
+
+        if 'mesh' in node:
+            geometry, material = glb.MeshGeometry(node['mesh'])
+            material = materials[material].get('name') if material is not None else None
+            return SceneNode(node.get('name'), NodeMatrix(node), children, geometry, extras.get('material', material))
+        return SceneNode(node.get('name'), NodeMatrix(node), children, material=extras.get('material'), hasGeometry='material' in extras)
+
+    scene = document['scenes'][document.get('scene', 0)] if document.get('scenes') else {'nodes': []}
+    return BuildCsb([ReadNode(index) for index in scene.get('nodes', [])])
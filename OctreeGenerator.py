@@ -1,8 +1,27 @@
 from Triangle import *
+from Geometry import Geometry
 import TriangleHelper
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+#Subtrees with fewer candidates than this are not worth sending to another process
+ParallelMinTriangles = 1024
+
+def ShareArray(array: np.ndarray) -> (shared_memory.SharedMemory, tuple):
+    #Copy an array into shared memory, returns the block and a picklable description of it
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+def AttachArray(description: tuple) -> (shared_memory.SharedMemory, np.ndarray):
+    name, shape, dtype = description
+    #pool workers share the creating process' resource tracker, which unlinks the block once
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
 
 class OctreeNode:
-    Triangles = list() #list[Triangle]
+    Triangles = list() #list[int] triangle ids
     
     Children = list() #list[OctreeNode]
     
@@ -39,34 +58,252 @@ class Octree:
     maxTrianglesPerNode = None # int
     maxDepth = None # int
     
-    def __init__(self, root_position: list[float], root_scale: float, maxTrianglesPerNode: int = 10, maxDepth: int = 5):
+    exactOverlap = False # bool, run the separating axis test on top of the AABB test
+    
+    Vertices = None # per triangle corner positions, only kept for the exact test
+    TriangleMin = None # per triangle AABB minimum
+    TriangleMax = None # per triangle AABB maximum
+    IDs = None # triangle id per triangle
+    
+    #Triangles stored in the leaves, and how many the AABB test alone would have let into the same leaves
+    LeafTriangles = 0
+    LeafAabbTriangles = 0
+    
+    def __init__(self, root_position: list[float], root_scale: float, maxTrianglesPerNode: int = 10, maxDepth: int = 5, exactOverlap: bool = False):
         self.root = OctreeNode(root_position, root_scale)
         self.maxTrianglesPerNode = maxTrianglesPerNode
         self.maxDepth = maxDepth
+        self.exactOverlap = exactOverlap
+    
+    def FilterTriangles(self, node: OctreeNode, triangles: np.ndarray) -> (np.ndarray, int):
+        #Go through the parent's triangles and remember them if they overlap with the region of this cube.
+        #A child cube lies inside its parent, so nothing the parent rejected can overlap it.
+        #Also returns how many passed the AABB test, before the exact test removed any.
+        overlaps = TriangleHelper.TrianglesCubeOverlap(self.TriangleMin[triangles], self.TriangleMax[triangles], node.Position, node.Scale)
+        containedTriangles = triangles[overlaps]
+        aabbCount = len(containedTriangles)
+        if self.exactOverlap:
+            overlaps = TriangleHelper.TrianglesCubeOverlapExact(self.Vertices[containedTriangles], node.Position, node.Scale)
+            containedTriangles = containedTriangles[overlaps]
+        return containedTriangles, aabbCount
+    
+    def AddLeaf(self, node: OctreeNode, containedTriangles: np.ndarray, aabbCount: int):
+        node.Triangles.extend(self.IDs[containedTriangles].tolist())
+        self.LeafTriangles += len(containedTriangles)
+        self.LeafAabbTriangles += aabbCount
     
-    def InsertTriangles(self, node: OctreeNode, triangles: list[Triangle], depth: int):
-        #Go through all triangles and remember them if they overlap with the region of this cube.
-        containedTriangles = list()
-        for triangle in triangles:
-            #print(triangle.Vertices)
-            if TriangleHelper.TriangleCubeOverlap(triangle, node.Position, node.Scale):
-                containedTriangles.append(triangle)
+    def InsertTriangles(self, node: OctreeNode, triangles: np.ndarray, depth: int):
+        containedTriangles, aabbCount = self.FilterTriangles(node, triangles)
         
         if len(containedTriangles) > self.maxTrianglesPerNode and depth < self.maxDepth:
             depth += 1
             node.Subdivide(depth)
             for child in node.Children:
-                self.InsertTriangles(child, triangles, depth)
+                self.InsertTriangles(child, containedTriangles, depth)
         else:
-            node.Triangles.extend(containedTriangles)
+            self.AddLeaf(node, containedTriangles, aabbCount)
     
-    def Build(self, triangles: list[Triangle]):
+    def SetTriangles(self, geometry: Geometry):
+        vertices = geometry.TriangleVertices()
+        self.TriangleMin, self.TriangleMax = TriangleHelper.TriangleBounds(vertices)
+        if self.exactOverlap:
+            self.Vertices = vertices
+        self.IDs = geometry.IDs
+    
+    def Build(self, geometry: Geometry, jobs: int = 1):
+        self.SetTriangles(geometry)
+        
         self.root.Subdivide(0)
+        if jobs > 1:
+            self.BuildParallel(jobs)
+            return
         for child in self.root.Children:
-            self.InsertTriangles(child, triangles, 0)
+            self.InsertTriangles(child, np.arange(geometry.NumTriangles), 0)
+    
+    def BuildParallel(self, jobs: int):
+        #Same recursion as InsertTriangles, but the biggest pending subtrees are split here until
+        #there is enough work for every process, then each one is built in a worker
+        tasks = [(child, np.arange(len(self.IDs)), 0) for child in self.root.Children]
+        while len(tasks) < jobs * 4:
+            largest = max(range(len(tasks)), key=lambda i: len(tasks[i][1]))
+            node, triangles, depth = tasks[largest]
+            if len(triangles) < ParallelMinTriangles:
+                break
+            tasks.pop(largest)
+            
+            containedTriangles, aabbCount = self.FilterTriangles(node, triangles)
+            if len(containedTriangles) > self.maxTrianglesPerNode and depth < self.maxDepth:
+                node.Subdivide(depth + 1)
+                #keep the children in place so the resulting tree is ordered like the serial one
+                tasks[largest:largest] = [(child, containedTriangles, depth + 1) for child in node.Children]
+            else:
+                self.AddLeaf(node, containedTriangles, aabbCount)
+        
+        arrays = {'TriangleMin': self.TriangleMin, 'TriangleMax': self.TriangleMax, 'IDs': self.IDs}
+        if self.exactOverlap:
+            arrays['Vertices'] = self.Vertices
+        blocks = []
+        try:
+            descriptions = {}
+            for name, array in arrays.items():
+                block, descriptions[name] = ShareArray(np.ascontiguousarray(array))
+                blocks.append(block)
+            
+            settings = (self.maxTrianglesPerNode, self.maxDepth, self.exactOverlap)
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(BuildSubtree, descriptions, settings, node.Position, node.Scale, triangles, depth) for node, triangles, depth in tasks]
+                for (node, _, _), future in zip(tasks, futures):
+                    subtree, leafTriangles, leafAabbTriangles = future.result()
+                    node.Triangles = subtree.Triangles
+                    node.Children = subtree.Children
+                    self.LeafTriangles += leafTriangles
+                    self.LeafAabbTriangles += leafAabbTriangles
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
 
-def Generate(root_position: list[float], root_scale: float, triangles: list[Triangle]):
+def BuildSubtree(descriptions: dict, settings: tuple, position: list[float], scale: float, triangles: np.ndarray, depth: int) -> (OctreeNode, int, int):
+    #Runs in a worker process, the triangle arrays are read straight from shared memory.
+    #Returns the subtree with its leaf triangle counts.
+    blocks = []
+    arrays = {}
+    octree = None
+    try:
+        for name, description in descriptions.items():
+            block, arrays[name] = AttachArray(description)
+            blocks.append(block)
+        
+        octree = Octree(position, scale, *settings)
+        octree.TriangleMin = arrays['TriangleMin']
+        octree.TriangleMax = arrays['TriangleMax']
+        octree.IDs = arrays['IDs']
+        octree.Vertices = arrays.get('Vertices')
+        
+        octree.InsertTriangles(octree.root, triangles, depth)
+        return octree.root, octree.LeafTriangles, octree.LeafAabbTriangles
+    finally:
+        #views into the blocks have to be gone before they can be closed
+        arrays.clear()
+        octree = None
+        for block in blocks:
+            block.close()
+
+def Generate(root_position: list[float], root_scale: float, triangles: Geometry, maxTrianglesPerNode: int = 10, maxDepth: int = 5, exactOverlap: bool = False, jobs: int = 1):
     #print(root_position)
-    octree = Octree(root_position, root_scale)
-    octree.Build(triangles)
-    return octree.root
\ No newline at end of file
+    if not isinstance(triangles, Geometry):
+        #list[Triangle]
+        triangles = Geometry.FromTriangles(triangles)
+    
+    octree = Octree(root_position, root_scale, maxTrianglesPerNode, maxDepth, exactOverlap)
+    octree.Build(triangles, jobs)
+    return octree.root
+
+def InterleaveBits(ix: np.ndarray, iz: np.ndarray, levels: int) -> np.ndarray:
+    #Morton code where every level contributes one child index (x in bit 0, z in bit 1), the root's children in the highest bits
+    code = np.zeros(len(ix), dtype=np.int64)
+    for bit in range(levels):
+        code |= ((ix >> bit) & 1) << (2 * bit)
+        code |= ((iz >> bit) & 1) << (2 * bit + 1)
+    return code
+
+def CellLevels(root_position: list[float], root_scale: float, triangles: Geometry, levels: int) -> (list, list, list):
+    #Rasterizes every triangle's XZ bounds into the finest of levels cell grids once,
+    #sorts the (triangle, cell) pairs a single time and derives every coarser level from that order.
+    #Per level (index 1 being the root's children): the cell and triangle of each unique pair and the
+    #triangle count of every cell. A level's cells don't depend on how many finer levels were rasterized.
+    cells = 1 << levels
+    cellSize = 2 * root_scale / cells
+    
+    triangleMin, triangleMax = TriangleHelper.TriangleBounds(triangles.TriangleVertices())
+    
+    #Height is ignored by the overlap test apart from this fixed band
+    box_height = 10000.0
+    inBand = (triangleMin[:, 1] <= root_position[1] + box_height) & (triangleMax[:, 1] >= root_position[1] - box_height)
+    
+    #Cell ranges touched by each triangle, cells are closed so a bound on a cell edge touches both sides
+    originX = root_position[0] - root_scale
+    originZ = root_position[2] - root_scale
+    ix0 = np.ceil((triangleMin[:, 0] - originX) / cellSize).astype(np.int64) - 1
+    ix1 = np.floor((triangleMax[:, 0] - originX) / cellSize).astype(np.int64)
+    iz0 = np.ceil((triangleMin[:, 2] - originZ) / cellSize).astype(np.int64) - 1
+    iz1 = np.floor((triangleMax[:, 2] - originZ) / cellSize).astype(np.int64)
+    
+    inGrid = inBand & (ix1 >= 0) & (ix0 < cells) & (iz1 >= 0) & (iz0 < cells)
+    tri = np.flatnonzero(inGrid)
+    ix0 = np.clip(ix0[tri], 0, cells - 1)
+    ix1 = np.clip(ix1[tri], 0, cells - 1)
+    iz0 = np.clip(iz0[tri], 0, cells - 1)
+    iz1 = np.clip(iz1[tri], 0, cells - 1)
+    
+    #Expand every triangle into the cells of its footprint
+    width = ix1 - ix0 + 1
+    counts = width * (iz1 - iz0 + 1)
+    pairTriangle = np.repeat(tri, counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pairWidth = np.repeat(width, counts)
+    pairX = np.repeat(ix0, counts) + local % pairWidth
+    pairZ = np.repeat(iz0, counts) + local // pairWidth
+    del local, pairWidth
+    
+    #The only sort: by triangle, then cell. A coarser cell is a prefix of the code, so for each triangle
+    #its coarser cells stay in order and duplicates are neighbours at every level.
+    codeBits = 2 * levels
+    code = InterleaveBits(pairX, pairZ, levels)
+    order = np.argsort((pairTriangle << codeBits) | code, kind='stable')
+    pairTriangle = pairTriangle[order]
+    code = code[order]
+    del order, pairX, pairZ
+    
+    #Unique (cell, triangle) pairs at every level, level 1 being the root's children
+    levelCells = [None]
+    levelTriangles = [None]
+    levelCounts = [None]
+    for level in range(1, levels + 1):
+        cell = code >> (2 * (levels - level))
+        start = np.ones(len(cell), dtype=bool)
+        start[1:] = (pairTriangle[1:] != pairTriangle[:-1]) | (cell[1:] != cell[:-1])
+        levelCells.append(cell[start])
+        levelTriangles.append(pairTriangle[start])
+        levelCounts.append(np.bincount(levelCells[-1], minlength=1 << (2 * level)))
+    return levelCells, levelTriangles, levelCounts
+
+def GenerateBottomUp(root_position: list[float], root_scale: float, triangles: Geometry, maxTrianglesPerNode: int = 10, maxDepth: int = 5):
+    #Alternative to Generate that rasterizes every triangle's XZ bounds into the finest cell grid once,
+    #sorts the (triangle, cell) pairs a single time and derives the triangle count of every coarser cell
+    #from that order, then only descends where a cell holds more than maxTrianglesPerNode triangles.
+    #Produces the same OctreeNode tree as Generate with the conservative AABB overlap test.
+    if not isinstance(triangles, Geometry):
+        #list[Triangle]
+        triangles = Geometry.FromTriangles(triangles)
+    
+    root = OctreeNode(root_position, root_scale)
+    root.Subdivide(0)
+    
+    #The root's children are depth 0, so the deepest cells are maxDepth + 1 halvings below the root
+    levels = maxDepth + 1
+    levelCells, levelTriangles, levelCounts = CellLevels(root_position, root_scale, triangles, levels)
+    
+    #Same subdivision rule as Octree.InsertTriangles, decided from the counts alone
+    leaves = [[] for _ in range(levels + 1)]
+    stack = [(child, i, 1) for i, child in enumerate(root.Children)]
+    while stack:
+        node, cell, level = stack.pop()
+        depth = level - 1
+        if levelCounts[level][cell] > maxTrianglesPerNode and depth < maxDepth:
+            node.Subdivide(depth + 1)
+            stack.extend((child, (cell << 2) | i, level + 1) for i, child in enumerate(node.Children))
+        else:
+            leaves[level].append((node, cell))
+    
+    #Leaf triangles, in ascending triangle order like the recursive builder
+    for level in range(1, levels + 1):
+        if not leaves[level]:
+            continue
+        order = np.argsort(levelCells[level], kind='stable')
+        sortedCells = levelCells[level][order]
+        for node, cell in leaves[level]:
+            first, last = np.searchsorted(sortedCells, [cell, cell + 1])
+            node.Triangles.extend(triangles.IDs[levelTriangles[level][order[first:last]]].tolist())
+    
+    return root
@@ -0,0 +1,96 @@
+from CsbFile import CsbFile
+from CtbFile import NodeDtype, OctreeRoot
+import OctreeGenerator
+
+import numpy as np
+
+#Settings tried by TuneParameters, every pair of them is scored
+CandidateTriangles = (4, 6, 8, 10, 12, 16, 24, 32, 48, 64)
+CandidateDepths = (2, 3, 4, 5, 6, 7)
+
+#Cost of visiting one node during a lookup, relative to testing one candidate triangle
+NodeStepCost = 0.5
+#Cost of one byte of table per triangle of the model, 32 bytes per triangle weigh as much as one candidate per lookup
+ByteCost = 1 / 32
+
+#Size of everything in front of the node table
+HeaderSize = 44
+
+DefaultTriangles = 10
+DefaultDepth = 5
+
+def EvaluateParameters(levelCounts: list, rootCount: int, numTriangles: int, maxTrianglesPerNode: int, maxDepth: int) -> dict:
+    #Cost model of the tree the builders would produce, from the cell counts of CellLevels alone.
+    #Lookups are points spread evenly over the root square: a leaf at level L is hit with probability 4^-L,
+    #the game then tests every triangle of that leaf.
+    nodes = 1
+    indices = rootCount
+    candidates = 0.0
+    steps = 0.0
+
+    cells = np.arange(4)
+    for level in range(1, maxDepth + 2):
+        counts = levelCounts[level][cells]
+        occupied = counts > 0
+        #nodes store the triangles of their whole subtree, empty nodes aren't written at all
+        nodes += int(np.count_nonzero(occupied))
+        indices += int(counts.sum())
+
+        split = counts > maxTrianglesPerNode if level - 1 < maxDepth else np.zeros(len(cells), dtype=bool)
+        leaf = ~split
+        area = 0.25 ** level
+        candidates += float(counts[leaf].sum()) * area
+        #a lookup ending in an empty child stops at the parent
+        steps += (np.count_nonzero(leaf & occupied) * (level + 1) + np.count_nonzero(leaf & ~occupied) * level) * area
+
+        cells = ((cells[split] << 2)[:, None] | np.arange(4)).ravel()
+        if len(cells) == 0:
+            break
+
+    size = HeaderSize + nodes * NodeDtype('<').itemsize + indices * 4
+    return {
+        'max_triangles': maxTrianglesPerNode,
+        'max_depth': maxDepth,
+        'candidates': candidates,
+        'steps': steps,
+        'nodes': nodes,
+        'size': size,
+        'cost': candidates + NodeStepCost * steps + ByteCost * size / max(numTriangles, 1),
+    }
+
+def DescribeParameters(result: dict) -> str:
+    return (f"{result['max_triangles']} triangles per node, depth {result['max_depth']}: "
+            f"{result['candidates']:.1f} candidates and {result['steps']:.1f} nodes per lookup, "
+            f"{result['nodes']} nodes, {result['size'] / 1024:.1f} KB")
+
+def TuneParameters(csbFile: CsbFile, sizeBudget: int = None) -> (int, int):
+    #Picks maxTrianglesPerNode and maxDepth for the collision table of a csb: the candidate with the
+    #lowest cost whose table fits in sizeBudget bytes, or the smallest table when none fits.
+    #The triangle/cell overlaps are rasterized once for the deepest candidate and shared by all of them.
+    #Scores assume the conservative overlap test, the exact one only ever makes the table smaller.
+    model = csbFile.Models[0]
+    if model.Geometry.NumTriangles == 0:
+        return DefaultTriangles, DefaultDepth
+
+    root_position, root_scale = OctreeRoot(model)
+    levels = max(CandidateDepths + (DefaultDepth,)) + 1
+    _, levelTriangles, levelCounts = OctreeGenerator.CellLevels(root_position, root_scale, model.Geometry, levels)
+    rootCount = len(np.unique(levelTriangles[1]))
+
+    numTriangles = model.Geometry.NumTriangles
+    results = [EvaluateParameters(levelCounts, rootCount, numTriangles, maxTriangles, maxDepth)
+               for maxDepth in CandidateDepths for maxTriangles in CandidateTriangles]
+    default = EvaluateParameters(levelCounts, rootCount, numTriangles, DefaultTriangles, DefaultDepth)
+
+    fitting = [result for result in results if sizeBudget is None or result['size'] <= sizeBudget]
+    if fitting:
+        best = min(fitting, key=lambda result: (result['cost'], result['size']))
+    else:
+        best = min(results, key=lambda result: (result['size'], result['cost']))
+
+    budget = 'no size budget' if sizeBudget is None else f'budget {sizeBudget / 1024:.1f} KB'
+    print(f"Octree auto-tune ({budget}, {len(results)} candidates): {DescribeParameters(best)}")
+    print(f"    defaults were {DescribeParameters(default)}")
+    if not fitting:
+        print("    no candidate fits the budget, using the smallest table")
+    return best['max_triangles'], best['max_depth']
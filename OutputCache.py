@@ -0,0 +1,121 @@
+from CsbFile import CsbFile
+from BoundingBox import BoundingBox
+from Geometry import Geometry
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+#Bump when a change to the writers or the octree makes old entries produce different files
+CacheVersion = 2
+
+def Canonical(value):
+    #Plain python form of a table value whose repr is stable across runs
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, BoundingBox):
+        return (Canonical(value.Min), Canonical(value.Max))
+    if isinstance(value, (list, tuple)):
+        return [Canonical(v) for v in value]
+    if isinstance(value, Geometry):
+        return None #hashed separately
+    if hasattr(value, '__dict__'):
+        return sorted((k, Canonical(v)) for k, v in Fields(value).items())
+    return value
+
+def Fields(value) -> dict:
+    #Public data fields of a table object, class defaults included so a field left at its default
+    #counts the same as one assigned the same value. Properties (Geometry, ...) and the private
+    #_geometry, _model, _source and _lock are left out.
+    fields = {}
+    for cls in reversed(type(value).__mro__):
+        fields.update((k, v) for k, v in vars(cls).items() if not k.startswith('_') and not callable(v) and not isinstance(v, (property, staticmethod, classmethod)))
+    fields.update((k, v) for k, v in vars(value).items() if not k.startswith('_'))
+    return fields
+
+def HashArray(hash, array: np.ndarray, dtype: str):
+    #Little endian and contiguous, so a file read in either byte order hashes like the imported one
+    hash.update(memoryview(np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<'))).cast('B'))
+
+def HashGeometry(hash, geometry: Geometry):
+    hash.update(repr((geometry.NumVertices, geometry.NumTriangles, geometry.VertexOffset)).encode())
+    HashArray(hash, geometry.Positions, 'f4')
+    HashArray(hash, geometry.Indices, 'u4')
+    HashArray(hash, geometry.Normals, 'f4')
+    HashArray(hash, geometry.IDs, 'i4')
+    HashArray(hash, geometry.Materials, 'u4')
+
+class OutputCache:
+    #Generated .csb/.ctb bytes on disk, keyed by a hash of everything they are built from.
+    #Entries are files named <key>.<extension>, the least recently used ones are removed
+    #once the directory grows past MaxBytes.
+
+    def __init__(self, directory: str = None, maxBytes: int = 512 * 1024 * 1024):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache', 'CollisionSceneBinaryPy')
+        self.Directory = directory
+        self.MaxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def Key(csb: CsbFile, parameters: dict, bigEndian: bool) -> str:
+        #parameters are the settings the outputs depend on (octree options, ...)
+        hash = hashlib.sha256()
+        hash.update(repr((CacheVersion, bool(bigEndian), sorted(parameters.items()))).encode())
+
+        for model in csb.Models:
+            hash.update(repr(Canonical(model)).encode())
+            HashGeometry(hash, model.Geometry)
+            for mesh in model.Meshes:
+                #name, flags, node index and buffer ranges, the faces are part of the model's geometry
+                hash.update(repr(Canonical(mesh)).encode())
+        hash.update(repr([Canonical(node) for node in csb.Nodes]).encode())
+        hash.update(repr([Canonical(obj) for obj in csb.Objects]).encode())
+        hash.update(repr(Canonical(csb.SubModelBounding)).encode())
+        return hash.hexdigest()
+
+    def GetPath(self, key: str, extension: str) -> str:
+        return os.path.join(self.Directory, f'{key}.{extension}')
+
+    def Load(self, key: str, extension: str) -> bytes:
+        #Cached bytes or None, a hit counts as a use for eviction
+        path = self.GetPath(key, extension)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def Save(self, key: str, extension: str, data: bytes):
+        #Written to a temporary file first so other processes never see half an entry
+        handle, temporary = tempfile.mkstemp(dir=self.Directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, self.GetPath(key, extension))
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.Evict()
+
+    def Evict(self):
+        entries = []
+        for entry in os.scandir(self.Directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.MaxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass #removed by another process
+            total -= size
@@ -0,0 +1,77 @@
+from CsbFile import CsbFile
+from CollisionBvh import ModelMatrix
+
+import numpy as np
+
+#One face record as laid out in the file, written in a single block
+FaceDtype = np.dtype([
+    ('count', 'u1'),
+    ('indices', '<i4', 3),
+    ('normal', '<f4', 3),
+    ('material', '<u4'),
+    ('flag', '<u4'),
+    ('model', '<u4'),
+])
+
+def ExportPly(csb: CsbFile, filePath: str):
+    #Every model in world space as one binary little endian .ply, each face keeps its normal,
+    #material attribute, collision flag and the index of the model it came from
+    positions = []
+    faces = []
+    vertexCount = 0
+
+    for modelIndex, model in enumerate(csb.Models):
+        geometry = model.Geometry
+        if geometry.NumTriangles == 0:
+            continue
+
+        modelPositions = geometry.Positions.astype(np.float64)
+        normals = geometry.Normals.astype(np.float64)
+        if not model.Meshes:
+            #split models are stored in their own space, the DEADBEEF model already is in world space
+            rotation, translation = ModelMatrix(model)
+            modelPositions = modelPositions @ rotation.T + translation
+            normals = normals @ rotation.T
+
+        flags = np.full(geometry.NumTriangles, model.ColFlag or 0, dtype=np.uint32)
+        for mesh in model.Meshes:
+            flags[mesh.TriangleOffset : mesh.TriangleOffset + mesh.NumTriangles] = mesh.ColFlag or 0
+
+        modelFaces = np.empty(geometry.NumTriangles, dtype=FaceDtype)
+        modelFaces['count'] = 3
+        modelFaces['indices'] = geometry.LocalIndices() + vertexCount
+        modelFaces['normal'] = normals
+        modelFaces['material'] = geometry.Materials
+        modelFaces['flag'] = flags
+        modelFaces['model'] = modelIndex
+
+        positions.append(modelPositions.astype('<f4'))
+        faces.append(modelFaces)
+        vertexCount += geometry.NumVertices
+
+    positions = np.concatenate(positions) if positions else np.zeros((0, 3), dtype='<f4')
+    faces = np.concatenate(faces) if faces else np.zeros(0, dtype=FaceDtype)
+
+    header = '\n'.join([
+        'ply',
+        'format binary_little_endian 1.0',
+        'comment CollisionSceneBinaryPy',
+        f'element vertex {len(positions)}',
+        'property float x',
+        'property float y',
+        'property float z',
+        f'element face {len(faces)}',
+        'property list uchar int vertex_indices',
+        'property float nx',
+        'property float ny',
+        'property float nz',
+        'property uint material',
+        'property uint flag',
+        'property uint model',
+        'end_header',
+    ]) + '\n'
+
+    with open(filePath, 'wb') as file:
+        file.write(header.encode('ascii'))
+        file.write(memoryview(np.ascontiguousarray(positions)).cast('B'))
+        file.write(memoryview(faces).cast('B'))
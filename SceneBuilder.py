@@ -0,0 +1,216 @@
+from CsbFile import CsbFile
+from Geometry import Geometry
+from BoundingBox import BoundingBox
+
+import numpy as np
+from math import radians
+from scipy.spatial.transform import Rotation
+
+epsilon = 1e-9
+
+def DecomposeMatrix(matrix: np.ndarray) -> (list, list, list):
+    # Extract translation
+    translation = matrix[:3, 3]
+
+    # Extract scale (length of each axis vector)
+    scale = np.linalg.norm(matrix[:3, :3], axis=0)
+
+    # Remove scale from the rotation matrix
+    rotation_matrix = matrix[:3, :3] / scale
+
+    # Convert rotation matrix to Euler angles
+    # Assumes XYZ rotation order (can be adjusted as needed)
+    rotation = Rotation.from_matrix(rotation_matrix)
+    eulerAngles = rotation.as_euler('xyz', degrees=True)
+    eulerAngles = [radians(a) for a in eulerAngles]
+
+    return translation, eulerAngles, scale
+
+class SceneNode:
+    #Format independent node of an imported scene, the .dae and .glb readers both build these
+    #and BuildCsb turns them into a CsbFile, so they share the naming rules for meshes,
+    #MODELSPLIT_ models and MAPOBJ_ objects
+    def __init__(self, name: str, matrix: np.ndarray, children: list = None, geometry: Geometry = None, material: str = None, hasGeometry: bool = None):
+        self.Name = name or ''
+        self.Matrix = matrix #4x4 local transform
+        self.Children = children if children is not None else []
+        self.Geometry = geometry #indices relative to its own positions
+        self.Material = material #name of the first material
+        #map objects have an (empty) geometry in .dae files only to carry their material
+        self.HasGeometry = geometry is not None if hasGeometry is None else hasGeometry
+
+def ParseMaterialName(name: str) -> (int, int, list):
+    #MaterialAttribute, ColFlag and the two identifiers encoded in a material name like MAT1_FLAG2_ID-A3_ID-B4
+    identifiers = [None, None]
+    MaterialAttribute = 0
+    ColFlag = 0
+    
+    for v in (name or '').split('_'):
+        if v.startswith('MAT'):
+            MaterialAttribute = int(v.replace('MAT', ''))
+        elif v.startswith('FLAG'):
+            ColFlag = int(v.replace('FLAG', ''))
+        elif v.startswith('ID-A'):
+            identifiers[0] = int(v.replace('ID-A', ''))
+        elif v.startswith('ID-B'):
+            identifiers[1] = int(v.replace('ID-B', ''))
+    return MaterialAttribute, ColFlag, identifiers
+
+def MaterialName(attribute: int, flag: int, identifiers: list[int] = None) -> str:
+    #Inverse of ParseMaterialName, the naming the exporters use
+    if identifiers is None:
+        return f"MAT{attribute}_FLAG{flag}"
+    return f"MAT{attribute}_FLAG{flag}_ID-A{identifiers[0]}_ID-B{identifiers[1]}"
+
+def BuildCsb(nodes: list[SceneNode]) -> CsbFile:
+    triID = 0
+    
+    def ImportMapObject(node: SceneNode, isSphere: bool = False):
+        nonlocal csb, ID
+        newColObject = csb.CollisionObject()
+        
+        newColObject.IsSphere = isSphere
+        
+        t, r, s = DecomposeMatrix(node.Matrix)
+        newColObject.Point1 = newColObject.Point2 = t
+        
+        if isSphere:
+            newColObject.Radius = s[0] if s[0] > epsilon else epsilon
+        else:
+            newColObject.Rotation = r 
+            newColObject.Size = [x if x > epsilon else epsilon for x in s]
+        
+        newColObject.Name = node.Name.split('_')
+        newColObject.Name = newColObject.Name[2:]
+        newColObject.Name = '_'.join(newColObject.Name)
+        
+        newColObject.NodeIndex = ID - 1
+        
+        newColObject.Unknown = 0
+        
+        newColObject.MaterialAttribute, newColObject.ColFlag, identifiers = ParseMaterialName(node.Material)
+        newColObject.Identifier1 = identifiers[0]
+        newColObject.Identifier2 = identifiers[1]
+        
+        csb.Objects.append(newColObject)
+    
+    def ImportModelSplit(node: SceneNode):
+        nonlocal csb, ID
+        newModelSplit = csb.Model()
+        
+        newModelSplit.Meshes = []
+        
+        t, r, s = DecomposeMatrix(node.Matrix)
+        newModelSplit.Translate = t
+        newModelSplit.Rotation = r
+        
+        newModelSplit.MaterialAttribute, newModelSplit.ColFlag, _ = ParseMaterialName(node.Material)
+        
+        newModelSplit.Name = node.Name.split('_')
+        newModelSplit.Name = newModelSplit.Name[1:]
+        newModelSplit.Name = '_'.join(newModelSplit.Name)
+        
+        newModelSplit.NodeIndex = ID - 1
+        
+        newModelSplit.Unknown0 = 1
+        newModelSplit.Unknown4 = 4
+        
+        newModelSplit.Geometry = node.Geometry if node.Geometry is not None else Geometry()
+        newModelSplit.Geometry.Materials[:] = newModelSplit.MaterialAttribute
+        newModelSplit.NumVertices = newModelSplit.Geometry.NumVertices
+        newModelSplit.NumTriangles = newModelSplit.Geometry.NumTriangles
+        
+        newModelSplit.Bounding.Compute(newModelSplit.Positions)
+        subModelBounds.Expand(newModelSplit.Bounding)
+        
+        csb.Models.append(newModelSplit)
+        
+        
+    
+    def ImportNode(node: SceneNode, root: bool = False):
+        nonlocal csb, ID, newModel, triID
+        
+        if root:
+            t, r, s = DecomposeMatrix(node.Matrix)
+            newModel.Translate = t
+            newModel.Rotation = r
+        
+        newNode = csb.Node()
+        
+        newNode.ID = ID
+        ID += 1
+        
+        newNode.Flags = 0
+        
+        newNode.NumChildren = len(node.Children)
+        
+        csb.Nodes.append(newNode)
+        
+        if node.HasGeometry:
+            if node.Name.startswith('MAPOBJ_SPHERE'):
+                ImportMapObject(node, True)
+                newNode.Flags = 2
+            elif node.Name.startswith('MAPOBJ_BOX'):
+                ImportMapObject(node, False)
+                newNode.Flags = 3
+            elif node.Name.startswith('MODELSPLIT'):
+                ImportModelSplit(node)
+                newNode.Flags = 1
+            else:
+                newMesh = csb.Mesh()
+                
+                newMesh.Name = node.Name
+                newMesh.NodeIndex = newNode.ID
+                newNode.Flags = 0
+                
+                newMesh.MaterialAttribute, newMesh.ColFlag, _ = ParseMaterialName(node.Material)
+                
+                geometry = node.Geometry if node.Geometry is not None else Geometry()
+                newMesh.VertexOffset = newModel.NumVertices
+                newMesh.TriangleOffset = newModel.NumTriangles
+                newMesh.Geometry = Geometry(geometry.Positions, geometry.LocalIndices() + newMesh.VertexOffset, geometry.Normals, vertexOffset=newMesh.VertexOffset)
+                newMesh.NumVertices = newMesh.Geometry.NumVertices
+                newMesh.NumTriangles = newMesh.Geometry.NumTriangles
+                
+                newMesh.Geometry.IDs = np.arange(triID, triID + newMesh.NumTriangles, dtype=np.int32)
+                newMesh.Geometry.Materials[:] = newMesh.MaterialAttribute
+                triID += newMesh.NumTriangles
+                
+                newModel.Meshes.append(newMesh)
+                newModel.NumVertices += newMesh.NumVertices
+                newModel.NumTriangles += newMesh.NumTriangles
+                modelBounds.ExpandPositions(newMesh.Positions)
+                
+                #bounds of the split models read so far, kept up to date as they are read
+                if len(csb.Models) == 0:
+                    #No sub models so use defaults
+                    csb.SubModelBounding.Min = (99999.0, 99999.0, 99999.0)
+                    csb.SubModelBounding.Max = (-99999.0, -99999.0, -99999.0)
+                else:
+                    csb.SubModelBounding = BoundingBox(subModelBounds.Min, subModelBounds.Max)
+        
+        for subnode in node.Children:
+            ImportNode(subnode)
+    
+    csb = CsbFile()
+    
+    # DEADBEEF model
+    ID = 0
+    newModel = csb.Model()
+    modelBounds = BoundingBox()
+    subModelBounds = BoundingBox()
+    for node in nodes:
+        ImportNode(node, True)
+    
+    #combine the mesh buffers and keep the meshes as views into it
+    newModel.Geometry = Geometry.Concatenate([mesh.Geometry for mesh in newModel.Meshes])
+    for mesh in newModel.Meshes:
+        mesh.Geometry = newModel.Geometry.Slice(mesh.TriangleOffset, mesh.NumTriangles, mesh.VertexOffset, mesh.NumVertices)
+    if modelBounds.IsEmpty():
+        #No meshes, use the same defaults as for missing sub models
+        modelBounds = BoundingBox((99999.0, 99999.0, 99999.0), (-99999.0, -99999.0, -99999.0))
+        if csb.SubModelBounding.IsEmpty():
+            csb.SubModelBounding = BoundingBox(modelBounds.Min, modelBounds.Max) if subModelBounds.IsEmpty() else subModelBounds
+    newModel.Bounding = modelBounds
+    csb.Models.insert(0, newModel)
+    return csb
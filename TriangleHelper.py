@@ -9,12 +9,12 @@ import numpy as np
 ## Returns a value indicating whether the given <paramref name="triangle"/> overlaps a cube positioned at the
 ## <paramref name="cubeCenter"/> expanding with <paramref name="cubeHalfSize"/>.
 ## </summary>
-## <param name="triangle">The <see cref="Triangle"/> to check for overlaps.</param>
+## <param name="triangle">The <see cref="Triangle"/>, or its three corner positions, to check for overlaps.</param>
 ## <param name="cubeCenter">The positional <see cref="Vector3F "/> at which the cube originates.</param>
 ## <param name="cubeHalfSize">The half length of one edge of the cube.</param>
 ## <returns><c>true</c> when the triangle intersects with the cube, otherwise <c>false</c>.</returns>
 def TriangleCubeOverlap(t: Triangle, Position: list[float], BoxSize: float) -> bool:
-    triangle = t
+    vertices = t.Vertices if isinstance(t, Triangle) else t
     boxCenter = np.array(Position)
     boxHalfSize = BoxSize
 
@@ -27,13 +27,241 @@ def TriangleCubeOverlap(t: Triangle, Position: list[float], BoxSize: float) -> b
     boxMax = boxCenter + np.array([boxHalfSize, box_height, boxHalfSize]);
 
     # Test each axis of the box
-    if (min(triangle.Vertices[0][0], min(triangle.Vertices[1][0], triangle.Vertices[2][0])) > boxMax[0]): return False
-    if (max(triangle.Vertices[0][0], max(triangle.Vertices[1][0], triangle.Vertices[2][0])) < boxMin[0]): return False
-    if (min(triangle.Vertices[0][1], min(triangle.Vertices[1][1], triangle.Vertices[2][1])) > boxMax[1]): return False
-    if (max(triangle.Vertices[0][1], max(triangle.Vertices[1][1], triangle.Vertices[2][1])) < boxMin[1]): return False
-    if (min(triangle.Vertices[0][2], min(triangle.Vertices[1][2], triangle.Vertices[2][2])) > boxMax[2]): return False
-    if (max(triangle.Vertices[0][2], max(triangle.Vertices[1][2], triangle.Vertices[2][2])) < boxMin[2]): return False
+    if (min(vertices[0][0], min(vertices[1][0], vertices[2][0])) > boxMax[0]): return False
+    if (max(vertices[0][0], max(vertices[1][0], vertices[2][0])) < boxMin[0]): return False
+    if (min(vertices[0][1], min(vertices[1][1], vertices[2][1])) > boxMax[1]): return False
+    if (max(vertices[0][1], max(vertices[1][1], vertices[2][1])) < boxMin[1]): return False
+    if (min(vertices[0][2], min(vertices[1][2], vertices[2][2])) > boxMax[2]): return False
+    if (max(vertices[0][2], max(vertices[1][2], vertices[2][2])) < boxMin[2]): return False
 
     # More accurate tests can be added here for edge cases
 
-    return True;
\ No newline at end of file
+    return True;
+
+## <summary>
+## Vectorized form of <see cref="TriangleCubeOverlap"/> for many triangles at once.
+## </summary>
+## <param name="triangleMin">The per-triangle AABB minimums, shape (n, 3).</param>
+## <param name="triangleMax">The per-triangle AABB maximums, shape (n, 3).</param>
+## <param name="Position">The positional <see cref="Vector3F "/> at which the cube originates.</param>
+## <param name="BoxSize">The half length of one edge of the cube.</param>
+## <returns>A boolean array, <c>true</c> for every triangle that overlaps the cube.</returns>
+def TrianglesCubeOverlap(triangleMin: np.ndarray, triangleMax: np.ndarray, Position: list[float], BoxSize: float) -> np.ndarray:
+    boxCenter = np.array(Position, dtype=np.float64)
+
+    #Ignore height for now
+    #Octrees just divide by width/depth
+    box_height = 10000.0
+
+    boxHalfSize = np.array([BoxSize, box_height, BoxSize])
+    boxMin = boxCenter - boxHalfSize
+    boxMax = boxCenter + boxHalfSize
+
+    return np.all((triangleMin <= boxMax) & (triangleMax >= boxMin), axis=1)
+
+## <summary>
+## Exact separating axis test between many triangles and one box, following the Akenine-Möller algorithm.
+## Tests the 3 box axes, the triangle plane and the 9 cross products of triangle edges and box axes.
+## </summary>
+## <param name="vertices">The triangle corner positions, shape (n, 3, 3).</param>
+## <param name="Position">The positional <see cref="Vector3F "/> at which the cube originates.</param>
+## <param name="BoxSize">The half length of one edge of the cube.</param>
+## <returns>A boolean array, <c>true</c> for every triangle that overlaps the cube.</returns>
+def TrianglesCubeOverlapExact(vertices: np.ndarray, Position: list[float], BoxSize: float) -> np.ndarray:
+    #Same box as the conservative test, height is ignored
+    box_height = 10000.0
+    boxHalfSize = np.array([BoxSize, box_height, BoxSize])
+
+    # Move the box to the origin
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 3, 3) - np.array(Position, dtype=np.float64)
+    v0, v1, v2 = v[:, 0], v[:, 1], v[:, 2]
+
+    # Box axes, same as the AABB test
+    overlaps = np.all((v.min(axis=1) <= boxHalfSize) & (v.max(axis=1) >= -boxHalfSize), axis=1)
+
+    # Triangle plane, the box overlaps it when the plane is within the box's projected radius
+    edges = (v1 - v0, v2 - v1, v0 - v2)
+    normal = np.cross(edges[0], edges[1])
+    distance = np.einsum('ij,ij->i', normal, v0)
+    radius = np.abs(normal) @ boxHalfSize
+    overlaps &= np.abs(distance) <= radius
+
+    # Cross products of every triangle edge with every box axis
+    for edge in edges:
+        for axis in range(3):
+            separatingAxis = np.cross(edge, np.eye(3)[axis])
+            p0 = np.einsum('ij,ij->i', separatingAxis, v0)
+            p1 = np.einsum('ij,ij->i', separatingAxis, v1)
+            p2 = np.einsum('ij,ij->i', separatingAxis, v2)
+            radius = np.abs(separatingAxis) @ boxHalfSize
+            overlaps &= (np.minimum(np.minimum(p0, p1), p2) <= radius) & (np.maximum(np.maximum(p0, p1), p2) >= -radius)
+
+    return overlaps
+
+## <summary>
+## Returns the axis aligned bounds of every triangle.
+## </summary>
+## <param name="vertices">The triangle corner positions, shape (n, 3, 3).</param>
+## <returns>The minimum and maximum corners, each of shape (n, 3) in double precision.</returns>
+def TriangleBounds(vertices: np.ndarray) -> (np.ndarray, np.ndarray):
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3, 3)
+    return vertices.min(axis=1), vertices.max(axis=1)
+
+## <summary>
+## Intersects rays with triangles pairwise using the Möller-Trumbore algorithm, both faces count as hits.
+## </summary>
+## <param name="origins">The ray origins, shape (n, 3).</param>
+## <param name="directions">The ray directions, shape (n, 3). They do not need to be normalized.</param>
+## <param name="vertices">The triangle corner positions, shape (n, 3, 3), one triangle per ray.</param>
+## <returns>The hit distance in multiples of the direction, <c>inf</c> where the ray misses or runs backwards.</returns>
+def RaysTrianglesIntersect(origins: np.ndarray, directions: np.ndarray, vertices: np.ndarray) -> np.ndarray:
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 3, 3)
+
+    edge1 = v[:, 1] - v[:, 0]
+    edge2 = v[:, 2] - v[:, 0]
+    p = np.cross(directions, edge2)
+    determinant = np.einsum('ij,ij->i', edge1, p)
+
+    # Parallel rays and degenerate triangles never hit
+    valid = np.abs(determinant) > 1e-12
+    inverse = np.divide(1.0, determinant, out=np.zeros_like(determinant), where=valid)
+
+    s = origins - v[:, 0]
+    u = np.einsum('ij,ij->i', s, p) * inverse
+    q = np.cross(s, edge1)
+    w = np.einsum('ij,ij->i', directions, q) * inverse
+    t = np.einsum('ij,ij->i', edge2, q) * inverse
+
+    hits = valid & (u >= 0) & (w >= 0) & (u + w <= 1) & (t >= 0)
+    return np.where(hits, t, np.inf)
+
+## <summary>
+## Slab test of ray/box pairs.
+## </summary>
+## <param name="origins">The ray origins, shape (n, 3).</param>
+## <param name="inverseDirections">The component-wise inverse of the ray directions, shape (n, 3), <c>inf</c> for zero components.</param>
+## <param name="boxMin">The box minimums, shape (n, 3).</param>
+## <param name="boxMax">The box maximums, shape (n, 3).</param>
+## <param name="maxDistance">How far along the direction each ray reaches, shape (n,).</param>
+## <returns>A boolean array, <c>true</c> where the ray enters the box between 0 and <paramref name="maxDistance"/>.</returns>
+def RaysBoxesIntersect(origins: np.ndarray, inverseDirections: np.ndarray, boxMin: np.ndarray, boxMax: np.ndarray, maxDistance: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore'):
+        t1 = (boxMin - origins) * inverseDirections
+        t2 = (boxMax - origins) * inverseDirections
+
+    # fmin/fmax skip the nan of a ray running exactly along a slab plane
+    near = np.fmin(t1, t2)
+    far = np.fmax(t1, t2)
+    tNear = np.fmax(np.fmax(near[:, 0], near[:, 1]), near[:, 2])
+    tFar = np.fmin(np.fmin(far[:, 0], far[:, 1]), far[:, 2])
+    return (tNear <= tFar) & (tFar >= 0) & (tNear <= maxDistance)
+
+## <summary>
+## Returns the point of every triangle closest to a query point, following Ericson's Voronoi region method.
+## </summary>
+## <param name="points">The query points, shape (n, 3).</param>
+## <param name="vertices">The triangle corner positions, shape (n, 3, 3), one triangle per point.</param>
+## <returns>The closest points, shape (n, 3).</returns>
+def ClosestPointsOnTriangles(points: np.ndarray, vertices: np.ndarray) -> np.ndarray:
+    p = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 3, 3)
+    a, b, c = v[:, 0], v[:, 1], v[:, 2]
+    dot = lambda x, y: np.einsum('ij,ij->i', x, y)
+
+    ab = b - a
+    ac = c - a
+    ap = p - a
+    bp = p - b
+    cp = p - c
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Inside the face
+        denominator = va + vb + vc
+        result = a + ab * (vb / denominator)[:, None] + ac * (vc / denominator)[:, None]
+
+        # The regions below are checked from the lowest to the highest priority, later ones win
+        onBC = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        result = np.where(onBC[:, None], b + (c - b) * w[:, None], result)
+
+        onAC = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        w = d2 / (d2 - d6)
+        result = np.where(onAC[:, None], a + ac * w[:, None], result)
+
+        result = np.where(((d6 >= 0) & (d5 <= d6))[:, None], c, result)
+
+        onAB = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        w = d1 / (d1 - d3)
+        result = np.where(onAB[:, None], a + ab * w[:, None], result)
+
+        result = np.where(((d3 >= 0) & (d4 <= d3))[:, None], b, result)
+        result = np.where(((d1 <= 0) & (d2 <= 0))[:, None], a, result)
+
+    return result
+
+## <summary>
+## Sweeps spheres along rays against triangles pairwise and returns the first time of contact,
+## testing the triangle face, its three edges and its three corners.
+## </summary>
+## <param name="origins">The sphere centers at the start, shape (n, 3).</param>
+## <param name="directions">The sweep directions, shape (n, 3). They do not need to be normalized.</param>
+## <param name="radii">The sphere radii, shape (n,).</param>
+## <param name="vertices">The triangle corner positions, shape (n, 3, 3), one triangle per sphere.</param>
+## <returns>The contact distance in multiples of the direction, 0 when already touching and <c>inf</c> when never touching.</returns>
+def SpheresTrianglesSweep(origins: np.ndarray, directions: np.ndarray, radii: np.ndarray, vertices: np.ndarray) -> np.ndarray:
+    o = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    d = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    r = np.asarray(radii, dtype=np.float64).reshape(-1)
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 3, 3)
+    dot = lambda x, y: np.einsum('ij,ij->i', x, y)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Face, the sphere touches the plane at distance r and the touching point has to be inside the triangle
+        normal = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+        normal /= np.linalg.norm(normal, axis=1)[:, None]
+        distance = dot(normal, o - v[:, 0])
+        side = np.where(distance >= 0, 1.0, -1.0)
+        approach = -side * dot(normal, d)
+        t = np.where(np.abs(distance) <= r, 0.0, (np.abs(distance) - r) / approach)
+        t = np.where((t >= 0) & ((np.abs(distance) <= r) | (approach > 0)), t, np.inf)
+
+        contact = o + d * np.where(np.isfinite(t), t, 0.0)[:, None] - normal * (side * np.minimum(np.abs(distance), r))[:, None]
+        inside = np.ones(len(o), dtype=bool)
+        for i in range(3):
+            edge = v[:, (i + 1) % 3] - v[:, i]
+            inside &= dot(np.cross(edge, contact - v[:, i]), normal) >= 0
+        result = np.where(inside & np.isfinite(t), t, np.inf)
+
+        dd = dot(d, d)
+        for i in range(3):
+            # Edge, a capsule side: |(m + t d) - ((m + t d) . e / e.e) e| = r
+            start = v[:, i]
+            edge = v[:, (i + 1) % 3] - start
+            m = o - start
+            ee = dot(edge, edge)
+            ed = dot(edge, d)
+            em = dot(edge, m)
+            qa = ee * dd - ed * ed
+            qb = ee * dot(m, d) - em * ed
+            qc = ee * dot(m, m) - em * em - r * r * ee
+            t = np.where(qc <= 0, 0.0, (-qb - np.sqrt(qb * qb - qa * qc)) / qa)
+            along = (em + t * ed) / ee
+            valid = (t >= 0) & (along >= 0) & (along <= 1) & ((qc <= 0) | ((qa > 0) & (qb < 0)))
+            result = np.where(valid & (t < result), t, result)
+
+            # Corner: |m + t d| = r
+            qb = dot(m, d)
+            qc = dot(m, m) - r * r
+            t = np.where(qc <= 0, 0.0, (-qb - np.sqrt(qb * qb - dd * qc)) / dd)
+            valid = (t >= 0) & ((qc <= 0) | (qb < 0))
+            result = np.where(valid & (t < result), t, result)
+
+    return result
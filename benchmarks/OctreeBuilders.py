@@ -0,0 +1,55 @@
+#Compares the recursive octree builder with the bottom-up grid builder on synthetic heightfields
+#Usage: python benchmarks/OctreeBuilders.py [grid sizes...]
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CsbFile import CsbFile
+from CtbFile import CtbFile
+from Geometry import Geometry
+import numpy as np
+
+def Heightfield(size: int, spacing: float = 10.0) -> Geometry:
+    #size x size quads of bumpy terrain, two triangles each
+    x, z = np.meshgrid(np.arange(size + 1), np.arange(size + 1))
+    y = 50 * np.sin(x / 7.0) * np.cos(z / 5.0)
+    positions = np.stack([x * spacing, y, z * spacing], axis=-1).reshape(-1, 3)
+    
+    corner = (np.arange(size)[:, None] * (size + 1) + np.arange(size)[None, :]).ravel()
+    indices = np.concatenate([
+        np.stack([corner, corner + size + 1, corner + 1], axis=1),
+        np.stack([corner + 1, corner + size + 1, corner + size + 2], axis=1)])
+    
+    geometry = Geometry(positions, indices)
+    geometry.IDs = np.arange(len(indices), dtype=np.int32)
+    return geometry
+
+def BuildCtb(csb: CsbFile, bottomUp: bool) -> (float, bytes):
+    start = time.perf_counter()
+    ctb = CtbFile()
+    ctb.Generate(csb, bottomUp=bottomUp)
+    data = ctb.Write(False)
+    return time.perf_counter() - start, bytes(data)
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [32, 64, 128, 256]
+    
+    results = []
+    for size in sizes:
+        csb = CsbFile()
+        model = csb.Model()
+        model.Geometry = Heightfield(size)
+        model.Bounding.Compute(model.Positions)
+        csb.Models.append(model)
+        
+        recursiveTime, recursive = BuildCtb(csb, False)
+        gridTime, grid = BuildCtb(csb, True)
+        results.append((model.Geometry.NumTriangles, recursiveTime, gridTime, recursive == grid))
+    
+    print(f'{"triangles":>10} {"recursive":>10} {"grid":>10} {"speedup":>8}  identical')
+    for triangles, recursiveTime, gridTime, identical in results:
+        print(f'{triangles:>10} {recursiveTime:>9.3f}s {gridTime:>9.3f}s {recursiveTime / gridTime:>7.1f}x  {identical}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#Times every stage of the pipeline on procedural scenes and records the results as JSON
+#Usage: python benchmarks/Pipeline.py [-sizes 1000,10000,...] [-scenes heightfield,floors,triggers]
+#       [-meshes N] [-objects N] [-repeat N] [-grid] [-nomemory] [-keep DIR] [-out results.json] [-compare old.json]
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+from contextlib import redirect_stdout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import CsbFile
+from CtbFile import CtbFile
+from CsbExporter import Export
+from CsbImporter import ImportFromDae
+from Geometry import Geometry
+from SceneBuilder import SceneNode, BuildCsb, MaterialName
+import numpy as np
+
+def Translation(x: float, y: float, z: float) -> np.ndarray:
+    matrix = np.identity(4, dtype=np.float32)
+    matrix[:3, 3] = (x, y, z)
+    return matrix
+
+def Grid(quadsX: int, quadsZ: int, x0: float, z0: float, spacing: float, height) -> Geometry:
+    #quadsX x quadsZ quads, two triangles each, height(x, z) gives the y of every vertex
+    x, z = np.meshgrid(x0 + np.arange(quadsX + 1) * spacing, z0 + np.arange(quadsZ + 1) * spacing)
+    positions = np.stack([x, height(x, z), z], axis=-1).reshape(-1, 3)
+
+    corner = (np.arange(quadsZ)[:, None] * (quadsX + 1) + np.arange(quadsX)[None, :]).ravel()
+    indices = np.concatenate([
+        np.stack([corner, corner + quadsX + 1, corner + 1], axis=1),
+        np.stack([corner + 1, corner + quadsX + 1, corner + quadsX + 2], axis=1)])
+
+    vertices = positions[indices]
+    normals = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return Geometry(positions, indices, normals)
+
+#The .csb stores a node's child count in a signed byte
+MaxChildren = 127
+
+def Root(children: list[SceneNode]) -> list[SceneNode]:
+    #Scene root over the children, nested into groups wherever there are too many for one node
+    while len(children) > MaxChildren:
+        children = [SceneNode(f'Group{i}', np.identity(4, dtype=np.float32), children[start : start + MaxChildren])
+                    for i, start in enumerate(range(0, len(children), MaxChildren))]
+    return [SceneNode('Scene', np.identity(4, dtype=np.float32), children)]
+
+def Tiles(faces: int, meshes: int) -> (int, int):
+    #Tiles per side and quads per tile side for about faces triangles spread over about meshes tiles
+    tiles = max(1, int(round(np.sqrt(meshes))))
+    quads = max(1, int(round(np.sqrt(faces / 2) / tiles)))
+    return tiles, quads
+
+def Terrain(x, z):
+    return 50 * np.sin(x / 70.0) * np.cos(z / 50.0)
+
+def TerrainTiles(faces: int, meshes: int) -> list[SceneNode]:
+    tiles, quads = Tiles(faces, meshes)
+    spacing = 10.0
+    children = []
+    for i in range(tiles * tiles):
+        tx, tz = i % tiles, i // tiles
+        geometry = Grid(quads, quads, tx * quads * spacing, tz * quads * spacing, spacing, Terrain)
+        children.append(SceneNode(f'Terrain{i}', np.identity(4, dtype=np.float32), geometry=geometry, material=MaterialName(i % 4, 0)))
+    return children
+
+def Heightfield(faces: int, meshes: int, objects: int) -> list[SceneNode]:
+    #Bumpy terrain cut into square tiles, one mesh per tile
+    return Root(TerrainTiles(faces, meshes))
+
+def StackedFloors(faces: int, meshes: int, objects: int) -> list[SceneNode]:
+    #Flat floors on top of each other, every floor covers the same XZ area so octree cells hold all of them
+    floors = max(1, meshes)
+    quads = max(1, int(round(np.sqrt(faces / 2 / floors))))
+    spacing = 2000.0 / quads
+    children = []
+    for i in range(floors):
+        geometry = Grid(quads, quads, 0.0, 0.0, spacing, lambda x, z: np.zeros_like(x))
+        children.append(SceneNode(f'Floor{i}', Translation(0.0, 300.0 * i, 0.0), geometry=geometry, material=MaterialName(i % 4, 1)))
+    return Root(children)
+
+def Triggers(faces: int, meshes: int, objects: int) -> list[SceneNode]:
+    #Terrain with box and sphere triggers scattered over it and a few moving platforms (MODELSPLIT_ models)
+    children = TerrainTiles(faces, meshes)
+    tiles, quads = Tiles(faces, meshes)
+    extent = tiles * quads * 10.0
+    rng = np.random.default_rng(0)
+
+    for i in range(objects):
+        matrix = Translation(*rng.uniform((0, 0, 0), (extent, 100, extent)))
+        matrix[:3, :3] *= rng.uniform(5, 50)
+        kind = 'MAPOBJ_SPHERE' if i % 2 else 'MAPOBJ_BOX'
+        children.append(SceneNode(f'{kind}_Trigger{i}', matrix, material=MaterialName(0, i % 8, [i, 0]), hasGeometry=True))
+
+    platform = Grid(4, 4, -20.0, -20.0, 10.0, lambda x, z: np.zeros_like(x))
+    for i in range(max(1, meshes // 4)):
+        children.append(SceneNode(f'MODELSPLIT_Platform{i}', Translation(*rng.uniform((0, 100, 0), (extent, 300, extent))), geometry=platform, material=MaterialName(1, 2)))
+    return Root(children)
+
+Scenes = {'heightfield': Heightfield, 'floors': StackedFloors, 'triggers': Triggers}
+
+def Measure(function, repeat: int, memory: bool) -> (float, int, object):
+    #Best seconds of repeat runs and, when memory is set, the peak traced allocation of one more run.
+    #Tracing slows allocations down, so it never runs during the timed ones.
+    seconds = None
+    for _ in range(repeat):
+        result = None
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    peak = None
+    if memory:
+        result = None
+        tracemalloc.start()
+        try:
+            with redirect_stdout(io.StringIO()):
+                result = function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak, result
+
+def ReadCsb(path: str) -> CsbFile.CsbFile:
+    csb = CsbFile.Open(path, False)
+    for model in csb.Models:
+        model.Geometry
+    return csb
+
+def WriteCsb(csb: CsbFile.CsbFile, path: str):
+    with open(path, 'wb') as file:
+        csb.WriteTo(file, False)
+
+def WriteCtb(csb: CsbFile.CsbFile, path: str, bottomUp: bool):
+    ctb = CtbFile()
+    ctb.Generate(csb, bottomUp=bottomUp)
+    with open(path, 'wb') as file:
+        file.write(ctb.Write(False) if ctb.Nodes else b'')
+
+def RunScene(scene: str, faces: int, options: dict, directory: str) -> list[dict]:
+    #Generates the scene and runs build, write, read, export, import and ctb on it in turn,
+    #every stage works on the output of the one before like a round trip through the tools would
+    base = os.path.join(directory, f'{scene}_{faces}')
+    memory = options['memory']
+    stages = []
+
+    def Stage(name: str, function, output: str = None):
+        seconds, peak, result = Measure(function, options['repeat'], memory)
+        stages.append({'stage': name, 'seconds': seconds, 'peak_bytes': peak, 'output_bytes': os.path.getsize(output) if output else None})
+        return result
+
+    nodes = Scenes[scene](faces, options['meshes'], options['objects'])
+    csb = Stage('build', lambda: BuildCsb(nodes))
+    del nodes
+    Stage('write', lambda: WriteCsb(csb, f'{base}.csb'), f'{base}.csb')
+    read = Stage('read', lambda: ReadCsb(f'{base}.csb'))
+    Stage('export', lambda: Export(read, f'{base}.dae'), f'{base}.dae')
+    del read
+    Stage('import', lambda: ImportFromDae(f'{base}.dae'))
+    Stage('ctb', lambda: WriteCtb(csb, f'{base}.ctb', options['grid']), f'{base}.ctb')
+
+    info = {
+        'scene': scene,
+        'faces': csb.Models[0].NumTriangles + sum(model.NumTriangles for model in csb.Models[1:]),
+        'meshes': len(csb.Models[0].Meshes),
+        'models': len(csb.Models),
+        'objects': len(csb.Objects),
+    }
+    return [dict(info, **stage) for stage in stages]
+
+def Compare(results: list[dict], previous: list[dict]):
+    #Time and memory ratios against an earlier run, matched by scene, requested size and stage
+    old = {(result['scene'], result['size'], result['stage']): result for result in previous}
+    print(f'{"scene":>12} {"faces":>9} {"stage":>7} {"before":>9} {"after":>9} {"speedup":>8} {"memory":>7}')
+    for result in results:
+        before = old.get((result['scene'], result['size'], result['stage']))
+        if before is None:
+            continue
+        memory = ''
+        if result['peak_bytes'] and before['peak_bytes']:
+            memory = f"{result['peak_bytes'] / before['peak_bytes']:>6.2f}x"
+        print(f"{result['scene']:>12} {result['faces']:>9} {result['stage']:>7} {before['seconds']:>8.3f}s {result['seconds']:>8.3f}s "
+              f"{before['seconds'] / max(result['seconds'], 1e-9):>7.2f}x {memory:>7}")
+
+def main():
+    def Value(flag: str, default: str) -> str:
+        return sys.argv[sys.argv.index(flag) + 1] if flag in sys.argv else default
+
+    options = {
+        'sizes': [int(size) for size in Value('-sizes', '1000,10000,100000,1000000').split(',')],
+        'scenes': Value('-scenes', ','.join(Scenes)).split(','),
+        'meshes': int(Value('-meshes', '16')),
+        'objects': int(Value('-objects', '256')),
+        'repeat': max(1, int(Value('-repeat', '1'))),
+        'grid': '-grid' in sys.argv,
+        'memory': not '-nomemory' in sys.argv,
+    }
+    output = Value('-out', 'pipeline_results.json')
+    for scene in options['scenes']:
+        if not scene in Scenes:
+            print(f'Unknown scene {scene}, use one of: {", ".join(Scenes)}')
+            return
+
+    keep = Value('-keep', None)
+    with tempfile.TemporaryDirectory() as directory:
+        if keep:
+            directory = keep
+            os.makedirs(directory, exist_ok=True)
+
+        results = []
+        print(f'{"scene":>12} {"faces":>9} {"stage":>7} {"time":>9} {"peak":>9} {"output":>9}')
+        for scene in options['scenes']:
+            for size in options['sizes']:
+                for result in RunScene(scene, size, options, directory):
+                    result['size'] = size
+                    results.append(result)
+                    peak = f"{result['peak_bytes'] / 2**20:.1f}MB" if result['peak_bytes'] is not None else '-'
+                    written = f"{result['output_bytes'] / 2**20:.1f}MB" if result['output_bytes'] is not None else '-'
+                    print(f"{scene:>12} {result['faces']:>9} {result['stage']:>7} {result['seconds']:>8.3f}s {peak:>9} {written:>9}")
+
+    run = {
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'options': options,
+        'results': results,
+    }
+    with open(output, 'w') as file:
+        json.dump(run, file, indent=2)
+    print(f'Results written to {output}')
+
+    previous = Value('-compare', None)
+    if previous:
+        with open(previous) as file:
+            Compare(results, json.load(file)['results'])
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,133 @@
 from sys import argv
+import os
 import CsbFile
-from CsbExporter import Export
+import Batch
+import CtbFile
+from OutputCache import OutputCache
 from CsbImporter import Import
+from OctreeTuning import TuneParameters
 
 def main():
     if (len(argv) == 1 or "-h" in argv):
         print("Usage:")
         print("    CollisionSceneBinaryCLI.exe file.csb (arguments)")
         print("    CollisionSceneBinaryCLI.exe file.dae (arguments)")
+        print("    CollisionSceneBinaryCLI.exe file.glb (arguments)")
+        print("    CollisionSceneBinaryCLI.exe folder \"pattern/**/*.csb\" ... (arguments)")
 
         print("Arguments:")
         print("    -big (big endian, needed for color splash)")
         print("    -mobj (create as map object)")
+        print("    -info (list the contents of .csb files without decoding geometry)")
+        print("    -exact (exact triangle/cell overlap test, smaller .ctb files)")
+        print("    -jobs N (build the octree with N processes, or process N files at once in batch mode)")
+        print("    -out DIR (batch mode, write the results to DIR instead of next to the inputs)")
+        print("    -summary FILE (batch mode, save the per-file timings, sizes and errors as JSON)")
+        print("    -grid (build the octree bottom-up from a cell grid, faster on large scenes)")
+        print("    -ctb (build a .ctb straight from a .csb, no .dae needed)")
+        print("    -maxtris N (triangles per octree node before it gets split, default 10)")
+        print("    -maxdepth N (deepest octree level, default 5)")
+        print("    -autotune (pick the octree settings per scene from a cost model instead of -maxtris/-maxdepth)")
+        print("    -ctbbudget KB (largest .ctb -autotune may pick)")
+        print("    -cache DIR (reuse the outputs of unchanged scenes from DIR)")
+        print("    -cachesize MB (size the cache is trimmed to, default 512)")
+        print("    -format dae|glb|ply (file type .csb files are exported to, default dae)")
+        print("    -weld TOL (merge vertices of a mesh closer than TOL when importing, 0 for exact duplicates)")
+        print("    -weldmodel (weld across the whole model too, so mesh seams meet exactly)")
+        print("    -cull (remove zero area and duplicate triangles when importing)")
+        print("    -cullnormals (also remove triangles whose normal is not unit length or faces against the winding)")
 
         return
     is_big_endian = "-big" in argv
     is_map_object = "-mobj" in argv
+    is_info = "-info" in argv
+    is_exact = "-exact" in argv
+    is_grid = "-grid" in argv
+    is_ctb = "-ctb" in argv
+    jobs = int(argv[argv.index("-jobs") + 1]) if "-jobs" in argv else 1
+    max_triangles = int(argv[argv.index("-maxtris") + 1]) if "-maxtris" in argv else 10
+    max_depth = int(argv[argv.index("-maxdepth") + 1]) if "-maxdepth" in argv else 5
+    auto_tune = "-autotune" in argv or "-ctbbudget" in argv
+    ctb_budget = int(float(argv[argv.index("-ctbbudget") + 1]) * 1024) if "-ctbbudget" in argv else None
+    output_dir = argv[argv.index("-out") + 1] if "-out" in argv else None
+    summary = argv[argv.index("-summary") + 1] if "-summary" in argv else None
+    cache_dir = argv[argv.index("-cache") + 1] if "-cache" in argv else None
+    cache_size = int(argv[argv.index("-cachesize") + 1]) if "-cachesize" in argv else 512
+    export_format = argv[argv.index("-format") + 1].lower() if "-format" in argv else "dae"
+    weld_combined = "-weldmodel" in argv
+    weld = float(argv[argv.index("-weld") + 1]) if "-weld" in argv else (0.0 if weld_combined else None)
+    cull_normals = "-cullnormals" in argv
+    cull = "-cull" in argv or cull_normals
     
-    for arg in argv[1:]:
-        if arg.endswith(".csb"): # export
-            print("Exporting CSB file!")
+    if not export_format in Batch.Exporters:
+        print(f"Unknown export format {export_format}, use one of: {', '.join(Batch.Exporters)}")
+        return
+    
+    value_flags = ("-jobs", "-maxtris", "-maxdepth", "-out", "-summary", "-cache", "-cachesize", "-format", "-weld", "-ctbbudget")
+    inputs = [arg for i, arg in enumerate(argv[1:], 1) if not arg.startswith("-") and not argv[i - 1] in value_flags]
+    files = Batch.CollectFiles(inputs)
+    
+    # batch mode: several files, folders or patterns go through a pool of -jobs processes
+    is_batch = len(files) > 1 or output_dir or summary or any(os.path.isdir(arg) or Batch.IsPattern(arg) for arg in inputs)
+    if is_batch and not is_info:
+        options = {
+            "big_endian": is_big_endian,
+            "map_object": is_map_object,
+            "exact": is_exact,
+            "grid": is_grid,
+            "ctb": is_ctb,
+            "max_triangles": max_triangles,
+            "max_depth": max_depth,
+            "auto_tune": auto_tune,
+            "ctb_budget": ctb_budget,
+            "cache": cache_dir,
+            "cache_size": cache_size,
+            "format": export_format,
+            "weld": weld,
+            "weld_combined": weld_combined,
+            "cull": cull,
+            "cull_normals": cull_normals,
+        }
+        Batch.RunBatch(files, options, jobs, output_dir, summary)
+        return
+    
+    cache = OutputCache(cache_dir, cache_size * 1024 * 1024) if cache_dir else None
+    
+    for arg, _ in files:
+        if arg.endswith(".csb") and is_info: # header scan only
+            with CsbFile.Open(arg, is_big_endian) as csb:
+                print(arg)
+                for model in csb.Models:
+                    print(f"    Model {model.Name} – {model.NumVertices} vertices, {model.NumTriangles} triangles")
+                for mesh in csb.Models[0].Meshes:
+                    print(f"    Mesh {mesh.Name} – {mesh.NumTriangles} triangles")
+                for obj in csb.Objects:
+                    print(f"    Object {obj.Name}")
+        elif arg.endswith(".csb") and is_ctb: # collision table only
+            print("Generating CTB file!")
             
-            csb = CsbFile.CsbFile(open(arg, "rb").read(), False)
-            output = arg[:-4] + ".dae"
+            with CsbFile.Open(arg, is_big_endian) as csb:
+                tris, depth = TuneParameters(csb, ctb_budget) if auto_tune else (max_triangles, max_depth)
+                data = CtbFile.GenerateBytes(csb, is_big_endian, is_exact, jobs, is_grid, tris, depth, cache)
+            if not data:
+                print("No triangles, skipping")
+                continue
+            
+            with open(arg[:-4] + "_output.ctb", "wb") as file:
+                file.write(data)
+        elif arg.endswith(".csb"): # export
+            print("Exporting CSB file!")
             
-            Export(csb, output)
+            output = arg[:-4] + "." + export_format
+            with CsbFile.Open(arg, False) as csb:
+                Batch.Exporters[export_format](csb, output)
             #with open(output, "w") as file:
             #    file.write("")
-        elif arg.endswith(".dae"): # import and create
+        elif arg.endswith((".dae", ".glb")): # import and create
             print("Generating CSB and CTB files!")
             
             output = arg[:-4]
-            Import(arg, output, is_big_endian, is_map_object)
+            Import(arg, output, is_big_endian, is_map_object, is_exact, jobs, is_grid, max_triangles, max_depth, cache, weld, weld_combined, cull, cull_normals, auto_tune, ctb_budget)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
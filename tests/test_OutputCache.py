@@ -0,0 +1,35 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CtbFile import CacheParameters
+from Geometry import Geometry
+from OutputCache import OutputCache
+from SceneBuilder import SceneNode, BuildCsb, MaterialName
+import numpy as np
+import pytest
+
+def Scene():
+    #Two quad meshes under one root, built like an imported .dae
+    quad = Geometry([(0, 0, 0), (10, 0, 0), (0, 0, 10), (10, 0, 10)], [(0, 2, 1), (1, 2, 3)])
+    meshes = [SceneNode(f'Mesh{i}', np.identity(4, dtype=np.float32), geometry=quad, material=MaterialName(1, 0)) for i in range(2)]
+    return BuildCsb([SceneNode('Scene', np.identity(4, dtype=np.float32), meshes)])
+
+def Key(csb) -> str:
+    return OutputCache.Key(csb, CacheParameters(False, 10, 5), False)
+
+def test_same_scene_same_key():
+    assert Key(Scene()) == Key(Scene())
+
+@pytest.mark.parametrize('field, value', [
+    ('ColFlag', 6),
+    ('MaterialAttribute', 2),
+    ('Name', 'Renamed'),
+    ('NodeIndex', 5),
+])
+def test_mesh_metadata_changes_key(field, value):
+    #the faces stay the same, only what the .csb writes for the mesh changes
+    csb = Scene()
+    before = Key(csb)
+    setattr(csb.Models[0].Meshes[1], field, value)
+    assert Key(csb) != before